@@ -3,12 +3,14 @@
 # Simulate the GANDALF model of turn taking for the machine
 #
 
-from sim.sim import Simulator, timems
+from sim.aio import Session, runWithGui
+from sim.sim import Simulator
+from sim.util import wallclock
 from tt.FSM import FSM, FSMNode
-from tt.sim_adapter import SimFeatureAdapter
+from tt.fsm_compiler import expression
 import tt.fsm_adapter
-import time
-import signal, threading
+import sim.trace as trace
+import asyncio
 
 DEBUG = False
 voice_activity = 0
@@ -22,112 +24,119 @@ otherpresenting = 7
 who_talking = 8
 running_action = 9
 
-lastactivitystamp = timems()
-
-actionqueued = False
-
-
-def observation_transformer(observations_in):
-    """
-    This takes the simulators actions and feeds them into the model we specify below
-    """
-    global lastactivitystamp, actionqueued
-    (utterancefeatures, gazefeatures, posfeatures, turnfeatures, scenefeatures) = \
-        observations_in
-    chosenpartner = 0
-    newObservation = []
-    print("Turn features: " + str(turnfeatures))
-    # voice activity
-    newObservation.append(turnfeatures[0])
-    if turnfeatures[0]:
-        lastactivitystamp = timems()
-    # action_queued
-    newObservation.append(actionqueued)  # TODO
-    # utterance_complete
-    newObservation.append(not utterancefeatures[1])
-    # otherlookatme
-    newObservation.append(gazefeatures[chosenpartner] == 0)
-    # otherpresenting
-    newObservation.append(scenefeatures[chosenpartner])
-    # who_talking
-    newObservation.append(turnfeatures[0])
-    # running_action
-    newObservation.append(0)
-    # wants_turn
-    newObservation.append(turnfeatures[0] or scenefeatures[chosenpartner])
-    # otheraccept
-    newObservation.append(gazefeatures[chosenpartner] == 0 and scenefeatures[chosenpartner])
-    # timesincelastactivity
-    newObservation.append(timems() - lastactivitystamp)
-
-    # print("Observation transformer output: " + str(newObservation))
-    return newObservation
+class ObservationTransformer:
+    """
+    This takes the simulators actions and feeds them into the model we specify below. It keeps
+    the time of the last voice activity it saw, read from clock, so every session needs its own.
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else wallclock
+        self.lastactivitystamp = self.clock.now()
+
+    def onskip(self, observations_in):
+        """
+        What a call does to the transformer's state on a tick where nothing else changed
+        (see tt.change_driven.stateful)
+        """
+        if observations_in[3][0]:
+            self.lastactivitystamp = self.clock.now()
+
+    def __call__(self, observations_in):
+        (utterancefeatures, gazefeatures, posfeatures, turnfeatures, scenefeatures) = \
+            observations_in
+        chosenpartner = 0
+        newObservation = []
+        if trace.LEVEL >= trace.DEBUG:
+            trace.emit(trace.FEATURES, utterancefeatures[1], turnfeatures[0])
+        # voice activity
+        newObservation.append(turnfeatures[0])
+        if turnfeatures[0]:
+            self.lastactivitystamp = self.clock.now()
+        # action_queued, Model.update fills in its own
+        newObservation.append(False)
+        # utterance_complete
+        newObservation.append(not utterancefeatures[1])
+        # otherlookatme
+        newObservation.append(gazefeatures[chosenpartner] == 0)
+        # otherpresenting
+        newObservation.append(scenefeatures[chosenpartner])
+        # who_talking
+        newObservation.append(turnfeatures[0])
+        # running_action
+        newObservation.append(0)
+        # wants_turn
+        newObservation.append(turnfeatures[0] or scenefeatures[chosenpartner])
+        # otheraccept
+        newObservation.append(gazefeatures[chosenpartner] == 0 and scenefeatures[chosenpartner])
+        # timesincelastactivity
+        newObservation.append(self.clock.now() - self.lastactivitystamp)
+
+        # print("Observation transformer output: " + str(newObservation))
+        return newObservation
+
+
+def transformer_for(newclock):
+    """
+    A new observation transformer, reading time from newclock. Used by the batch runner.
+    """
+    return ObservationTransformer(newclock)
 
 
 ######################################################
 ## State transition callbacks below
 ######################################################
-def ihave_igive(observations):
+@expression("not o[voice_activity] and not o[action_queued] and o[wants_turn]")
+def ihave_igive(o):
     """
     Function that is called from ihave state to igive state
     """
-    if (not observations[voice_activity] and not observations[action_queued] \
-            and observations[wants_turn]):
-        return True
-    return False
 
 
-def igive_ihave(observations):
+@expression("not o[otheraccept]")
+def igive_ihave(o):
     """
     Function that is called from igive state to ihave state
     """
-    if not observations[otheraccept]:
-        return True
-    return False
 
 
-def igive_otherhas(observations):
+@expression("o[otheraccept] and o[wants_turn] and o[otherlookatme] and o[action_queued]")
+def igive_otherhas(o):
     """
     Function that is called from igive state to otherhas state
     """
-    if observations[otheraccept] and observations[wants_turn] and observations[otherlookatme] and observations[action_queued]:
-        return True
-    return False
 
 
-def otherhas_itake(observations):
+@expression("(o[timesincelastactivity] > 50 and not o[otherpresenting])"
+            " or (o[timesincelastactivity] > 70 and o[utterance_complete])"
+            " or o[timesincelastactivity] > 120", time=(timesincelastactivity,))
+def otherhas_itake(o):
     """
     Function that is called from otherhas state to itake state
     """
-    if (observations[timesincelastactivity] > 50 and observations[giving_turn]) or (observations[timesincelastactivity] > 70 and observations[utterance_complete]) or (observations[timesincelastactivity] > 120):
-        return True
-    return False
 
 
-def itake_otherhas(observations):
+@expression("o[timesincelastactivity] > 170 and o[voice_activity]", time=(timesincelastactivity,))
+def itake_otherhas(o):
     """
     Function that is called from itake state to otherhas state
     """
-    if observations[timesincelastactivity] > 170 and observations[voice_activity]:
-        return True
-    return False
 
 
-def itake_ihave(observations):
+@expression("o[otherlookatme] and not o[otherpresenting] and not o[wants_turn]")
+def itake_ihave(o):
     """
     Function that is called from itake state to ihave state
     """
-    if observations[otherlookatme] and not observations[otherpresenting] and not observations[wants_turn]:
-        return True
-    return False
 
 
 class Model(FSM):
     """
     GANDALF finite state machine
     """
-    def __init__(self):
+    def __init__(self, clock=None):
         FSM.__init__(self, self.createTree())
+        self.clock = clock if clock is not None else wallclock
         self.actionqueued = False
         self.actionrunning = False
 
@@ -163,14 +172,17 @@ class Model(FSM):
         self.actionqueued = True
         print("Queuing action")
 
+    # the simulator calls the snake_case name
+    queue_action = queueAction
+
     def update(self, observations):
         """
         Update function
         """
-        global DEBUG, lastactivitystamp
+        global DEBUG
         observations[tt.fsm_adapter.f_action_queued] = self.actionqueued  # TODO
         observations[tt.fsm_adapter.f_running_action] = self.actionrunning  # TODO
-        # observations[tt.fsm_adapter.timesincelastactivity] = timems()-lastactivitystamp
+        # observations[tt.fsm_adapter.timesincelastactivity] = clock.now()-lastactivitystamp
         FSM.update(self, observations)
         if DEBUG:
             print("Current state : " + self.cur_state.name)
@@ -181,7 +193,7 @@ class Model(FSM):
         Yay I can take my turn, trigger my action and utterance
         """
         global DEBUG
-        self.action_started_at = timems()
+        self.action_started_at = self.clock.now()
         if DEBUG:
             print("Starting my turn")
         # self.agent.queuedAction = False
@@ -199,45 +211,12 @@ class Model(FSM):
 
 
 if __name__ == "__main__":
-    adapter = SimFeatureAdapter()
     agent_estimate = Model()
     simulator = Simulator(agent_estimate, 4)
 
     simulator.circle.makeRobotLookAtPerson(0)
 
-
-    def signal_handler(sig, frame):
-        print('You pressed Ctrl+C!')
-        simulator.running = False
-        simulator.quit()
-
-
-    signal.signal(signal.SIGINT, signal_handler)
-
-
-    def my_callback():
-        time.sleep(0.05)
-        while simulator.running:
-            fts = simulator.getFeatures()
-            fts_trans = observation_transformer(fts)
-            observations = agent_estimate.update(fts_trans)
-            # print(str(observations))
-            simulator.vis_features(observations, agent_estimate.cur_state)
-
-            simulator.circle.robot.queuedAction = agent_estimate.actionqueued
-            if agent_estimate.actionrunning and timems() - agent_estimate.action_started_at > 2000:
-                agent_estimate.actionrunning = False
-
-            simulator.circle.makeRobotLookAtPerson(simulator.circle.turnstate.whospeaking)
-            # print("Current state: " + str(agent_estimate.cur_state.name))
-            time.sleep(0.05)
-
-
-    thr = threading.Thread(target=my_callback)
-    thr.start()
-    simulator.start()
-    simulator.startVis()
+    # the sim, the model and the window all run on one asyncio loop
+    session = Session(simulator, agent_estimate, ObservationTransformer())
     print("Started simulator")
-    time.sleep(1)
-
-    simulator.join()
+    asyncio.run(runWithGui(session))
@@ -3,129 +3,68 @@
 # Simulate a hypothetical multi-party GANDALF model of turn taking for the machine
 #
 
+from sim.aio import Session, runWithGui
 from sim.sim import Simulator, ModelInterface
 from tt.FSM import FSM, FSMNode
+from tt.fsm_compiler import expression
 from tt.sim_adapter import SimFeatureAdapter
 import tt.fsm_adapter
-from sim.util import timems
-import time, signal
-import threading
+from sim.util import wallclock
+import asyncio
 
 DEBUG = False
 
 
-def ihave_igive(observations):
+@expression("o[tt.fsm_adapter.f_action_queued] == 0 and not o[tt.fsm_adapter.f_running_action]")
+def ihave_igive(o):
     """
-    Function that is called from ihave state to igive state
+    Function that is called from ihave state to igive state: no action is queued and nothing
+    is running
     """
-    global DEBUG
-    if DEBUG:
-        print("Ihave->Igive :->:")
-    if observations[tt.fsm_adapter.f_action_queued] == 0:
-        if DEBUG:
-            print("   -> An action is queued...")
-        if not observations[tt.fsm_adapter.f_running_action]:
-            if DEBUG:
-                print("   -> And nothing is running.. transitioning!")
-            return True
-    return False
 
 
-def igive_ihave(observations):
+@expression("o[tt.fsm_adapter.f_other_accepts] == 0 and o[tt.fsm_adapter.f_action_queued]")
+def igive_ihave(o):
     """
-    Function that is called from igive state to ihave state
+    Function that is called from igive state to ihave state: they didn't accept the turn and I
+    have an action ready
     """
-    global DEBUG
-    if DEBUG:
-        print("Igive->Ihave :->:")
-    if observations[tt.fsm_adapter.f_other_accepts] == 0:
-        if DEBUG:
-            print("   -> they didn't accept the turn")
-        if observations[tt.fsm_adapter.f_action_queued]:
-            if DEBUG:
-                print("   -> I have an action ready")
-            return True
-    return False
 
 
-def igive_otherhas(observations):
+@expression("o[tt.fsm_adapter.f_wants_turn] or o[tt.fsm_adapter.f_voice_activity]")
+def igive_otherhas(o):
     """
-    Function that is called from igive state to otherhas state
+    Function that is called from igive state to otherhas state: someone wants the turn, or
+    someone is talking
     """
-    global DEBUG
-    if DEBUG:
-        print("Igive->Theyhave :->:")
-    if observations[tt.fsm_adapter.f_wants_turn]:
-        if DEBUG:
-            print("   -> Someone wants the turn")
-        return True
-    if observations[tt.fsm_adapter.f_voice_activity]:
-        if DEBUG:
-            print("   -> Someone is talking")
-        return True
-    return False
 
 
-def otherhas_itake(observations):
+@expression("(o[tt.fsm_adapter.timesincelastactivity] > 50 and not o[tt.fsm_adapter.f_other_presenting])"
+            " or (o[tt.fsm_adapter.timesincelastactivity] > 70 and o[tt.fsm_adapter.f_utterance_complete])"
+            " or o[tt.fsm_adapter.timesincelastactivity] > 120",
+            time=(tt.fsm_adapter.timesincelastactivity,))
+def otherhas_itake(o):
     """
-    Function that is called from otherhas state to itake state
+    Function that is called from otherhas state to itake state: nobody is gesturing after 50 ms,
+    nobody is talking after 70 ms, or it's been 120 ms
     """
-    global DEBUG
-    if DEBUG:
-        print("Theyhave->Itake :->:")
-    if observations[tt.fsm_adapter.timesincelastactivity] > 50 and not observations[tt.fsm_adapter.f_other_presenting]:
-        if DEBUG:
-            print("   -> Nobody is gesturing after 50 ms")
-        return True
-    if observations[tt.fsm_adapter.timesincelastactivity] > 70 and observations[tt.fsm_adapter.f_utterance_complete]:
-        if DEBUG:
-            print("   -> Nobody is talking after 70 ms")
-        return True
-    if observations[tt.fsm_adapter.timesincelastactivity] > 120:
-        if DEBUG:
-            print("   -> It's been 120ms")
-        return True
-    return False
 
 
-def itake_otherhas(observations):
+@expression("(o[tt.fsm_adapter.timesincelastactivity] > 170 and o[tt.fsm_adapter.f_voice_activity])"
+            " or o[tt.fsm_adapter.f_voice_activity]",
+            time=(tt.fsm_adapter.timesincelastactivity,))
+def itake_otherhas(o):
     """
-    Function that is called from itake state to otherhas state
+    Function that is called from itake state to otherhas state: they started talking
     """
-    global DEBUG
-    if DEBUG:
-        print("Itake->Theyhave :->:")
-    if observations[tt.fsm_adapter.timesincelastactivity] > 170:
-        if DEBUG:
-            print("   -> They haven't talked in 170ms")
-        if observations[tt.fsm_adapter.f_voice_activity]:
-            if DEBUG:
-                print("   -> They started talking")
-            return True
-    if observations[tt.fsm_adapter.f_voice_activity]:
-        if DEBUG:
-            print("   -> They started talking")
-        return True
-    return False
 
 
-def itake_ihave(observations):
+@expression("o[tt.fsm_adapter.f_action_queued] == 1 and o[tt.fsm_adapter.f_other_lookat]")
+def itake_ihave(o):
     """
-    Function that is called from itake state to ihave state
+    Function that is called from itake state to ihave state: I have an action waiting and
+    someone is looking at me
     """
-    global DEBUG
-    if DEBUG:
-        print("Itake->Ihave :->:")
-        print("Action queued? : " + str(tt.fsm_adapter.f_action_queued))
-
-    if observations[tt.fsm_adapter.f_action_queued] == 1:
-        if DEBUG:
-            print("   -> I have an action waiting")
-        if observations[tt.fsm_adapter.f_other_lookat]:
-            if DEBUG:
-                print("   -> Someone is looking at me")
-            return True
-    return False
 
 
 class Model(FSM):
@@ -133,14 +72,15 @@ class Model(FSM):
     Multi-party (MP)GANDALF finite state machine
     """
 
-    def __init__(self):
+    def __init__(self, clock=None):
         FSM.__init__(self, self.createTree())
+        self.clock = clock if clock is not None else wallclock
         self.isSpeaking = False
-        self.action_started_at = timems()
+        self.action_started_at = self.clock.now()
         self.agent = None
         self.actionqueued = False
         self.actionrunning = False
-        self.lastactivitystamp = timems()
+        self.lastactivitystamp = self.clock.now()
 
     def createTree(self):
         """
@@ -181,7 +121,7 @@ class Model(FSM):
         global DEBUG
         observations[tt.fsm_adapter.f_action_queued] = self.actionqueued  # TODO
         observations[tt.fsm_adapter.f_running_action] = self.actionrunning  # TODO
-        observations[tt.fsm_adapter.timesincelastactivity] = timems() - self.lastactivitystamp
+        observations[tt.fsm_adapter.timesincelastactivity] = self.clock.now() - self.lastactivitystamp
         FSM.update(self, observations)
         if DEBUG:
             print("Current state : " + self.cur_state.name)
@@ -192,7 +132,7 @@ class Model(FSM):
         Yay I can take my turn, trigger my action and utterance
         """
         global DEBUG
-        self.action_started_at = timems()
+        self.action_started_at = self.clock.now()
         if DEBUG:
             print("Starting my turn")
         # self.agent.queuedAction = False
@@ -216,39 +156,7 @@ if __name__ == "__main__":
 
     simulator.circle.makeRobotLookAtPerson(0)
 
-
-    def signal_handler(sig, frame):
-        print('You pressed Ctrl+C!')
-        simulator.running = False
-        simulator.quit()
-
-
-    signal.signal(signal.SIGINT, signal_handler)
-
-
-    def my_callback():
-        time.sleep(0.05)
-        while simulator.running:
-            fts = simulator.getFeatures()
-            fts_trans = adapter.transform_features(fts)
-            observations = agent_estimate.update(fts_trans)
-            # print(str(observations))
-            simulator.vis_features(observations, agent_estimate.cur_state)
-
-            simulator.circle.robot.queuedAction = agent_estimate.actionqueued
-            if agent_estimate.actionrunning and timems() - agent_estimate.action_started_at > 2000:
-                agent_estimate.actionrunning = False
-
-            simulator.circle.makeRobotLookAtPerson(simulator.circle.turnstate.whospeaking)
-            # print("Current state: " + str(agent_estimate.cur_state.name))
-            time.sleep(0.05)
-
-
-    thr = threading.Thread(target=my_callback)
-    thr.start()
-    simulator.start()
-    simulator.startVis()
+    # the sim, the model and the window all run on one asyncio loop
+    session = Session(simulator, agent_estimate, adapter.transform_features)
     print("Started simulator")
-    time.sleep(1)
-
-    simulator.join()
+    asyncio.run(runWithGui(session))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Compare the FSM interpreter with the compiled transition table (tt.fsm_compiler) on the
+# observations of a headless episode
+#
+#   python -m bench.fsm --duration 600000
+#
+
+import argparse
+import contextlib
+import os
+import time
+
+from sim.runner import sim_adapter_for
+from sim.sim import Simulator
+from sim.util import SimClock
+from tt.FSM import FSM
+from tt.fsm_compiler import compileFSM
+import GANDALF
+import MP_GANDALF
+
+MODELS = [("MP_GANDALF", MP_GANDALF.Model, sim_adapter_for),
+          ("GANDALF", GANDALF.Model, GANDALF.transformer_for)]
+
+
+def episode_observations(model_cls, adapter_for, npeople, duration_ms, seed, action_interval_ms):
+    """
+    Every observation vector a model gets during one headless episode, as it was fed to FSM.update
+    """
+    clock = SimClock()
+    model = model_cls(clock)
+    simulator = Simulator(model, npeople, headless=True, clock=clock, seed=seed)
+    transform = adapter_for(clock)
+    observations = []
+    next_action = action_interval_ms
+    while clock.now() < duration_ms:
+        features = simulator.step()
+        observations.append(list(model.update(transform(features))))
+        if clock.now() >= next_action:
+            model.queue_action()
+            next_action += action_interval_ms
+        if model.actionrunning and clock.now() - model.action_started_at > 2000:
+            model.actionrunning = False
+        clock.sleep(simulator.tick_ms)
+    return observations
+
+
+def measure_updates(model, observations):
+    """
+    Run FSM.update over all the observations. Returns (microseconds per update, visited states)
+    """
+    states = []
+    t_start = time.perf_counter()
+    for observation in observations:
+        states.append(FSM.update(model, observation))
+    t_total = time.perf_counter() - t_start
+    return (t_total / len(observations) * 1e6, states)
+
+
+def measure_steps(table, observations):
+    """
+    Microseconds per step of the bare table, no callbacks and no FSM.update around it
+    """
+    steps = table.steps
+    i = 0
+    t_start = time.perf_counter()
+    for observation in observations:
+        i = steps[i](observation)
+    return (time.perf_counter() - t_start) / len(observations) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FSM interpreter vs compiled transition table")
+    parser.add_argument("--npeople", type=int, default=4)
+    parser.add_argument("--duration", type=int, default=600000, help="episode length in simulated ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--action-interval", type=int, default=3000)
+    args = parser.parse_args()
+
+    for (name, model_cls, adapter_for) in MODELS:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            observations = episode_observations(model_cls, adapter_for, args.npeople, args.duration,
+                                                args.seed, args.action_interval)
+            (t_interp, interp_states) = measure_updates(model_cls(SimClock()), observations)
+            compiled = model_cls(SimClock())
+            table = compileFSM(compiled)
+            (t_compiled, compiled_states) = measure_updates(compiled, observations)
+            t_steps = measure_steps(table, observations)
+
+        if [s.name for s in interp_states] != [s.name for s in compiled_states]:
+            raise AssertionError("%s: the compiled table took a different path than the interpreter" % name)
+        print("%-10s %d updates, %d/%d predicates inlined: interpreter %.3f us, compiled %.3f us (%.1fx),"
+              " bare table step %.3f us"
+              % (name, len(observations), table.inlined, sum(map(len, table.predicates)),
+                 t_interp, t_compiled, t_interp / t_compiled, t_steps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+#
+# Check that the fast paths still give the results of the plain scalar code they replace.
+# Exits 1 on the first mismatch, so it can guard a change the way bench.fsm guards the
+# compiled transition table:
+#
+#   python -m bench.parity
+#   python -m bench.parity --seeds 50 --duration 600000 events
+#
+
+import argparse
+import ast
+import contextlib
+import math
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from sim.batch import BatchScene
+from sim.events import EventScheduler
+from sim.sim import Simulator, ModelInterface, Character, GazeState, angleTable, computeTheta
+from sim.util import SimClock
+from sim.features import FeatureRecord
+from sim.recorder import Recording
+from sim.runner import run_episode
+from tt.FSM import FSM
+from tt.batch_fsm import BatchFSM, vectorizedPredicate
+from tt.fsm_compiler import TransitionTable, foldedExpression
+from tt.replay import replay
+from tt.sim_adapter import SimFeatureAdapter
+from bench.fsm import MODELS, episode_observations
+
+
+def sceneState(simulator):
+    """
+    Everything a scene carries from one tick to the next
+    """
+    scene = simulator.circle
+    bubbler = scene.bubbler
+    turnstate = scene.turnstate
+    return {"t": simulator.clock.now(),
+            "whospeaking": turnstate.whospeaking,
+            "turn stamp": turnstate.lastStamp,
+            "cadence": turnstate.cadence,
+            "turns": scene.turns,
+            "trying footing": scene.tryingfooting,
+            "utterance": (bubbler.utterance, bubbler.lastStamp, bubbler.forhowlong, bubbler.includespronoun),
+            "gesturing": [c.isGesturing for c in scene.people + [scene.robot]],
+            "theta": [c.theta for c in scene.people + [scene.robot]],
+            "lookat": scene.gazestate.lookat.tolist(),
+            "random state": scene.rng.getstate()}
+
+
+def checkEvents(seeds, npeople, duration_ms):
+    """
+    EventScheduler against stepping every tick: the features of every tick the scheduler runs,
+    and the whole scene state at the end, are the same
+    """
+    for seed in seeds:
+        dense = Simulator(ModelInterface(), npeople, headless=True, clock=SimClock(), seed=seed)
+        features = {}
+        while dense.clock.now() < duration_ms:
+            t = dense.clock.now()
+            features[t] = dense.step().copy()
+            dense.clock.sleep(dense.tick_ms)
+
+        sparse = Simulator(ModelInterface(), npeople, headless=True, clock=SimClock(), seed=seed)
+        scheduler = EventScheduler(sparse)
+
+        def compare(record):
+            t = sparse.clock.now() - sparse.tick_ms
+            if not np.array_equal(record.buffer, features[t].buffer):
+                raise AssertionError("events, seed %d: the features at %d ms differ from stepping every tick"
+                                     % (seed, t))
+
+        scheduler.runUntil(duration_ms, on_tick=compare)
+        (expected, got) = (sceneState(dense), sceneState(sparse))
+        for key in expected:
+            if expected[key] != got[key]:
+                raise AssertionError("events, seed %d: %s differs after %d ms" % (seed, key, duration_ms))
+    return "%d seeds x %d ms" % (len(seeds), duration_ms)
+
+
+def computeLookat(scene, lookat):
+    """
+    GazeState.setGazeState before the angle table: computeTheta to whoever each person should
+    look at, lookat being where they looked before (None if nowhere yet)
+    """
+    people = scene.people
+    who = scene.turnstate.whospeaking
+    out = []
+    for (i, person) in enumerate(people):
+        target = people[who % len(people)].getPos()
+        if who == -1:
+            target = scene.robot.getPos()
+        elif i == who:
+            if lookat[i] is not None:
+                out.append(lookat[i])
+                continue
+            target = scene.robot.getPos() if len(people) == 1 else people[(who + 1) % len(people)].getPos()
+        out.append(computeTheta(person.getPos(), target))
+    return out
+
+
+def computeGazeFeatures(scene, lookat):
+    """
+    The three point gaze features one person at a time, before threePointFeatures
+    """
+    out = []
+    for (person, look) in zip(scene.people, lookat):
+        th = computeTheta(person.getPos(), scene.robot.getPos())
+        dtheta = th - look
+        x_z3 = (look + (2 * math.pi)) % (2 * math.pi)
+        y_z3 = (th + (2 * math.pi)) % (2 * math.pi)
+        if abs(dtheta) < math.radians(30) and abs(y_z3 - x_z3) < math.pi:
+            dtheta = x_z3 - y_z3
+            out.append(-1 if dtheta < -math.radians(30) else 1 if dtheta > math.radians(30) else 0)
+        else:
+            out.append(-2)
+    return out
+
+
+def checkAngles(seeds, npeople, duration_ms):
+    """
+    Scene's angle table, gaze targets and gaze features against computing every angle with
+    computeTheta when it's needed, the way the scene did before the table
+    """
+    for seed in seeds:
+        simulator = Simulator(ModelInterface(), npeople, headless=True, clock=SimClock(), seed=seed)
+        scene = simulator.circle
+        chars = scene.people + [scene.robot]
+        expected = [[computeTheta(a.getPos(), b.getPos()) for b in chars] for a in chars]
+        if scene.angles.tolist() != expected:
+            raise AssertionError("angles, seed %d: the table differs from computeTheta" % seed)
+        for who in range(-2, npeople):
+            scene.makeRobotLookAtPerson(who)
+            person = scene.people[who % npeople]
+            if scene.robot.desired_theta != computeTheta(scene.robot.getPos(), person.getPos()):
+                raise AssertionError("angles, seed %d: the robot looks the wrong way for person %d" % (seed, who))
+
+        lookat = computeLookat(scene, [None] * npeople)
+        turns = scene.turns
+        while simulator.clock.now() < duration_ms:
+            simulator.step()
+            if scene.turns != turns:
+                lookat = computeLookat(scene, lookat)
+                turns = scene.turns
+            where = "angles, seed %d at %d ms" % (seed, simulator.clock.now())
+            if scene.gazestate.lookat.tolist() != lookat:
+                raise AssertionError("%s: gaze targets differ from computeTheta" % where)
+            if scene.gazestate.getFeatures(scene.robot) != computeGazeFeatures(scene, lookat):
+                raise AssertionError("%s: gaze features differ from the per-person loop" % where)
+            simulator.clock.sleep(simulator.tick_ms)
+    return "%d seeds x %d ms" % (len(seeds), duration_ms)
+
+
+def checkBatchFSM(seeds, npeople, duration_ms, nagents=256, action_interval_ms=3000):
+    """
+    BatchFSM against one scalar FSM per agent. Every agent replays an episode's observations
+    from its own random offset, so the batch holds agents in every state at once. Also
+    BatchScene.getObservations against SimFeatureAdapter on the same scene state.
+    """
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        for (name, model_cls, adapter_for) in MODELS:
+            observations = episode_observations(model_cls, adapter_for, npeople, duration_ms, seed,
+                                                action_interval_ms)
+            matrix = np.array(observations, dtype=float)
+            models = [model_cls(SimClock()) for _ in range(nagents)]
+            bfsm = BatchFSM(model_cls(SimClock()))
+            current = bfsm.initial(nagents)
+            offsets = rng.integers(0, len(observations), nagents)
+            for tick in range(len(observations)):
+                rows = (offsets + tick) % len(observations)
+                current = bfsm.step(matrix[rows], current)
+                states = [FSM.update(model, observations[row]).name for (model, row) in zip(models, rows.tolist())]
+                if bfsm.names(current) != states:
+                    raise AssertionError("batch_fsm, %s seed %d: agents took a different path at tick %d"
+                                         % (name, seed, tick))
+
+        batch = BatchScene(64, npeople, seed=seed)
+        adapter = SimFeatureAdapter(batch.clock)
+        record = FeatureRecord(npeople)
+        for _ in range(duration_ms // batch.tick_ms):
+            batch.step()
+            gaze = batch.getGazeFeatures()
+            speaking = batch.isSpeaking()
+            observed = batch.getObservations()
+            for b in range(batch.nscenes):
+                record.utterance[:] = (batch.includespronoun[b], speaking[b])
+                record.gaze[:] = gaze[b]
+                record.turn[0] = batch.whospeaking[b]
+                record.scene[:] = batch.isGesturing[b, :-1]
+                if observed[b].tolist() != [float(o) for o in adapter.transform_features(record)]:
+                    raise AssertionError("batch_fsm, seed %d: getObservations differs from SimFeatureAdapter "
+                                         "for scene %d at %d ms" % (seed, b, batch.clock.now()))
+            batch.clock.sleep(batch.tick_ms)
+    return "%d seeds x %d agents x %d ms, %s" % (len(seeds), nagents, duration_ms,
+                                                  " and ".join(name for (name, _, _) in MODELS))
+
+
+def checkReplay(seeds, npeople, duration_ms, action_interval_ms=3000):
+    """
+    tt.replay against the live episode loop: replaying a recording through the model that made
+    it goes through the same states and hands the model the same observations on every tick
+    """
+    for seed in seeds:
+        for (name, model_cls, adapter_for) in MODELS:
+            with tempfile.TemporaryDirectory() as tmp:
+                run_episode(model_cls, npeople, duration_ms, seed, 0, adapter_for, action_interval_ms, tmp)
+                recording = Recording(os.path.join(tmp, "episode-0"))
+                # state indices as the recorder hands them out, in order of first appearance
+                stateindex = {}
+                states = []
+                observations = []
+
+                def collect(t, features, replayed):
+                    state = replayed[0].model.cur_state
+                    states.append(stateindex.setdefault(state, len(stateindex)))
+                    observations.append(replayed[0].observation)
+
+                replay(recording.path, [(model_cls, adapter_for)], on_tick=collect)
+                if len(states) != len(recording):
+                    raise AssertionError("replay, %s seed %d: replayed %d of %d ticks"
+                                         % (name, seed, len(states), len(recording)))
+                diverged = np.flatnonzero(np.array(states) != recording.state)
+                if len(diverged):
+                    raise AssertionError("replay, %s seed %d: the replayed state differs from the live one at %d ms"
+                                         % (name, seed, recording.t[diverged[0]]))
+                diverged = np.flatnonzero((np.array(observations, dtype=float) != recording.observations).any(axis=1))
+                if len(diverged):
+                    raise AssertionError("replay, %s seed %d: the replayed observation differs from the live one "
+                                         "at %d ms" % (name, seed, recording.t[diverged[0]]))
+    return "%d seeds x %d ms, %s" % (len(seeds), duration_ms, " and ".join(name for (name, _, _) in MODELS))
+
+
+# observation values to draw from: flags, who is talking, and times on both sides of every threshold
+OBSERVATION_VALUES = [-2, -1, 0, 1, 2, 3, 49, 50, 51, 69, 70, 71, 119, 120, 121, 169, 170, 171, 500]
+
+
+def checkPredicates(seeds, nrows=4096):
+    """
+    The three ways an @expression predicate gets evaluated give the same answers on random
+    observations: the predicate the interpreter calls, the folded expression the transition
+    table inlines and BatchFSM's numpy mask. Every table step also matches FSM.nextState.
+    """
+    npredicates = 0
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        for (name, model_cls, _) in MODELS:
+            model = model_cls(SimClock())
+            table = TransitionTable(model.all_states)
+            # wide enough for every o[k] the predicates read
+            width = 1 + max(node.slice.value for fns in table.predicates for fn in fns
+                            for node in ast.walk(foldedExpression(fn)) if isinstance(node, ast.Subscript))
+            O = rng.choice(OBSERVATION_VALUES, size=(nrows, width))
+            rows = O.tolist()
+            for (i, fns) in enumerate(table.predicates):
+                for fn in fns:
+                    folded = foldedExpression(fn)
+                    if folded is None:
+                        raise AssertionError("predicates, %s: %s can't be inlined" % (name, fn.__name__))
+                    inlined = eval("lambda o: bool(%s)" % ast.unparse(folded))
+                    mask = vectorizedPredicate(fn)(O).tolist()
+                    for (k, row) in enumerate(rows):
+                        if not fn(row) == inlined(row) == mask[k]:
+                            raise AssertionError("predicates, %s seed %d: %s disagrees on %s"
+                                                 % (name, seed, fn.__name__, row))
+                    npredicates += 1
+                node = table.states[i]
+                for row in rows:
+                    if table.states[table.step(i, row)] is not node.nextState(row):
+                        raise AssertionError("predicates, %s seed %d: the table leaves %s differently on %s"
+                                             % (name, seed, node.name, row))
+    return "%d seeds x %d observations, %d predicates" % (len(seeds), nrows, npredicates // len(seeds))
+
+
+def scalarTheta(theta, desired_theta):
+    """
+    Character.update from theta towards desired_theta
+    """
+    char = Character.__new__(Character)
+    (char.theta, char.desired_theta) = (theta, desired_theta)
+    char.update()
+    return char.theta
+
+
+def scalarLookat(angles, lookat, whospeaking):
+    """
+    Where GazeState.setGazeState has everyone look, on a scene with this angle table
+    """
+    gazestate = GazeState(len(lookat), None, None, angles)
+    gazestate.lookat[:] = lookat
+    turnstate = lambda: None
+    turnstate.whospeaking = whospeaking
+    gazestate.setGazeState(turnstate, None)
+    return gazestate.lookat
+
+
+def checkBatchRules(batch, scenes):
+    """
+    Step the batch once and check that, given the random outcomes it drew, every scene in
+    scenes followed the rules of TurnState, GazeState, Robot and Character
+    """
+    now = batch.clock.now()
+    before = {name: getattr(batch, name).copy() for name in
+              ("theta", "desired_theta", "isGesturing", "whospeaking", "turn_stamp", "cadence", "tryingfooting",
+               "lookat", "lookat_set", "utt_stamp", "utt_length", "queuedAction")}
+    batch.step()
+    ids = list(batch.ids)
+    for b in scenes:
+        where = "batch, scene %d at %d ms" % (b, now)
+        speaking = now - before["utt_stamp"][b] < before["utt_length"][b]
+        stamp = now if before["turn_stamp"][b] == -1 else before["turn_stamp"][b]
+        expired = not speaking and now - stamp > before["cadence"][b]
+        gesturing = before["isGesturing"][b]
+        lookat = np.where(before["lookat_set"][b], before["lookat"][b], np.nan)
+        robot_gesture = bool(gesturing[-1])
+        trying = bool(before["tryingfooting"][b])
+
+        if expired and gesturing.any():
+            # TurnState.__pickNext found someone, Scene.update resets footing and gaze
+            who = int(batch.whospeaking[b])
+            if not gesturing[ids.index(who)]:
+                raise AssertionError("%s: %d got the turn without gesturing" % (where, who))
+            if not 300 <= batch.cadence[b] <= 700:
+                raise AssertionError("%s: cadence %d out of range" % (where, batch.cadence[b]))
+            if list(batch.isGesturing[b]) != [i == who and bool(g) for (i, g) in zip(ids, gesturing)]:
+                raise AssertionError("%s: footing wasn't reset for everyone but the speaker" % where)
+            if batch.my_turn[b] != (who == -1):
+                raise AssertionError("%s: the robot's turn flag is wrong" % where)
+            if batch.tryingfooting[b] == trying:
+                raise AssertionError("%s: footing attempt didn't flip on a turn change" % where)
+            lookat = scalarLookat(batch.angles[b], lookat, who)
+            if batch.utt_stamp[b] != now or batch.utt_length[b] not in range(1000, 11000, 1000):
+                raise AssertionError("%s: no new utterance after the turn change" % where)
+        else:
+            if expired:
+                # nobody was gesturing, everyone tries again
+                tried = True
+                if batch.whospeaking[b] != -2:
+                    raise AssertionError("%s: nobody gesturing but %d got the turn" % (where, batch.whospeaking[b]))
+            else:
+                tried = not speaking and not trying
+                if batch.whospeaking[b] != before["whospeaking"][b] or batch.cadence[b] != before["cadence"][b]:
+                    raise AssertionError("%s: the turn changed before the cadence ran out" % where)
+                if batch.tryingfooting[b] != (trying or tried):
+                    raise AssertionError("%s: footing attempt flag is wrong" % where)
+            if tried:
+                robot_gesture = robot_gesture or bool(before["queuedAction"][b])
+            elif list(batch.isGesturing[b]) != list(gesturing):
+                raise AssertionError("%s: gestures changed without a footing attempt" % where)
+            if bool(batch.isGesturing[b, -1]) != robot_gesture:
+                raise AssertionError("%s: robot gesture doesn't follow Robot.try_footing" % where)
+            expected_stamp = now if speaking else stamp
+            if batch.turn_stamp[b] != expected_stamp:
+                raise AssertionError("%s: turn state stamp is %d, not %d" % (where, batch.turn_stamp[b], expected_stamp))
+
+        if not np.array_equal(np.where(batch.lookat_set[b], batch.lookat[b], np.nan), lookat, equal_nan=True):
+            raise AssertionError("%s: gaze targets differ from GazeState" % where)
+        desired = np.append(np.where(np.isnan(lookat), 0.0, lookat), before["desired_theta"][b, -1])
+        theta = [scalarTheta(t, d) for (t, d) in zip(before["theta"][b].tolist(), desired.tolist())]
+        if batch.theta[b].tolist() != theta:
+            raise AssertionError("%s: gaze smoothing differs from Character.update" % where)
+
+
+def checkBatch(seeds, npeople, duration_ms, nscenes=64, rate_scenes=128, rate_ms=30 * 60 * 1000, tolerance=0.03):
+    """
+    BatchScene against Scene. The batch draws from its own numpy stream, so scenes can't match
+    one to one. Instead every tick of every scene has to follow the scalar rules for the
+    random outcomes it drew, and the turn rate has to match the scalar scene's.
+    """
+    for seed in seeds:
+        batch = BatchScene(nscenes, npeople, seed=seed)
+        # the angle table comes out of the same formula as angleTable, numpy's arctan2 can be
+        # an ulp off math.atan2
+        for b in range(nscenes):
+            chars = [lambda: None for _ in range(npeople + 1)]
+            for (char, pos) in zip(chars, batch.pos[b].tolist()):
+                char.getPos = lambda pos=pos: pos
+            if not np.allclose(batch.angles[b], angleTable(chars), rtol=0, atol=1e-12):
+                raise AssertionError("batch, seed %d: scene %d's angle table differs from angleTable" % (seed, b))
+        # exercise the robot's footing too
+        batch.queuedAction[::2] = True
+        for _ in range(min(duration_ms, 120000) // batch.tick_ms):
+            checkBatchRules(batch, range(nscenes))
+            batch.clock.sleep(batch.tick_ms)
+
+    # turns per scene over enough scene-time that the noise is well under the tolerance. The
+    # scalar side skips the idle ticks with the EventScheduler
+    batch = BatchScene(rate_scenes, npeople, seed=0)
+    batch.run(rate_ms // batch.tick_ms)
+    batch_rate = batch.turns / rate_scenes
+    scalar_turns = 0
+    for scene in range(rate_scenes):
+        simulator = Simulator(ModelInterface(), npeople, headless=True, clock=SimClock(), seed=scene)
+        EventScheduler(simulator).runUntil(rate_ms)
+        scalar_turns += simulator.circle.turns
+    scalar_rate = scalar_turns / rate_scenes
+    if abs(batch_rate - scalar_rate) > tolerance * scalar_rate:
+        raise AssertionError("batch: %.1f turns per scene, the scalar scene makes %.1f" % (batch_rate, scalar_rate))
+    return "%d seeds x %d scenes follow the scalar rules, %.1f vs %.1f turns per scene in %d min" \
+        % (len(seeds), nscenes, batch_rate, scalar_rate, rate_ms // 60000)
+
+
+CHECKS = {"events": lambda args: checkEvents(range(args.seeds), args.npeople, args.duration),
+          "batch": lambda args: checkBatch(range(max(1, args.seeds // 10)), args.npeople, args.duration),
+          "angles": lambda args: checkAngles(range(args.seeds), args.npeople, args.duration),
+          "batch_fsm": lambda args: checkBatchFSM(range(max(1, args.seeds // 10)), args.npeople,
+                                                  min(args.duration, 60000)),
+          "predicates": lambda args: checkPredicates(range(max(1, args.seeds // 4))),
+          "replay": lambda args: checkReplay(range(max(1, args.seeds // 4)), args.npeople, args.duration)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast paths against the scalar code they replace")
+    parser.add_argument("checks", nargs="*", help="which of %s to run (all by default)" % ", ".join(CHECKS))
+    parser.add_argument("--npeople", type=int, default=4)
+    parser.add_argument("--seeds", type=int, default=20)
+    parser.add_argument("--duration", type=int, default=300000, help="episode length in simulated ms")
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error("unknown check %r" % name)
+
+    failed = False
+    for name in args.checks or CHECKS:
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                summary = CHECKS[name](args)
+        except AssertionError as e:
+            print("%-10s FAILED: %s" % (name, e))
+            failed = True
+        else:
+            print("%-10s ok (%s)" % (name, summary))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+#
+# Benchmark suite for the per-tick hot paths. Sweeps the number of people and the episode
+# length, times every component on every tick of a seeded headless episode, and writes the
+# results as JSON so two runs can be compared
+#
+#   python -m bench.suite --out before.json
+#   ... change things ...
+#   python -m bench.suite --out after.json --compare before.json
+#   python -m bench.suite --gui      (also the Kivy scene and TimelineViz.update, needs a display)
+#
+# Per benchmark and sweep point:
+#   us_per_tick / ticks_per_s   best of --repeat runs, with the timer overhead taken out
+#   alloc_bytes_per_tick        how far Python's traced memory rises inside the call, on
+#                               average (tracemalloc peak, so a lower bound on what it allocates)
+#   retained_bytes_per_tick     how much of that is still alive after the call
+#   texture_hits / _misses      with --gui, on the timeline.update row: lookups in the shared text
+#                               texture cache during one episode. Misses rasterize a new texture,
+#                               in steady state there should be none
+#
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench.ticks import measure_ticks
+from sim.features import FeatureRecord
+from sim.runner import episode_seed
+from sim.sim import Simulator
+from sim.util import SimClock
+from tt.sim_adapter import SimFeatureAdapter
+import GANDALF
+import MP_GANDALF
+
+BENCHES = ["simulator.step",
+           "scene.updateVis",
+           "simulator.getFeatures",
+           "gazestate.getFeatures",
+           "adapter.transform_features",
+           "MP_GANDALF.update",
+           "GANDALF.update",
+           "timeline.update"]
+
+
+class Probe:
+    """
+    Accumulates time (and, with allocations, traced memory) per benchmark over one episode
+    """
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.time_ns = dict.fromkeys(BENCHES, 0)
+        self.alloc = dict.fromkeys(BENCHES, 0)
+        self.retained = dict.fromkeys(BENCHES, 0)
+        self.calls = dict.fromkeys(BENCHES, 0)
+        # text texture cache hits and misses over the episode, with the gui
+        self.textures = None
+
+    def call(self, name, fn, *args):
+        if self.allocations:
+            tracemalloc.reset_peak()
+            (before, _) = tracemalloc.get_traced_memory()
+            result = fn(*args)
+            (after, peak) = tracemalloc.get_traced_memory()
+            self.alloc[name] += peak - before
+            self.retained[name] += after - before
+        else:
+            t_start = time.perf_counter_ns()
+            result = fn(*args)
+            self.time_ns[name] += time.perf_counter_ns() - t_start
+        self.calls[name] += 1
+        return result
+
+
+def probe_overhead_ns(ncalls=100000):
+    """
+    What Probe.call costs around a function that does nothing
+    """
+    probe = Probe()
+    noop = lambda: None
+    for _ in range(ncalls):
+        probe.call("simulator.step", noop)
+    return probe.time_ns["simulator.step"] / ncalls
+
+
+def run_episode(npeople, nticks, seed, gui=False, allocations=False, action_interval_ms=3000):
+    """
+    One seeded episode of nticks ticks with every component called (and probed) once per
+    tick, the way Simulator.step and the model loops call them. Returns the Probe.
+    """
+    probe = Probe(allocations)
+    if gui:
+        # kivy is only imported when we actually want a window
+        from sim.sim_vis import textures
+        before = textures.stats()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        clock = SimClock()
+        mp_model = MP_GANDALF.Model(clock)
+        gandalf = GANDALF.Model(clock)
+        simulator = Simulator(mp_model, npeople, headless=not gui, clock=clock, seed=episode_seed(seed, 0))
+        scene = simulator.circle
+        adapter = SimFeatureAdapter(clock)
+        gandalf_transform = GANDALF.transformer_for(clock)
+        next_action = action_interval_ms
+        # refilled every tick, the way step() reuses its ring
+        record = FeatureRecord(npeople)
+
+        for _ in range(nticks):
+            probe.call("scene.updateVis", scene.updateVis, simulator.visualizer)
+            features = probe.call("simulator.getFeatures", simulator.getFeatures, record)
+            probe.call("gazestate.getFeatures", scene.gazestate.getFeatures, scene.robot)
+            if gui:
+                probe.call("timeline.update", simulator.timeline.update, features)
+
+            observations = probe.call("adapter.transform_features", adapter.transform_features, features)
+            probe.call("MP_GANDALF.update", mp_model.update, observations)
+            probe.call("GANDALF.update", gandalf.update, gandalf_transform(features))
+
+            if clock.now() >= next_action:
+                mp_model.queue_action()
+                gandalf.queue_action()
+                next_action += action_interval_ms
+            for model in (mp_model, gandalf):
+                if model.actionrunning and clock.now() - model.action_started_at > 2000:
+                    model.actionrunning = False
+            scene.robot.queuedAction = mp_model.actionqueued
+            scene.makeRobotLookAtPerson(scene.turnstate.whospeaking)
+            clock.sleep(simulator.tick_ms)
+        if gui:
+            after = textures.stats()
+            probe.textures = {"hits": after["hits"] - before["hits"], "misses": after["misses"] - before["misses"]}
+
+        # the whole tick, as the runtime calls it
+        simulator = Simulator(mp_model, npeople, headless=not gui, clock=SimClock(), seed=episode_seed(seed, 0))
+        if allocations:
+            for _ in range(nticks):
+                probe.call("simulator.step", simulator.step)
+                simulator.clock.sleep(simulator.tick_ms)
+        else:
+            probe.time_ns["simulator.step"] = 1e9 * nticks / measure_ticks(simulator, nticks)
+            probe.calls["simulator.step"] = nticks
+    return probe
+
+
+def measure(npeople, nticks, seed, gui, repeat, allocations, overhead_ns):
+    """
+    Result rows of one sweep point
+    """
+    best = {}
+    for _ in range(repeat):
+        probe = run_episode(npeople, nticks, seed, gui)
+        texturestats = probe.textures
+        for (name, calls) in probe.calls.items():
+            if calls:
+                overhead = 0 if name == "simulator.step" else overhead_ns
+                ns = max(probe.time_ns[name] / calls - overhead, 1.0)
+                best[name] = min(best.get(name, ns), ns)
+
+    if allocations:
+        tracemalloc.start()
+        try:
+            probe = run_episode(npeople, nticks, seed, gui, allocations=True)
+        finally:
+            tracemalloc.stop()
+
+    rows = []
+    for name in BENCHES:
+        if name not in best:
+            continue
+        row = {"bench": name,
+               "mode": "gui" if gui else "headless",
+               "npeople": npeople,
+               "ticks": nticks,
+               "us_per_tick": best[name] / 1000.0,
+               "ticks_per_s": 1e9 / best[name]}
+        if allocations:
+            row["alloc_bytes_per_tick"] = probe.alloc[name] / probe.calls[name]
+            row["retained_bytes_per_tick"] = probe.retained[name] / probe.calls[name]
+        if name == "timeline.update" and texturestats is not None:
+            row["texture_hits"] = texturestats["hits"]
+            row["texture_misses"] = texturestats["misses"]
+        rows.append(row)
+    return rows
+
+
+def environment():
+    """
+    What the numbers were measured on
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "commit": commit,
+            "time": datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def key(row):
+    return (row["bench"], row["mode"], row["npeople"], row["ticks"])
+
+
+def compare(rows, baseline, threshold):
+    """
+    Print the current rows against a baseline run. Returns the rows that got slower by more than threshold
+    """
+    previous = {key(row): row for row in baseline["results"]}
+    regressions = []
+    print()
+    print("%-28s %-8s %7s %7s %10s %10s %7s" % ("vs baseline", "mode", "people", "ticks", "base us", "now us", "ratio"))
+    for row in rows:
+        base = previous.get(key(row))
+        if base is None:
+            continue
+        ratio = row["us_per_tick"] / base["us_per_tick"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(row)
+        print("%-28s %-8s %7d %7d %10.3f %10.3f %6.2fx%s" % (row["bench"], row["mode"], row["npeople"], row["ticks"],
+                                                           base["us_per_tick"], row["us_per_tick"], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-tick hot paths over a sweep of scene sizes")
+    parser.add_argument("--npeople", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--ticks", type=int, nargs="+", default=[1200, 6000],
+                        help="episode lengths in ticks (1200 ticks = 1 simulated minute)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="keep the best of this many runs")
+    parser.add_argument("--no-allocations", action="store_true", help="skip the (slow) tracemalloc pass")
+    parser.add_argument("--gui", action="store_true", help="also run with the Kivy scene and TimelineViz")
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, metavar="BASELINE",
+                        help="compare with an earlier --out file, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown that counts as a regression (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    if args.gui:
+        # keep kivy from eating our command line
+        os.environ.setdefault("KIVY_NO_ARGS", "1")
+
+    overhead_ns = probe_overhead_ns()
+    rows = []
+    print("%-28s %-8s %7s %7s %10s %12s %12s" % ("bench", "mode", "people", "ticks", "us/tick", "ticks/s", "alloc B/tick"))
+    for gui in ([False, True] if args.gui else [False]):
+        for npeople in args.npeople:
+            for nticks in args.ticks:
+                for row in measure(npeople, nticks, args.seed, gui, args.repeat, not args.no_allocations, overhead_ns):
+                    rows.append(row)
+                    alloc = "%.0f" % row["alloc_bytes_per_tick"] if "alloc_bytes_per_tick" in row else "-"
+                    print("%-28s %-8s %7d %7d %10.3f %12.0f %12s" % (row["bench"], row["mode"], row["npeople"],
+                                                                    row["ticks"], row["us_per_tick"],
+                                                                    row["ticks_per_s"], alloc))
+                    if "texture_misses" in row:
+                        print("%-28s %d hits, %d misses in the last episode" % ("    text textures", row["texture_hits"],
+                                                                                row["texture_misses"]))
+
+    result = {"environment": environment(),
+              "settings": {"seed": args.seed, "repeat": args.repeat, "probe_overhead_ns": overhead_ns},
+              "results": rows}
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(rows, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
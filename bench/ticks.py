@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Measure how many simulator ticks per second we get with and without the GUI
+#
+#   python -m bench.ticks --npeople 4 --ticks 2000
+#   python -m bench.ticks --gui      (needs a display, draws a frame 60 times a second)
+#
+
+import argparse
+import os
+import time
+
+from sim.sim import Simulator, ModelInterface
+from sim.util import SimClock
+
+
+def measure_ticks(simulator, nticks, fps=None):
+    """
+    Step the simulator as fast as possible and return ticks per second. The simulator has to
+    run on a SimClock, which moves on by tick_ms after every tick like in an episode, so the
+    ticks measured are ticks where things happen.
+
+    With fps the simulator also draws, like the kivy clock would: render() is called whenever
+    a frame of a display refreshing fps times a second (real time) is due. simulator.frames and
+    simulator.skippedframes then tell how many ticks got drawn and how many never were.
+    """
+    clock = simulator.clock
+    if not isinstance(clock, SimClock):
+        raise ValueError("measure_ticks needs a simulator running on a SimClock")
+    turnstate = simulator.circle.turnstate
+    t_begin = clock.now()
+    frame_s = 1.0 / fps if fps else None
+    t_start = time.perf_counter()
+    t_frame = t_start
+    for _ in range(nticks):
+        simulator.step()
+        clock.advance(simulator.tick_ms)
+        if frame_s is not None:
+            t = time.perf_counter()
+            if t >= t_frame:
+                simulator.render()
+                t_frame = t + frame_s
+    t_total = time.perf_counter() - t_start
+    # the turn state stamps every tick someone speaks, a scene stuck in time never gets past t_begin
+    if nticks > 1 and turnstate.lastStamp <= t_begin:
+        raise RuntimeError("The scene made no progress in %d ticks" % nticks)
+    return nticks / t_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ticks per second of the simulator")
+    parser.add_argument("--npeople", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--gui", action="store_true", help="also measure the Kivy path")
+    parser.add_argument("--fps", type=float, default=60, help="frames drawn per second with --gui")
+    args = parser.parse_args()
+
+    simulator = Simulator(ModelInterface(), args.npeople, headless=True, clock=SimClock())
+    print("headless: %.1f ticks/s" % measure_ticks(simulator, args.ticks))
+
+    if args.gui:
+        # keep kivy from eating our command line
+        os.environ.setdefault("KIVY_NO_ARGS", "1")
+        simulator = Simulator(ModelInterface(), args.npeople, clock=SimClock())
+        tps = measure_ticks(simulator, args.ticks, fps=args.fps)
+        print("gui:      %.1f ticks/s, %d frames drawn, %d ticks skipped"
+              % (tps, simulator.frames, simulator.skippedframes))
+
+
+if __name__ == "__main__":
+    main()
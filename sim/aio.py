@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# asyncio runtime. A simulator and its model run as coroutines on one event loop instead of
+# two threads that each sleep 50 ms: the sim ticks on fixed deadlines, the model wakes up as
+# soon as a tick is published, action timeouts are timers, and the kivy window (if any) runs
+# on the same loop through App.async_run, drawing the latest tick on the kivy clock. One
+# process can host as many sessions as it likes.
+#
+#   session = Session(simulator, model, adapter.transform_features)
+#   asyncio.run(runWithGui(session))          # interactive
+#   asyncio.run(runSessions(sessions, 60000)) # many headless ones, e.g. on SimClocks
+#
+
+import asyncio
+import itertools
+import signal
+
+import sim.trace as trace
+from sim.util import SimClock
+from tt.change_driven import ChangeDriven
+
+# session ids, the trace source of everything a session's sim and model emit
+session_ids = itertools.count(1)
+
+
+class Session:
+    """
+    One simulator and the model that drives its robot.
+
+    On the wall clock ticks are spaced on absolute deadlines of the event loop, so a slow tick
+    doesn't push all the later ones back. On a SimClock a tick just moves the clock and yields,
+    the session runs as fast as the other sessions on the loop let it.
+
+    Trace events of the session are tagged with its source, a new id per session by default.
+    """
+
+    def __init__(self, simulator, model, transform, action_timeout_ms=2000, look_at_speaker=True,
+                 change_driven=False, source=None):
+        self.simulator = simulator
+        self.source = source if source is not None else next(session_ids)
+        self.model = model
+        self.transform = transform
+        self.clock = simulator.clock
+        self.action_timeout_ms = action_timeout_ms
+        self.look_at_speaker = look_at_speaker
+        self.simulated = isinstance(self.clock, SimClock)
+        # only wake the model up for ticks where it can decide something new
+        self.stepper = ChangeDriven(model, transform) if change_driven else None
+
+        self.ticked = asyncio.Event()
+        self.timeout = None
+        self.ticks = 0
+        self.updates = 0
+        # ticks that came in faster than the model handled them
+        self.skipped = 0
+        self.late = 0
+
+    def __endAction(self):
+        self.timeout = None
+        self.model.actionrunning = False
+
+    def __scheduleTimeout(self):
+        """
+        The running action ends action_timeout_ms after it started
+        """
+        model = self.model
+        if not model.actionrunning:
+            if self.timeout is not None:
+                self.timeout.cancel()
+                self.timeout = None
+            return
+        if self.timeout is not None:
+            return
+        remaining = model.action_started_at + self.action_timeout_ms - self.clock.now()
+        if self.simulated:
+            # simulated time has no loop timer, check on the model's next wakeup instead
+            if remaining < 0:
+                model.actionrunning = False
+            return
+        loop = asyncio.get_running_loop()
+        self.timeout = loop.call_later(max(0, remaining) / 1000.0, self.__endAction)
+
+    async def simLoop(self, duration_ms=None, start_delay_ms=0):
+        """
+        Step the simulator every tick_ms until it stops running (or duration_ms is up)
+        """
+        simulator = self.simulator
+        tick_s = simulator.tick_ms / 1000.0
+        loop = asyncio.get_running_loop()
+        if start_delay_ms:
+            if self.simulated:
+                self.clock.sleep(start_delay_ms)
+            else:
+                await asyncio.sleep(start_delay_ms / 1000.0)
+        t_end = None if duration_ms is None else self.clock.now() + duration_ms
+        deadline = loop.time()
+        while simulator.running and (t_end is None or self.clock.now() < t_end):
+            trace.setSource(self.source)
+            simulator.step()
+            self.ticks += 1
+            self.ticked.set()
+            if self.simulated:
+                # let the model see the tick at the time it was published, then move on
+                await asyncio.sleep(0)
+                self.clock.sleep(simulator.tick_ms)
+                continue
+            deadline += tick_s
+            delay = deadline - loop.time()
+            if delay < 0:
+                # fell behind, start over from now rather than bunching up ticks
+                self.late += 1
+                deadline = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+        simulator.running = False
+        self.ticked.set()
+
+    async def modelLoop(self):
+        """
+        Update the model on every published tick and send the robot commands back
+        """
+        simulator = self.simulator
+        model = self.model
+        last_seq = 0
+        while True:
+            await self.ticked.wait()
+            self.ticked.clear()
+            snapshot = simulator.readSnapshot()
+            if snapshot is not None and snapshot.seq != last_seq:
+                self.skipped += snapshot.seq - last_seq - 1
+                last_seq = snapshot.seq
+                trace.setSource(self.source)
+
+                if self.stepper is not None:
+                    observations = self.stepper.update(snapshot.features, snapshot.t)
+                    evaluated = self.stepper.evaluated
+                else:
+                    observations = model.update(self.transform(snapshot.features))
+                    evaluated = True
+                self.__scheduleTimeout()
+
+                # when the model wasn't woken up there is nothing new to show or send
+                if evaluated:
+                    self.updates += 1
+                    simulator.vis_features(observations, model.cur_state)
+                    # applied at the start of the sim's next tick
+                    simulator.requestQueuedAction(model.actionqueued)
+                    if self.look_at_speaker:
+                        simulator.requestLookAt(int(snapshot.features.turn[0]))
+            if not simulator.running:
+                break
+        if self.timeout is not None:
+            self.timeout.cancel()
+
+    async def run(self, duration_ms=None, start_delay_ms=0):
+        """
+        Run the session until the simulator stops (or duration_ms is up)
+        """
+        await asyncio.gather(self.simLoop(duration_ms, start_delay_ms), self.modelLoop())
+        return self
+
+
+async def runSessions(sessions, duration_ms=None):
+    """
+    Run many sessions side by side on the current event loop
+    """
+    return await asyncio.gather(*[session.run(duration_ms) for session in sessions])
+
+
+async def runWithGui(session, start_delay_ms=500):
+    """
+    Run a session together with its simulator's kivy window. Closing the window or Ctrl+C ends both.
+    """
+    simulator = session.simulator
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, simulator.quit)
+    except (NotImplementedError, RuntimeError):
+        # no signal handlers on this platform / off the main thread
+        pass
+
+    async def gui():
+        # frames are drawn by the kivy clock, at the display's rate, whatever rate the sim ticks at
+        simulator.startRendering()
+        await simulator.app.async_run(async_lib="asyncio")
+        simulator.running = False
+
+    await asyncio.gather(gui(), session.run(start_delay_ms=start_delay_ms))
+    simulator.close()
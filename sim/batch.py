@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+#
+# Vectorized version of the Scene. Holds many conversational circles as arrays and
+# steps all of them with a handful of numpy operations per tick.
+#
+
+import math
+
+import numpy as np
+
+from sim.sim import threePointFeatures, MIN_GAP
+from sim.util import SimClock
+import tt.fsm_adapter as fsm_adapter
+
+TWO_PI = 2 * math.pi
+
+
+def placeAngles(rng, nscenes, nslots, mindist=None, jitter=1.0):
+    """
+    Same formation rule as UniformCirclePlacer, for every scene at once
+    """
+    spacing = 2 * math.pi / nslots
+    if mindist is None:
+        mindist = min(MIN_GAP, spacing)
+    if nslots > 1 and mindist > spacing:
+        raise ValueError("Can't fit %d people %.1f degrees apart" % (nslots, math.degrees(mindist)))
+
+    maxjitter = jitter * (spacing - mindist) / 2 if nslots > 1 else math.pi
+    offset = rng.uniform(-math.pi, math.pi, (nscenes, 1))
+    angles = offset + np.arange(nslots) * spacing + rng.uniform(-maxjitter, maxjitter, (nscenes, nslots))
+    angles = (angles + math.pi) % TWO_PI - math.pi
+    return rng.permuted(angles, axis=1)
+
+
+class BatchScene:
+    """
+    B scenes with N people and one robot each, stored struct-of-arrays style.
+
+    Column N of every (B, N + 1) array is the robot, which keeps id -1 like in Scene.
+    One call to step() does what Scene.updateVis does for every scene: turn picking,
+    footing, gaze smoothing and utterance timers. Nothing is drawn.
+
+    seed is an int or a numpy SeedSequence, e.g. one spawned from a run's root seed.
+    """
+
+    def __init__(self, nscenes, npeople, seed=None, clock=None, tick_ms=50, radius=50, mindist=None):
+        self.nscenes = nscenes
+        self.npeople = npeople
+        self.rng = np.random.default_rng(seed)
+        self.clock = clock if clock is not None else SimClock()
+        self.tick_ms = tick_ms
+        self.center = (250, 150)
+
+        B = nscenes
+        N = npeople
+        self.ids = np.append(np.arange(N), -1)
+
+        # Character
+        conv_angle = placeAngles(self.rng, B, N + 1, mindist)
+        px = np.trunc(radius * np.cos(conv_angle) + self.center[0])
+        py = np.trunc(-radius * np.sin(conv_angle) + self.center[1])
+        self.pos = np.stack([px, 500 - py], axis=-1)
+        self.theta = conv_angle.copy()
+        self.desired_theta = np.zeros((B, N + 1))
+        self.isnonverbal = np.ones((B, N), dtype=bool)
+        self.isGesturing = np.zeros((B, N + 1), dtype=bool)
+
+        # angle from every participant to every other one, positions never move
+        d = self.pos[:, None, :, :] - self.pos[:, :, None, :]
+        self.angles = -np.arctan2(d[..., 1], d[..., 0])
+
+        # Robot
+        self.queuedAction = np.zeros(B, dtype=bool)
+        self.my_turn = np.zeros(B, dtype=bool)
+
+        # UtteranceBubbler
+        self.utt_stamp = np.zeros(B, dtype=np.int64)
+        self.utt_length = np.zeros(B, dtype=np.int64)
+        self.includespronoun = np.zeros(B, dtype=bool)
+        self.__randomUtterance(np.ones(B, dtype=bool))
+
+        # TurnState
+        self.whospeaking = np.zeros(B, dtype=np.int64)
+        self.turn_stamp = np.full(B, -1, dtype=np.int64)
+        self.cadence = self.rng.integers(-200, 201, B) + 500
+        self.tryingfooting = np.zeros(B, dtype=bool)
+        self.turns = 0
+
+        # GazeState
+        self.lookat = np.zeros((B, N))
+        self.lookat_set = np.zeros((B, N), dtype=bool)
+        self.__setGazeState(np.ones(B, dtype=bool))
+
+    def __randomUtterance(self, mask):
+        """
+        Start a new utterance in the masked scenes
+        """
+        n = int(mask.sum())
+        self.utt_stamp[mask] = self.clock.now()
+        self.utt_length[mask] = self.rng.integers(1, 11, n) * 1000
+        self.includespronoun[mask] = self.rng.random(n) < 0.3
+
+    def isSpeaking(self):
+        """
+        (B,) whether each scene's bubbler is still talking
+        """
+        return self.clock.now() - self.utt_stamp < self.utt_length
+
+    def __setGazeState(self, mask):
+        """
+        Everyone looks at whoever is speaking. The speaker keeps their gaze, or looks at a neighbour
+        """
+        N = self.npeople
+        rows = np.nonzero(mask)[0]
+        if len(rows) == 0:
+            return
+        who = self.whospeaking[rows]
+        people = np.arange(N)
+
+        # robot talking -> everyone looks at the robot (column N)
+        target = np.where((who == -1)[:, None], N, who[:, None] % N)
+        target = np.broadcast_to(target, (len(rows), N)).copy()
+
+        isspeaker = people[None, :] == who[:, None]
+        if N == 1:
+            speaker_target = np.full(len(rows), N)
+        else:
+            speaker_target = (who + 1) % N
+        target = np.where(isspeaker, speaker_target[:, None], target)
+
+        keep = isspeaker & self.lookat_set[rows]
+        newlook = self.angles[rows[:, None], people[None, :], target]
+        self.lookat[rows] = np.where(keep, self.lookat[rows], newlook)
+        self.lookat_set[rows] = True
+
+    def __tryFooting(self, mask):
+        """
+        People in masked scenes randomly gesture, the robot gestures if it has an action queued
+        """
+        gestures = (self.rng.integers(0, 2, (self.nscenes, self.npeople)) > 0) & self.isnonverbal
+        self.isGesturing[:, :-1] = np.where(mask[:, None], gestures, self.isGesturing[:, :-1])
+        self.my_turn[mask] = False
+        self.isGesturing[:, -1] |= mask & self.queuedAction
+
+    def __resetFooting(self, mask):
+        """
+        Only whoever got the turn keeps gesturing
+        """
+        got = self.ids[None, :] == self.whospeaking[:, None]
+        self.isGesturing = np.where(mask[:, None], self.isGesturing & got, self.isGesturing)
+        self.my_turn = np.where(mask, self.isGesturing[:, -1], self.my_turn)
+
+    def __pickNext(self, mask):
+        """
+        Pick a random gesturing participant in each masked scene. Returns the scenes where nobody was
+        """
+        candidates = self.isGesturing & mask[:, None]
+        anyone = candidates.any(axis=1)
+        keys = np.where(candidates, self.rng.random(candidates.shape), -1.0)
+        choice = self.ids[np.argmax(keys, axis=1)]
+
+        self.whospeaking = np.where(anyone, choice, np.where(mask, -2, self.whospeaking))
+        self.cadence[anyone] = self.rng.integers(-200, 201, int(anyone.sum())) + 500
+        return anyone, mask & ~anyone
+
+    def step(self):
+        """
+        One tick of every scene, the same as Scene.updateVis
+        """
+        now = self.clock.now()
+        speaking = self.isSpeaking()
+
+        # TurnState.update
+        self.turn_stamp[self.turn_stamp == -1] = now
+        expired = ~speaking & (now - self.turn_stamp > self.cadence)
+        (turnchange, nobody) = self.__pickNext(expired)
+        self.turn_stamp[speaking] = now
+        self.turns += int(turnchange.sum())
+
+        self.__resetFooting(turnchange)
+        self.tryingfooting ^= turnchange
+        self.__setGazeState(turnchange)
+
+        startfooting = ~expired & ~speaking & ~self.tryingfooting
+        self.tryingfooting |= startfooting
+        self.__tryFooting(startfooting | nobody)
+
+        # Character.update
+        self.desired_theta[:, :-1] = self.lookat
+        x_z3 = (self.theta + TWO_PI) % TWO_PI
+        y_z3 = (self.desired_theta + TWO_PI) % TWO_PI
+        ccw = np.abs(y_z3 - x_z3) < math.pi
+        self.theta = np.where(ccw, (y_z3 - x_z3) / 4, (self.desired_theta - self.theta) / 4) + self.theta
+
+        self.__randomUtterance(turnchange)
+
+    def run(self, nticks):
+        """
+        Step nticks times, moving the clock a tick each time
+        """
+        for _ in range(nticks):
+            self.step()
+            self.clock.sleep(self.tick_ms)
+
+    def makeRobotLookAtPerson(self, whichPerson):
+        """
+        (B,) person index per scene, with Scene's negative index behaviour
+        """
+        target = np.asarray(whichPerson) % self.npeople
+        self.desired_theta[:, -1] = self.angles[np.arange(self.nscenes), -1, target]
+
+    def getGazeFeatures(self):
+        """
+        (B, N) three point gaze features, see GazeState
+        """
+        return threePointFeatures(self.angles[:, :-1, -1], self.lookat)
+
+    def getObservations(self, out=None):
+        """
+        (B, F) observations in tt.fsm_adapter order, what SimFeatureAdapter makes of each
+        scene's features. The fields a model fills in itself (action queued, running action,
+        time since last activity) are -1, like the adapter leaves them.
+        """
+        out = out if out is not None else np.empty((self.nscenes, fsm_adapter.timesincelastactivity + 1))
+        speaking = self.isSpeaking()
+        lookat = (self.getGazeFeatures() == 0).any(axis=1)
+        presenting = self.isGesturing[:, :-1].any(axis=1)
+        out[:, fsm_adapter.f_voice_activity] = speaking
+        out[:, fsm_adapter.f_action_queued] = -1
+        out[:, fsm_adapter.f_utterance_complete] = ~speaking
+        out[:, fsm_adapter.f_other_lookat] = lookat
+        out[:, fsm_adapter.f_other_presenting] = presenting
+        out[:, fsm_adapter.f_who_talking] = self.whospeaking
+        out[:, fsm_adapter.f_running_action] = -1
+        out[:, fsm_adapter.f_wants_turn] = speaking | presenting
+        out[:, fsm_adapter.f_other_accepts] = lookat & presenting
+        out[:, fsm_adapter.timesincelastactivity] = -1
+        return out
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# Discrete-event stepping for the simulator. Instead of running every 50 ms tick,
+# work out when the next tick that can change anything is and jump straight to it.
+#
+
+import heapq
+
+from sim.util import SimClock
+
+
+class EventScheduler:
+    """
+    Steps a headless Simulator on a SimClock, skipping the ticks where nothing can happen.
+
+    A tick of Scene.update is idle when the bubbler is still speaking, or when the floor
+    is quiet, footing was already tried and the turn cadence has not expired yet. Idle ticks
+    draw no random numbers, so skipping them (and catching up on the gaze smoothing and the
+    turn state stamp) gives exactly the trajectory the tick-based loop would give.
+
+    Anything outside the scene that needs to run at a given time (a model deadline, an
+    action timeout) registers it with schedule().
+    """
+
+    def __init__(self, simulator):
+        if not isinstance(simulator.clock, SimClock):
+            raise ValueError("The event scheduler needs a simulator running on a SimClock")
+        if not simulator.headless:
+            raise ValueError("The event scheduler only works with a headless simulator")
+        self.simulator = simulator
+        self.scene = simulator.circle
+        self.clock = simulator.clock
+        self.tick_ms = simulator.tick_ms
+        # ticks live on this grid, same as the tick-based loop
+        self.t_origin = self.clock.now()
+        self.deadlines = []
+        self.ticks_run = 0
+        self.ticks_skipped = 0
+
+    def schedule(self, t):
+        """
+        Make sure the tick at (or right after) time t gets run
+        """
+        heapq.heappush(self.deadlines, t)
+
+    def __onGrid(self, t):
+        """
+        First tick at or after t
+        """
+        offset = (t - self.t_origin) % self.tick_ms
+        return t if offset == 0 else t + self.tick_ms - offset
+
+    def __quietFrom(self, t):
+        """
+        First tick at or after t where the bubbler is quiet, and what the turn state
+        stamp will be at that tick
+        """
+        bubbler = self.scene.bubbler
+        speech_end = bubbler.lastStamp + bubbler.forhowlong
+        if t >= speech_end:
+            return t, self.scene.turnstate.lastStamp
+        t_quiet = self.__onGrid(speech_end)
+        # while speaking, the turn state stamps every tick
+        return t_quiet, t_quiet - self.tick_ms
+
+    def nextEventTime(self):
+        """
+        Time of the next tick that has to actually run
+        """
+        t = self.clock.now()
+        turnstate = self.scene.turnstate
+        if turnstate.lastStamp == -1:
+            return t
+
+        (t_event, laststamp) = self.__quietFrom(t)
+        if self.scene.tryingfooting:
+            # nothing happens until the cadence runs out
+            t_cadence = laststamp + turnstate.cadence
+            if t_event <= t_cadence:
+                t_event = t_event + ((t_cadence - t_event) // self.tick_ms + 1) * self.tick_ms
+
+        if self.deadlines:
+            t_event = min(t_event, max(t, self.__onGrid(self.deadlines[0])))
+        return t_event
+
+    def __skipTo(self, t_event):
+        """
+        Fast forward over the idle ticks between now and t_event
+        """
+        t = self.clock.now()
+        nticks = (t_event - t) // self.tick_ms
+        if nticks <= 0:
+            return
+
+        (t_quiet, laststamp) = self.__quietFrom(t)
+        if t_quiet > t:
+            # the last skipped tick where someone was still speaking
+            self.scene.turnstate.lastStamp = min(laststamp, t_event - self.tick_ms)
+
+        lookat = self.scene.gazestate.lookat.tolist()
+        for i in range(len(self.scene.people)):
+            person = self.scene.people[i]
+            person.look_at(lookat[i])
+            person.updateTicks(nticks)
+        self.scene.robot.updateTicks(nticks)
+
+        self.clock.advance(t_event - t)
+        self.ticks_skipped += nticks
+
+    def advance(self, t_end=None):
+        """
+        Run the next tick that matters. Returns its features, or None if t_end comes first.
+        """
+        t_event = self.nextEventTime()
+        if t_end is not None and t_event >= t_end:
+            self.__skipTo(self.__onGrid(t_end))
+            return None
+
+        self.__skipTo(t_event)
+        while self.deadlines and self.deadlines[0] <= t_event:
+            heapq.heappop(self.deadlines)
+
+        features = self.simulator.step()
+        self.ticks_run += 1
+        self.clock.advance(self.tick_ms)
+        return features
+
+    def runUntil(self, t_end, on_tick=None):
+        """
+        Run every tick that matters up to t_end. on_tick(features) is called after each one.
+        """
+        while self.clock.now() < t_end and self.simulator.running:
+            features = self.advance(t_end)
+            if features is None:
+                break
+            if on_tick is not None:
+                on_tick(features)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Fixed layout feature record. One flat int64 buffer per record, with a numpy view per
+# feature group, so the simulator can refill the same memory every tick.
+#
+
+import numpy as np
+
+# feature groups, in the order Simulator.getFeatures has always returned them
+UTTERANCE = 0
+GAZE = 1
+POSITIONS = 2
+TURN = 3
+SCENE = 4
+
+
+def recordSize(npeople):
+    """
+    Length of the flat buffer for npeople: utterance (2), gaze (N), positions (2N), turn (1), scene (N)
+    """
+    return 3 + 4 * npeople
+
+
+class FeatureRecord:
+    """
+    All the features of one tick for a scene of npeople.
+
+    Unpacks and indexes like the old list of five lists:
+        (utterancefeatures, gazefeatures, posfeatures, turnfeatures, scenefeatures) = record
+        record[3][0]  # who is speaking
+    but every group is a view into the same buffer, so nothing is allocated per tick. Wrap an
+    existing buffer (e.g. a row of a recording) to read it without copying.
+    """
+
+    __slots__ = ("npeople", "buffer", "utterance", "gaze", "positions", "turn", "scene", "groups", "seq",
+                 "version")
+
+    def __init__(self, npeople, buffer=None):
+        self.npeople = npeople
+        size = recordSize(npeople)
+        self.buffer = np.zeros(size, dtype=np.int64) if buffer is None else buffer
+        if len(self.buffer) != size:
+            raise ValueError("A record for %d people needs %d values, got %d" % (npeople, size, len(self.buffer)))
+
+        N = npeople
+        self.utterance = self.buffer[0:2]
+        self.gaze = self.buffer[2:2 + N]
+        self.positions = self.buffer[2 + N:2 + 3 * N].reshape(N, 2)
+        self.turn = self.buffer[2 + 3 * N:3 + 3 * N]
+        self.scene = self.buffer[3 + 3 * N:]
+        self.groups = (self.utterance, self.gaze, self.positions, self.turn, self.scene)
+        # tick this record was last written for
+        self.seq = 0
+        # the simulator's feature version when it wrote this record: two records of one simulator
+        # with the same version hold the same features. None for records it didn't write
+        self.version = None
+
+    def __getitem__(self, group):
+        return self.groups[group]
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def copy(self):
+        """
+        A record with its own buffer
+        """
+        record = FeatureRecord(self.npeople, self.buffer.copy())
+        record.seq = self.seq
+        record.version = self.version
+        return record
+
+    def tolist(self):
+        """
+        The old nested list form, handy for printing
+        """
+        return [group.tolist() for group in self.groups]
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Interval history for the timeline. Each row keeps its most recent intervals in a fixed
+# capacity ring, so memory and the cost of finding what is on screen don't grow with the
+# length of the session. Intervals pushed out of the ring can go to an IntervalLog on disk:
+#
+#   log.bin    (row int16, start int64, end int64) records, each row oldest first
+#
+# Every session appends to the log, and starts with a header record: row SESSION, start the
+# wall clock time it began at (ms since the epoch), end the time of the session's own clock
+# the intervals are measured from.
+#
+
+import os
+
+import numpy as np
+
+from sim.util import wallclock
+
+LOG_DTYPE = np.dtype([("row", np.int16), ("start", np.int64), ("end", np.int64)])
+# row of the header record that opens each session in a log
+SESSION = -1
+
+
+class IntervalLog:
+    """
+    Append-only file of the intervals that dropped out of the rings. Records are buffered
+    by the file object, so a spill costs a small write into memory.
+    """
+
+    def __init__(self, path, t_origin=0):
+        self.path = path
+        self.file = open(path, "ab")
+        self.record = np.zeros(1, dtype=LOG_DTYPE)
+        # the session header, not counted as an interval
+        self.record[0] = (SESSION, wallclock.now(), t_origin)
+        self.file.write(self.record.tobytes())
+        self.count = 0
+
+    def write(self, row, start, end):
+        self.record[0] = (row, start, end)
+        self.file.write(self.record.tobytes())
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def readIntervalLog(path):
+    """
+    The records of an interval log, memory-mapped, session headers included. Filter by row
+    with log[log["row"] == r]
+    """
+    n = os.path.getsize(path) // LOG_DTYPE.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.memmap(path, dtype=LOG_DTYPE, mode="r", shape=(n,))
+
+
+def intervalSessions(log):
+    """
+    [(header, records)] of each session in a log read by readIntervalLog, oldest first. The
+    records are views into log
+    """
+    starts = np.flatnonzero(log["row"] == SESSION)
+    ends = list(starts[1:]) + [len(log)]
+    return [(log[i], log[i + 1:j]) for (i, j) in zip(starts, ends)]
+
+
+class IntervalRing:
+    """
+    The last capacity intervals of one row, oldest first. Only the newest interval can be
+    open (still being extended). Appending, extending and closing are O(1); once the ring is
+    full, a new interval overwrites the oldest one, after writing it to the log if there is one.
+    """
+
+    def __init__(self, capacity=256, log=None, row=0):
+        self.capacity = capacity
+        self.start = np.zeros(capacity, dtype=np.int64)
+        self.end = np.zeros(capacity, dtype=np.int64)
+        self.log = log
+        self.row = row
+        # intervals appended so far, the ring holds the last min(count, capacity)
+        self.count = 0
+        self.open = False
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def dropped(self):
+        """
+        How many intervals got pushed out of the ring
+        """
+        return max(0, self.count - self.capacity)
+
+    def extend(self, t):
+        """
+        The row is active at t: extend the open interval to t, or start a new one at t
+        """
+        if self.open:
+            self.end[(self.count - 1) % self.capacity] = t
+            return
+        i = self.count % self.capacity
+        if self.count >= self.capacity and self.log is not None:
+            self.log.write(self.row, self.start[i], self.end[i])
+        self.start[i] = t
+        self.end[i] = t
+        self.count += 1
+        self.open = True
+
+    def close(self):
+        """
+        The row went inactive, the open interval (if any) ends where it was last extended
+        """
+        self.open = False
+
+    def window(self, tbegin, tend):
+        """
+        The (start, end) of the intervals overlapping (tbegin, tend), oldest first. Walks back
+        from the newest interval, so it only touches what is visible plus one.
+        """
+        out = []
+        for k in range(self.count - 1, self.count - 1 - len(self), -1):
+            i = k % self.capacity
+            end = int(self.end[i])
+            if end < tbegin:
+                break
+            start = int(self.start[i])
+            if start < tend:
+                out.append((start, end))
+        out.reverse()
+        return out
+
+    def ordered(self):
+        """
+        Copies of the start and end arrays still in the ring, oldest first
+        """
+        n = len(self)
+        first = (self.count - n) % self.capacity
+        index = (np.arange(n) + first) % self.capacity
+        return (self.start[index], self.end[index])
+
+    def flush(self):
+        """
+        Write the intervals still in the ring to the log at the end of a session. The ring
+        logs nothing after that
+        """
+        if self.log is None:
+            return
+        for (start, end) in zip(*self.ordered()):
+            self.log.write(self.row, start, end)
+        self.log = None
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+#
+# End-to-end decision latency: how long from a cue appearing in the scene to the robot
+# reacting to it, and where that time goes.
+#
+#   tracker = LatencyTracker(simulator, model).attach()
+#   session = Session(simulator, model, tracker.adapter(transform))
+#   ... run ...
+#   tracker.detach()
+#   print(tracker.format())
+#
+# Cues:      speech end  the bubbler stops speaking (timestamped when the utterance actually ends,
+#                        not when the next tick notices)
+#            gesture     somebody starts gesturing in Character.try_footing (it happens inside
+#                        the tick that publishes it, so it has no observe stage)
+# Reactions: take turn   the model's FSM enters "I have turn"
+#            gesture     the robot starts gesturing (Robot.isGesturing)
+#
+# Stages, each one a streaming histogram:
+#   tick     CPU time of Simulator.step                         (us, real time)
+#   observe  speech end -> the first published tick that shows it (ms, session clock)
+#   pickup   tick published -> the model reads it               (ms, session clock)
+#   adapter  CPU time of the observation transform              (us, real time)
+#   fsm      CPU time of the model update                       (us, real time)
+#   command  model sends a robot command -> the sim applies it  (ms, session clock)
+#
+# python -m sim.latency runs the same seeded episodes twice: with the model woken up by every
+# published tick (sim.aio.Session) and with the model polling every 50 ms on its own, like the
+# old pair of sleeping threads. The difference is what the uncoordinated loops add on top of
+# the thresholds in the model itself.
+#
+
+import argparse
+import contextlib
+import math
+import os
+import time
+
+from sim.runner import episode_seed, load_attr, sim_adapter_for
+from sim.sim import Simulator
+from sim.util import SimClock
+import sim.trace as trace
+
+# cue kinds
+SPEECH_END = 0
+GESTURE = 1
+CUES = {SPEECH_END: "speech end", GESTURE: "gesture"}
+
+# reaction kinds
+TAKE_TURN = 0
+ROBOT_GESTURE = 1
+REACTIONS = {TAKE_TURN: "take turn", ROBOT_GESTURE: "robot gesture"}
+
+STAGES = [("tick", "us"), ("observe", "ms"), ("pickup", "ms"), ("adapter", "us"), ("fsm", "us"), ("command", "ms")]
+
+PERCENTILES = (50, 95, 99)
+
+
+class StreamingHistogram:
+    """
+    Log-bucketed histogram: constant memory however many values go in, percentiles good to
+    about ratio (2% by default). Values below lowest share the first bucket.
+    """
+
+    __slots__ = ("unit", "lowest", "scale", "counts", "count", "total", "min", "max")
+
+    def __init__(self, unit="ms", lowest=0.01, highest=1e7, ratio=1.02):
+        self.unit = unit
+        self.lowest = lowest
+        self.scale = 1.0 / math.log(ratio)
+        self.counts = [0] * (int(math.ceil(math.log(highest / lowest) * self.scale)) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        if value < self.lowest:
+            i = 0
+        else:
+            i = min(int(math.log(value / self.lowest) * self.scale) + 1, len(self.counts) - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the values of a histogram with the same buckets
+        """
+        for (i, c) in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def percentile(self, q):
+        """
+        Value below which q percent of the values fall
+        """
+        if not self.count:
+            return math.nan
+        rank = q / 100.0 * self.count
+        seen = 0
+        for (i, c) in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                break
+        # middle of the bucket, and never outside what was actually seen
+        value = 0.0 if i == 0 else self.lowest * math.exp((i - 0.5) / self.scale)
+        return min(max(value, self.min), self.max)
+
+    def summary(self):
+        result = {"unit": self.unit, "count": self.count, "mean": self.mean(),
+                  "max": self.max if self.count else math.nan}
+        for q in PERCENTILES:
+            result["p%d" % q] = self.percentile(q)
+        return result
+
+
+class LatencyTracker:
+    """
+    Timestamps cues and reactions of one simulator and its model, and times the stages in
+    between. Attaching shadows simulator.step, simulator.requestQueuedAction and model.update on
+    those instances, detaching puts the originals back. The observation transform is timed by
+    wrapping it with adapter().
+
+    A reaction answers the latest cue of each kind that came before it and hasn't been answered
+    yet, so a cue followed by another cue of the same kind before any reaction goes unanswered.
+    """
+
+    def __init__(self, simulator, model, reaction_states=("I have turn",)):
+        self.simulator = simulator
+        self.model = model
+        self.clock = simulator.clock
+        self.reaction_states = reaction_states
+
+        self.stages = {name: StreamingHistogram(unit) for (name, unit) in STAGES}
+        self.endtoend = {(cue, reaction): StreamingHistogram("ms") for cue in CUES for reaction in REACTIONS}
+        self.cues = {cue: 0 for cue in CUES}
+        self.reactions = {reaction: 0 for reaction in REACTIONS}
+        self.latest = {cue: None for cue in CUES}
+        self.pending = {pair: False for pair in self.endtoend}
+
+        # (seq, t) of the last few published ticks, by seq
+        self.published = [(0, 0)] * 8
+        self.speaking = False
+        self.gesturing = []
+        self.robotgesturing = False
+        self.saved = None
+
+    def __cue(self, cue, t_cue, now, observed=True):
+        if observed:
+            self.stages["observe"].add(now - t_cue)
+        self.cues[cue] += 1
+        self.latest[cue] = t_cue
+        for reaction in REACTIONS:
+            self.pending[(cue, reaction)] = True
+        if trace.LEVEL >= trace.INFO:
+            trace.emit(trace.CUE, cue, now - t_cue)
+
+    def __react(self, reaction, now):
+        self.reactions[reaction] += 1
+        for cue in CUES:
+            if self.pending[(cue, reaction)]:
+                self.pending[(cue, reaction)] = False
+                self.endtoend[(cue, reaction)].add(now - self.latest[cue])
+        if trace.LEVEL >= trace.INFO:
+            trace.emit(trace.REACTION, reaction)
+
+    def __trackedStep(self, step):
+        clock = self.clock
+        scene = self.simulator.circle
+        bubbler = scene.bubbler
+        perf_counter_ns = time.perf_counter_ns
+        tick = self.stages["tick"]
+
+        def tracked():
+            t_start = perf_counter_ns()
+            features = step()
+            tick.add((perf_counter_ns() - t_start) / 1000.0)
+            now = clock.now()
+            self.published[features.seq % len(self.published)] = (features.seq, now)
+
+            speaking = bool(features.utterance[1])
+            if self.speaking and not speaking:
+                # nobody starts talking on the tick the last utterance ends, so this is still it
+                self.__cue(SPEECH_END, bubbler.lastStamp + bubbler.forhowlong, now)
+            self.speaking = speaking
+            gesturing = features.scene.tolist()
+            if any(g and not before for (g, before) in zip(gesturing, self.gesturing)):
+                # started by this very step, there is no delay to observe
+                self.__cue(GESTURE, now, now, observed=False)
+            self.gesturing = gesturing
+            if scene.robot.isGesturing and not self.robotgesturing:
+                self.__react(ROBOT_GESTURE, now)
+            self.robotgesturing = scene.robot.isGesturing
+            return features
+        return tracked
+
+    def __trackedUpdate(self, update):
+        model = self.model
+        perf_counter_ns = time.perf_counter_ns
+        fsm = self.stages["fsm"]
+
+        def tracked(observations):
+            prev_state = model.cur_state
+            t_start = perf_counter_ns()
+            result = update(observations)
+            fsm.add((perf_counter_ns() - t_start) / 1000.0)
+            if model.cur_state is not prev_state and model.cur_state.name in self.reaction_states:
+                self.__react(TAKE_TURN, self.clock.now())
+            return result
+        return tracked
+
+    def __trackedRequest(self, request):
+        clock = self.clock
+        commands = self.simulator.commands
+        command = self.stages["command"]
+
+        def applied(sent):
+            command.add(clock.now() - sent)
+
+        def tracked(queued):
+            request(queued)
+            # runs right after the real command, on the sim's next tick
+            commands.put((applied, clock.now()))
+        return tracked
+
+    def adapter(self, transform):
+        """
+        transform, timed as the adapter stage. Also times how long the tick it is given has
+        been waiting for the model.
+        """
+        clock = self.clock
+        perf_counter_ns = time.perf_counter_ns
+        stage = self.stages["adapter"]
+        pickup = self.stages["pickup"]
+
+        def tracked(features):
+            (seq, t_published) = self.published[features.seq % len(self.published)]
+            if seq == features.seq:
+                pickup.add(clock.now() - t_published)
+            t_start = perf_counter_ns()
+            result = transform(features)
+            stage.add((perf_counter_ns() - t_start) / 1000.0)
+            return result
+        if hasattr(transform, "onskip"):
+            # keep tt.change_driven working on the wrapped transform
+            tracked.onskip = transform.onskip
+        return tracked
+
+    def attach(self):
+        """
+        Start tracking. Returns the tracker
+        """
+        if self.saved is not None:
+            return self
+        simulator = self.simulator
+        self.saved = (simulator.step, simulator.requestQueuedAction, self.model.update)
+        # shadow the methods on these instances only
+        simulator.step = self.__trackedStep(simulator.step)
+        simulator.requestQueuedAction = self.__trackedRequest(simulator.requestQueuedAction)
+        self.model.update = self.__trackedUpdate(self.model.update)
+        return self
+
+    def detach(self):
+        """
+        Stop tracking, the numbers are kept
+        """
+        if self.saved is None:
+            return
+        del self.simulator.step
+        del self.simulator.requestQueuedAction
+        del self.model.update
+        self.saved = None
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def merge(self, other):
+        """
+        Add another tracker's numbers to this one's, e.g. to sum up several episodes
+        """
+        for (name, histogram) in other.stages.items():
+            self.stages[name].merge(histogram)
+        for (pair, histogram) in other.endtoend.items():
+            self.endtoend[pair].merge(histogram)
+        for cue in CUES:
+            self.cues[cue] += other.cues[cue]
+        for reaction in REACTIONS:
+            self.reactions[reaction] += other.reactions[reaction]
+
+    def report(self):
+        """
+        Everything collected so far, as plain python values (e.g. for json)
+        """
+        return {"stages": {name: histogram.summary() for (name, histogram) in self.stages.items()},
+                "cues": {CUES[cue]: count for (cue, count) in self.cues.items()},
+                "reactions": {REACTIONS[reaction]: count for (reaction, count) in self.reactions.items()},
+                "endtoend": {"%s -> %s" % (CUES[cue], REACTIONS[reaction]): histogram.summary()
+                             for ((cue, reaction), histogram) in self.endtoend.items()}}
+
+    def format(self):
+        """
+        The report as a table for the terminal
+        """
+        header = "%-28s %8s %9s" % ("", "count", "mean") + "".join(" %9s" % ("p%d" % q) for q in PERCENTILES)
+        lines = [header]
+        rows = [(name, histogram) for (name, histogram) in self.stages.items()]
+        rows += [("%s -> %s" % (CUES[cue], REACTIONS[reaction]), histogram)
+                 for ((cue, reaction), histogram) in self.endtoend.items()]
+        for (name, histogram) in rows:
+            summary = histogram.summary()
+            lines.append("%-28s %8d %9.1f" % ("%s (%s)" % (name, histogram.unit), summary["count"], summary["mean"])
+                         + "".join(" %9.1f" % summary["p%d" % q] for q in PERCENTILES))
+        return "\n".join(lines)
+
+
+def measure_episode(model_cls, npeople, duration_ms, seed, episode=0, adapter_for=sim_adapter_for,
+                    action_interval_ms=None, poll_phase_ms=None, poll_period_ms=None):
+    """
+    Run one headless episode on simulated time and return its (detached) LatencyTracker.
+
+    By default the model handles every tick right after it is published, as sim.aio.Session
+    does. With poll_phase_ms the model instead wakes up on its own every poll_period_ms
+    (tick_ms by default), starting poll_phase_ms after the first tick, and reads whatever the
+    last tick published, like the old model thread that slept 50 ms between updates.
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        clock = SimClock()
+        model = model_cls(clock)
+        simulator = Simulator(model, npeople, headless=True, clock=clock, seed=episode_seed(seed, episode))
+        tracker = LatencyTracker(simulator, model).attach()
+        transform = tracker.adapter(adapter_for(clock))
+        tick_ms = simulator.tick_ms
+        poll_period_ms = poll_period_ms if poll_period_ms is not None else tick_ms
+
+        next_action = action_interval_ms
+
+        def poll():
+            nonlocal next_action
+            snapshot = simulator.readSnapshot()
+            model.update(transform(snapshot.features))
+            if next_action is not None and clock.now() >= next_action:
+                model.queue_action()
+                next_action += action_interval_ms
+            if model.actionrunning and clock.now() - model.action_started_at > 2000:
+                model.actionrunning = False
+            simulator.requestQueuedAction(model.actionqueued)
+            simulator.requestLookAt(int(snapshot.features.turn[0]))
+
+        t_poll = poll_phase_ms
+        while clock.now() < duration_ms:
+            t_next = clock.now() + tick_ms
+            simulator.step()
+            if poll_phase_ms is None:
+                poll()
+            else:
+                while t_poll < t_next:
+                    clock.advance(max(0, t_poll - clock.now()))
+                    poll()
+                    t_poll += poll_period_ms
+            clock.advance(t_next - clock.now())
+        tracker.detach()
+    return tracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cue to reaction latency, event driven vs polling model loop")
+    parser.add_argument("model", help="model class, e.g. MP_GANDALF.Model")
+    parser.add_argument("--adapter", default=None,
+                        help="function clock -> transform, e.g. GANDALF.transformer_for (default SimFeatureAdapter)")
+    parser.add_argument("--npeople", type=int, default=4)
+    parser.add_argument("--duration", type=int, default=600000, help="episode length in simulated ms")
+    parser.add_argument("--episodes", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--action-interval", type=int, default=3000,
+                        help="queue a robot action every this many simulated ms")
+    parser.add_argument("--poll-period", type=int, default=None,
+                        help="period of the polling model loop in ms (default: the tick, 50 ms)")
+    args = parser.parse_args()
+
+    model_cls = load_attr(args.model)
+    adapter_for = load_attr(args.adapter) if args.adapter is not None else sim_adapter_for
+
+    results = {}
+    for mode in ("event driven", "polling"):
+        total = None
+        for episode in range(args.episodes):
+            # the polling loop's phase against the sim's ticks is spread over the episodes
+            phase = None if mode == "event driven" else episode * 50 // args.episodes
+            tracker = measure_episode(model_cls, args.npeople, args.duration, args.seed, episode, adapter_for,
+                                      args.action_interval, phase, args.poll_period)
+            if total is None:
+                total = tracker
+            else:
+                total.merge(tracker)
+        results[mode] = total
+        print("== %s, %d episodes" % (mode, args.episodes))
+        print(total.format())
+        print()
+
+    print("== what polling adds (ms)")
+    for ((cue, reaction), histogram) in results["polling"].endtoend.items():
+        base = results["event driven"].endtoend[(cue, reaction)]
+        print("%-28s" % ("%s -> %s" % (CUES[cue], REACTIONS[reaction]))
+              + "".join(" p%d %+7.1f" % (q, histogram.percentile(q) - base.percentile(q)) for q in PERCENTILES))
+
+
+if __name__ == "__main__":
+    main()
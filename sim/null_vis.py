@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# No-op stand-ins for the Kivy visualizers so the simulator can run headless
+#
+
+
+class NullCanvas:
+    """
+    Canvas that never redraws
+    """
+
+    def ask_update(self):
+        pass
+
+
+class NullVis:
+    """
+    Drop-in replacement for PyGameVis that draws nothing. Nothing in here touches Kivy.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.canvas = NullCanvas()
+        self.timelineGroup = None
+        self.textGroup = None
+        self.on_keys = None
+
+    def set_keyboard_handler(self, on_keysI):
+        """
+        Keep the callback around, there is no keyboard to call it though
+        """
+        self.on_keys = on_keysI
+
+    def addChar(self, pos_new, color_new):
+        return None
+
+    def blankScreen(self):
+        pass
+
+    def drawJib(self, utterance):
+        pass
+
+    def putJib(self, center):
+        pass
+
+    def update(self):
+        pass
+
+    def evalSpaceBar(self, on_spacebar, on_quit):
+        pass
+
+    def drawChar(self, center, pos, drawOuterCircle, thetaRot, color, thechar):
+        pass
+
+
+class NullTimeline:
+    """
+    Drop-in replacement for TimelineViz
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def update(self, features):
+        pass
+
+    def record(self, features, t_now):
+        pass
+
+    def view(self, t_now):
+        return None
+
+    def render(self, view):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullGui:
+    """
+    Drop-in replacement for FlexGui
+    """
+
+    def __init__(self):
+        self.tt_viewer = None
+
+    def print_line(self, key, value):
+        pass
+
+    def create_slider_int(self, name, minV, maxV, defaultVal=0):
+        return None
+
+    def run(self):
+        pass
+
+    def stop(self):
+        pass
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# Episode recorder. Every tick's features, observations, FSM state and robot actions go into
+# a directory of raw column files, one per column, plus a meta.json describing them:
+#
+#   recording/
+#     meta.json         npeople, column dtypes and widths, FSM state names
+#     t.bin             int64      simulated (or wall) ms of the tick
+#     features.bin      int64      the FeatureRecord buffer, recordSize(npeople) wide
+#     observations.bin  float64    the observation vector handed to the model
+#     state.bin         int16      index into meta["states"]
+#     actions.bin       int16      action queued, action running, who the robot looks at
+#
+# Rows are buffered in fixed size chunks and appended to the column files a chunk at a time.
+# Reading memory-maps the columns, so even a recording of many hours opens straight away and
+# only the pages that are touched get read.
+#
+
+import json
+import os
+
+import numpy as np
+
+from sim.features import FeatureRecord, recordSize
+import tt.fsm_adapter as fsm_adapter
+
+META = "meta.json"
+NOBSERVATIONS = fsm_adapter.timesincelastactivity + 1
+
+# robot action columns
+ACTION_QUEUED = 0
+ACTION_RUNNING = 1
+ROBOT_LOOKAT = 2
+NACTIONS = 3
+
+
+def columnLayout(npeople, nobservations=NOBSERVATIONS):
+    """
+    name -> (dtype, width) of every column, width 0 for a column with a single value per tick
+    """
+    return {"t": (np.int64, 0),
+            "features": (np.int64, recordSize(npeople)),
+            "observations": (np.float64, nobservations),
+            "state": (np.int16, 0),
+            "actions": (np.int16, NACTIONS)}
+
+
+class Recorder:
+    """
+    Appends ticks to a recording directory. Nothing is written until a chunk is full (or on
+    flush/close), so a tick costs one slice copy of the feature record and a few list appends.
+    """
+
+    def __init__(self, path, npeople, nobservations=NOBSERVATIONS, chunksize=4096):
+        self.path = path
+        self.npeople = npeople
+        self.chunksize = chunksize
+        os.makedirs(path, exist_ok=True)
+
+        self.layout = columnLayout(npeople, nobservations)
+        self.files = {name: open(os.path.join(path, name + ".bin"), "wb") for name in self.layout}
+        # the feature rows of a chunk, filled through a flat memoryview: one slice assignment
+        # of the record's buffer per tick, cheaper than numpy's row assignment
+        self.width = self.layout["features"][1]
+        self.features = np.zeros((chunksize, self.width), dtype=self.layout["features"][0])
+        self.featureslots = memoryview(self.features.reshape(-1))
+        # the rest are python ints, bools and short lists. Converting them row by row costs
+        # more than the rest of append() together, so they are gathered flat and converted
+        # once per chunk
+        self.t = []
+        self.state = []
+        self.observations = []
+        self.actions = []
+
+        # FSM nodes get an index the first time they show up. Keyed by node, not by name,
+        # a machine can have two states with the same name
+        self.stateindex = {}
+        self.statenames = []
+        self.row = 0
+        self.nticks = 0
+        self.__writeMeta()
+
+    def __writeMeta(self):
+        meta = {"npeople": self.npeople,
+                "nticks": self.nticks,
+                "columns": {name: [np.dtype(dtype).str, width] for (name, (dtype, width)) in self.layout.items()},
+                "states": self.statenames}
+        tmp = os.path.join(self.path, META + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(self.path, META))
+
+    def append(self, t, features, observation, state, actions):
+        """
+        Record one tick. features is the FeatureRecord, state the FSMNode the model is in,
+        actions (action queued, action running, who the robot looks at).
+        """
+        index = self.stateindex.get(state)
+        if index is None:
+            index = self.stateindex[state] = len(self.statenames)
+            self.statenames.append(state.name)
+
+        start = self.row * self.width
+        self.featureslots[start:start + self.width] = features.buffer
+        self.t.append(t)
+        self.state.append(index)
+        self.observations.extend(observation)
+        self.actions.extend(actions)
+        self.row += 1
+        if self.row == self.chunksize:
+            self.flush()
+
+    def flush(self):
+        """
+        Write out the rows buffered so far
+        """
+        if self.row:
+            n = self.row
+            columns = {"t": np.array(self.t, dtype=self.layout["t"][0]),
+                       "features": self.features[:n],
+                       "observations": np.array(self.observations, dtype=self.layout["observations"][0]),
+                       "state": np.array(self.state, dtype=self.layout["state"][0]),
+                       "actions": np.array(self.actions, dtype=self.layout["actions"][0])}
+            for (name, column) in columns.items():
+                column.tofile(self.files[name])
+                self.files[name].flush()
+            del self.t[:]
+            del self.state[:]
+            del self.observations[:]
+            del self.actions[:]
+            self.nticks += n
+            self.row = 0
+        self.__writeMeta()
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Recording:
+    """
+    A recording opened for reading. Every column is a read-only numpy memmap with one row per
+    tick, e.g. recording.observations[1000:2000] or recording.t[-1].
+
+    The number of ticks comes from the column files themselves, so a recording that is still
+    being written (or whose writer died) opens fine up to the last full chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as f:
+            self.meta = json.load(f)
+        self.npeople = self.meta["npeople"]
+        self.statenames = self.meta["states"]
+
+        columns = self.meta["columns"]
+        nticks = None
+        for (name, (dtype, width)) in columns.items():
+            rowbytes = np.dtype(dtype).itemsize * max(width, 1)
+            rows = os.path.getsize(os.path.join(path, name + ".bin")) // rowbytes
+            nticks = rows if nticks is None else min(nticks, rows)
+        self.nticks = nticks
+
+        for (name, (dtype, width)) in columns.items():
+            shape = (nticks, width) if width else (nticks,)
+            if nticks == 0:
+                column = np.zeros(shape, dtype=dtype)
+            else:
+                column = np.memmap(os.path.join(path, name + ".bin"), dtype=dtype, mode="r", shape=shape)
+            setattr(self, name, column)
+
+    def __len__(self):
+        return self.nticks
+
+    def record(self, i):
+        """
+        The features of tick i as a FeatureRecord, viewing the file without copying
+        """
+        return FeatureRecord(self.npeople, self.features[i])
+
+    def stateName(self, i):
+        """
+        Name of the FSM state the model was in at tick i
+        """
+        return self.statenames[self.state[i]]
+
+    def chunks(self, chunksize=65536):
+        """
+        Yield (start, stop) row ranges covering the recording, for walking it a chunk at a time
+        """
+        for start in range(0, self.nticks, chunksize):
+            yield (start, min(start + chunksize, self.nticks))
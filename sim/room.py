@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# A room full of conversations. Many conversational circles (F-formations) side by side,
+# each one its own Scene, plus a spatial index so perception only looks at who is close.
+#
+
+import math
+
+import numpy as np
+
+import sim.trace as trace
+from sim.null_vis import NullVis
+from sim.sim import Scene, threePointFeatures
+from sim.util import wallclock, SpawnableRandom
+
+
+class GridIndex:
+    """
+    Uniform grid over the floor. Points are bucketed by cell so a radius query only looks
+    at the handful of cells the radius touches.
+    """
+
+    def __init__(self, cellsize):
+        self.cellsize = cellsize
+        self.cells = {}
+        self.positions = {}
+
+    def __cell(self, pos):
+        return (int(math.floor(pos[0] / self.cellsize)), int(math.floor(pos[1] / self.cellsize)))
+
+    def insert(self, key, pos):
+        """
+        Add something at pos
+        """
+        self.positions[key] = pos
+        self.cells.setdefault(self.__cell(pos), []).append(key)
+
+    def query(self, pos, radius):
+        """
+        Everything within radius of pos
+        """
+        (cx0, cy0) = self.__cell((pos[0] - radius, pos[1] - radius))
+        (cx1, cy1) = self.__cell((pos[0] + radius, pos[1] + radius))
+        found = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for key in self.cells.get((cx, cy), ()):
+                    (px, py) = self.positions[key]
+                    if (px - pos[0]) ** 2 + (py - pos[1]) ** 2 <= radius * radius:
+                        found.append(key)
+        return found
+
+
+class Room:
+    """
+    Lots of conversational groups in one simulation, like a cocktail party or a lobby. Every
+    group is a Scene with its own turn state, bubbler and robot seat, so stepping a group only
+    costs as much as the group is big.
+
+    Everyone is in a GridIndex keyed by (group, id), with id -1 for a group's robot. Every tick,
+    each robot perceives the people within perception_radius of it (its own circle by default,
+    plus anyone from a neighbouring group standing that close).
+
+    Trace events of a group are tagged with the group's index as their source.
+    """
+
+    def __init__(self, groupsizes, visualizer=None, clock=None, seed=None, radius=50, spacing=None,
+                 perception_radius=None):
+        self.clock = clock if clock is not None else wallclock
+        self.visualizer = visualizer if visualizer is not None else NullVis()
+        self.rng = SpawnableRandom(seed)
+        # leave a circle's width between neighbouring groups
+        self.spacing = spacing if spacing is not None else 4 * radius
+        self.perception_radius = perception_radius if perception_radius is not None else 2 * radius
+
+        ncols = int(math.ceil(math.sqrt(len(groupsizes))))
+        self.groups = []
+        for (g, scene_rng) in enumerate(self.rng.spawn(len(groupsizes))):
+            trace.setSource(g)
+            center = ((g % ncols + 1) * self.spacing, (g // ncols + 1) * self.spacing)
+            self.groups.append(Scene(groupsizes[g], self.visualizer, self.clock, scene_rng, radius,
+                                     center=center))
+
+        self.index = GridIndex(self.spacing)
+        for (g, scene) in enumerate(self.groups):
+            for person in scene.people:
+                self.index.insert((g, person.id), person.getPos())
+            self.index.insert((g, -1), scene.robot.getPos())
+
+        # what each group's robot perceived on the last step, see perceive
+        self.perceived = [None] * len(self.groups)
+
+    def character(self, key):
+        """
+        (group, id) -> the Character
+        """
+        (g, who) = key
+        scene = self.groups[g]
+        return scene.robot if who == -1 else scene.people[who]
+
+    def step(self):
+        """
+        One tick of every group, then what each robot perceives around it
+        """
+        for (g, scene) in enumerate(self.groups):
+            trace.setSource(g)
+            scene.updateVis(self.visualizer)
+        for g in range(len(self.groups)):
+            self.perceived[g] = self.perceive((g, -1), self.perception_radius)
+
+    def nearby(self, pos, radius):
+        """
+        (group, id) of everyone within radius of pos
+        """
+        return self.index.query(pos, radius)
+
+    def perceive(self, key, radius):
+        """
+        What the character at key can see: the people within radius of it, whether each is
+        gesturing and speaking, and the three point gaze feature of each one towards it.
+        Only the people returned by the index are looked at.
+        """
+        (mygroup, me) = key
+        mypos = self.index.positions[key]
+        others = [k for k in self.nearby(mypos, radius) if k != key and k[1] != -1]
+        if not others:
+            return [others, [], [], []]
+
+        scene = self.groups[mygroup]
+        gaze = [None] * len(others)
+        if me == -1:
+            # a robot's own group already keeps its gaze features towards the robot
+            features = scene.gazestate.getFeatureArray(scene.robot).tolist()
+            for (i, (g, who)) in enumerate(others):
+                if g == mygroup:
+                    gaze[i] = features[who]
+        rest = [i for i in range(len(others)) if gaze[i] is None]
+        if rest:
+            # angle from each of the others to the viewer: the viewer's own group is in its angle
+            # table (robot last), anyone further away gets one vectorized computeTheta
+            pos = np.array([self.index.positions[others[i]] for i in rest], dtype=float)
+            th = -np.arctan2(mypos[1] - pos[:, 1], mypos[0] - pos[:, 0])
+            for (j, i) in enumerate(rest):
+                (g, who) = others[i]
+                if g == mygroup:
+                    th[j] = scene.angles[who, me]
+            lookat = np.array([self.groups[others[i][0]].gazestate.lookat[others[i][1]] for i in rest])
+            for (i, feature) in zip(rest, threePointFeatures(th, lookat).tolist()):
+                gaze[i] = feature
+
+        gesturing = [self.character(k).isGesturing for k in others]
+        speaking = [self.groups[g].turnstate.whospeaking == who and self.groups[g].bubbler.isSpeaking()
+                    for (g, who) in others]
+        return [others, gaze, gesturing, speaking]
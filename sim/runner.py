@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+# Monte Carlo runner. Fans independent, seeded headless episodes out over a process pool
+# and streams a summary of each one back as it finishes.
+#
+#   python -m sim.runner MP_GANDALF.Model --npeople 4 --duration 600000 --episodes 64
+#
+
+import argparse
+import concurrent.futures
+import contextlib
+import importlib
+import json
+import os
+import time
+
+import numpy as np
+
+from sim.recorder import Recorder
+from sim.sim import Simulator
+from sim.util import SimClock
+from tt.change_driven import ChangeDriven
+from tt.sim_adapter import SimFeatureAdapter
+
+
+def sim_adapter_for(clock):
+    """
+    Default observation transform: the SimFeatureAdapter
+    """
+    return SimFeatureAdapter(clock).transform_features
+
+
+def episode_seed(seed, episode):
+    """
+    The seed sequence of one episode of a run. Same as SeedSequence(seed).spawn(n)[episode]
+    """
+    return np.random.SeedSequence(seed, spawn_key=(episode,))
+
+
+def run_episode(model_cls, npeople, duration_ms, seed, episode=0, adapter_for=sim_adapter_for,
+                action_interval_ms=None, record_dir=None, change_driven=False):
+    """
+    Run one headless episode on simulated time and summarize it. This is the same loop as
+    the __main__ block of the models, minus the GUI, the threads and the sleeping.
+
+    (seed, episode) fully determine the episode, so any one of a batch run can be re-run on its own.
+    With record_dir, every tick is also recorded to record_dir/episode-<episode> (see sim.recorder).
+    With change_driven, the model is only updated on ticks where it can decide something new
+    (see tt.change_driven), which gives the same states for a fraction of the work.
+    """
+    t_start = time.perf_counter()
+    # the sim and the models print a lot, nobody is reading it here
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        clock = SimClock()
+        model = model_cls(clock)
+        simulator = Simulator(model, npeople, headless=True, clock=clock, seed=episode_seed(seed, episode))
+        transform = adapter_for(clock)
+        scene = simulator.circle
+        stepper = ChangeDriven(model, transform) if change_driven else None
+        recorder = None
+        if record_dir is not None:
+            recorder = Recorder(os.path.join(record_dir, "episode-%d" % episode), npeople)
+
+        state_ticks = {}
+        transitions = 0
+        robot_turns = 0
+        next_action = action_interval_ms
+        prev_state = model.cur_state
+        while clock.now() < duration_ms:
+            turns = scene.turns
+            features = simulator.step()
+            if scene.turns != turns and scene.turnstate.whospeaking == -1:
+                robot_turns += 1
+
+            if stepper is not None:
+                observation = stepper.update(features, clock.now())
+            else:
+                observation = model.update(transform(features))
+            state_ticks[model.cur_state.name] = state_ticks.get(model.cur_state.name, 0) + 1
+            if model.cur_state is not prev_state:
+                transitions += 1
+                prev_state = model.cur_state
+
+            if next_action is not None and clock.now() >= next_action:
+                model.queue_action()
+                next_action += action_interval_ms
+            scene.robot.queuedAction = model.actionqueued
+            if model.actionrunning and clock.now() - model.action_started_at > 2000:
+                model.actionrunning = False
+
+            scene.makeRobotLookAtPerson(scene.turnstate.whospeaking)
+            if recorder is not None:
+                recorder.append(clock.now(), features, observation, model.cur_state,
+                                (model.actionqueued, model.actionrunning, scene.turnstate.whospeaking))
+            clock.sleep(simulator.tick_ms)
+        if recorder is not None:
+            recorder.close()
+
+    return {"episode": episode,
+            "seed": seed,
+            "npeople": npeople,
+            "duration_ms": duration_ms,
+            "ticks": sum(state_ticks.values()),
+            "turns": scene.turns,
+            "robot_turns": robot_turns,
+            "transitions": transitions,
+            "state_ticks": state_ticks,
+            "final_state": model.cur_state.name,
+            "model_updates": stepper.evaluations if stepper is not None else sum(state_ticks.values()),
+            "wall_s": time.perf_counter() - t_start}
+
+
+def run_episodes(model_cls, npeople, duration_ms, nepisodes, seed=0, workers=None,
+                 adapter_for=sim_adapter_for, action_interval_ms=None, record_dir=None, change_driven=False):
+    """
+    Run nepisodes episodes over a process pool and yield each summary as it completes (in
+    completion order). Every episode gets its own independent stream spawned from seed.
+    Only a couple of episodes per worker are ever in flight, so memory stays bounded no
+    matter how many episodes are asked for.
+
+    model_cls and adapter_for have to be picklable, i.e. defined at module level.
+    """
+    workers = workers if workers is not None else os.cpu_count()
+    max_in_flight = 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        episode = 0
+        while episode < nepisodes or pending:
+            while episode < nepisodes and len(pending) < max_in_flight:
+                pending.add(pool.submit(run_episode, model_cls, npeople, duration_ms, seed,
+                                        episode, adapter_for, action_interval_ms, record_dir, change_driven))
+                episode += 1
+            (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def load_attr(spec):
+    """
+    'MP_GANDALF.Model' -> the Model class out of MP_GANDALF
+    """
+    (modname, attr) = spec.rsplit(".", 1)
+    return getattr(importlib.import_module(modname), attr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many headless episodes of a model in parallel")
+    parser.add_argument("model", help="model class, e.g. MP_GANDALF.Model")
+    parser.add_argument("--adapter", default=None,
+                        help="function clock -> transform, e.g. GANDALF.transformer_for (default SimFeatureAdapter)")
+    parser.add_argument("--npeople", type=int, default=4)
+    parser.add_argument("--duration", type=int, default=60000, help="episode length in simulated ms")
+    parser.add_argument("--episodes", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--action-interval", type=int, default=None,
+                        help="queue a robot action every this many simulated ms")
+    parser.add_argument("--record", default=None, metavar="DIR",
+                        help="record every episode's ticks under DIR (see sim.recorder)")
+    parser.add_argument("--change-driven", action="store_true",
+                        help="only update the model when its inputs change (see tt.change_driven)")
+    args = parser.parse_args()
+
+    model_cls = load_attr(args.model)
+    adapter_for = load_attr(args.adapter) if args.adapter is not None else sim_adapter_for
+
+    t_start = time.perf_counter()
+    for summary in run_episodes(model_cls, args.npeople, args.duration, args.episodes, args.seed,
+                                args.workers, adapter_for, args.action_interval, args.record,
+                                args.change_driven):
+        print(json.dumps(summary), flush=True)
+    print("%d episodes in %.2f s" % (args.episodes, time.perf_counter() - t_start))
+
+
+if __name__ == "__main__":
+    main()
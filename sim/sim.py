@@ -3,17 +3,53 @@
 # Backend for the simulator
 #
 
+import collections
 import math
-import time
-import random
+import queue
 
-from sim.sim_vis import TimelineViz, PyGameVis
+import numpy as np
 
-from sim.flexgui import FlexGui
+from sim.features import FeatureRecord
+from sim.null_vis import NullVis, NullTimeline, NullGui
+import sim.trace as trace
 import threading
 
 import tt.fsm_adapter
-from sim.util import timems
+from sim.util import wallclock, SpawnableRandom
+
+
+# snapshots point into a small ring of feature records, so a reader has this many ticks
+# minus one before the record it holds gets written again
+NRECORDS = 3
+
+
+class FeatureSnapshot(collections.namedtuple("FeatureSnapshot", ["seq", "t", "features", "scene", "timeline"],
+                                              defaults=(None, None))):
+    """
+    One tick's worth of features, published by the sim thread as a whole. The sim never writes
+    a record that is still the latest snapshot, so other threads can read it without locking.
+    With a window, scene (a SceneFrame) and timeline (a sim.sim_vis.TimelineView) hold what
+    render() draws of the tick, copied out of the live state.
+
+    The record's seq works as a seqlock: the sim zeroes it before rewriting any field and sets
+    the new tick's seq once every field is written. Read (or copy) what you need, then check
+    valid(); if it's False the read may have been torn and the values are not this tick's.
+    """
+    __slots__ = ()
+
+    def valid(self):
+        """
+        False once the sim has started reusing this snapshot's record for a later tick
+        """
+        return self.features.seq == self.seq
+
+
+class SceneFrame(collections.namedtuple("SceneFrame", ["thetas", "gesturing", "speaking", "utterance"])):
+    """
+    What is drawn of a scene at one tick: where everyone looks and who gestures (the people,
+    then the robot), and the utterance if it is being spoken
+    """
+    __slots__ = ()
 
 
 class ModelInterface:
@@ -30,7 +66,8 @@ class Character:
     A character that can speak and be visualized
     """
 
-    def __init__(self, center, theta_from_center, dist_from_center, id, visualizer):
+    def __init__(self, center, theta_from_center, dist_from_center, id, visualizer, rng=None):
+        self.rng = rng if rng is not None else SpawnableRandom()
         self.conv_pos = [theta_from_center, dist_from_center]
 
         px = self.conv_pos[1] * math.cos(self.conv_pos[0])
@@ -49,13 +86,13 @@ class Character:
         self.visualizer = visualizer
         self.char = None
 
-    def drawChar(self, center):
+    def drawChar(self, center, theta, gesturing):
         """
-        Draw the character on the pygame board
+        Draw the character on the pygame board, looking at theta
         """
         if self.char is None:
             self.char = self.visualizer.addChar(self.pos, self.mycolor)
-        self.visualizer.drawChar(center, self.pos, self.isGesturing, self.theta, self.mycolor, self.char)
+        self.visualizer.drawChar(center, self.pos, gesturing, theta, self.mycolor, self.char)
 
     def update(self):
         """
@@ -72,6 +109,17 @@ class Character:
             # go cw (compute difference in -180-180 space )
             self.theta = (self.desired_theta - self.theta) / 4 + self.theta
 
+    def updateTicks(self, nticks):
+        """
+        Same as calling update nticks times. Stops early once the gaze has settled,
+        since update is then a fixed point.
+        """
+        for _ in range(nticks):
+            theta = self.theta
+            self.update()
+            if self.theta == theta:
+                break
+
     def look_at(self, angle):
         """
         Make the character look in some angle
@@ -88,7 +136,7 @@ class Character:
         """
         Try to grab the floor by randomly gesturing
         """
-        self.isGesturing = random.randint(0, 1) > 0 if self.isnonverbal else False
+        self.isGesturing = self.rng.randint(0, 1) > 0 if self.isnonverbal else False
 
     def reset_footing(self, idwhogot):
         """
@@ -102,8 +150,8 @@ class Robot(Character):
     The machine in the game
     """
 
-    def __init__(self, center, theta_from_center, dist_from_center, visualizer):
-        Character.__init__(self, center, theta_from_center, dist_from_center, -1, visualizer)
+    def __init__(self, center, theta_from_center, dist_from_center, visualizer, rng=None):
+        Character.__init__(self, center, theta_from_center, dist_from_center, -1, visualizer, rng)
         self.mycolor = (100. / 255., 100. / 255., 100. / 255.)
         self.queuedAction = False
         self.my_turn = False
@@ -128,22 +176,47 @@ class Robot(Character):
             self.my_turn = False
 
 
+# closest two people in a circle are allowed to stand, by default
+MIN_GAP = math.radians(38)
+
+
 class UniformCirclePlacer:
-    def __init__(self):
+    """
+    Places the characters in a 'conversational circle'. This is called "formation".
+
+    All nslots slots are laid out up front: evenly spaced, rotated at random, and each one
+    jittered by up to half the slack between the even spacing and mindist, so neighbours
+    always stay at least mindist apart. Then they are handed out in random order.
+    """
+
+    def __init__(self, nslots, rng=None, radius=50, mindist=MIN_GAP, jitter=1.0):
+        self.rng = rng if rng is not None else SpawnableRandom()
+        self.radius = radius
+        self.mindist = mindist
         self.slots = []
 
+        if nslots < 1:
+            raise ValueError("Need at least one slot in the circle")
+        spacing = 2 * math.pi / nslots
+        if nslots > 1 and mindist > spacing:
+            raise ValueError("Can't fit %d people %.1f degrees apart, %.1f is the most for that many"
+                             % (nslots, math.degrees(mindist), math.degrees(spacing)))
+
+        maxjitter = jitter * (spacing - mindist) / 2 if nslots > 1 else math.pi
+        offset = self.rng.uniform(-math.pi, math.pi)
+        for k in range(nslots):
+            angle = offset + k * spacing + self.rng.uniform(-maxjitter, maxjitter)
+            # back into -pi..pi
+            self.slots.append((angle + math.pi) % (2 * math.pi) - math.pi)
+        self.rng.shuffle(self.slots)
+
     def getNextAngle(self):
         """
-        Places the characters in a 'conversational circle'. This is called "formation"
+        Angle from the center of the next free slot
         """
-        mindist = math.radians(38)
-        anglefromcenter = random.uniform(-math.pi, math.pi)
-
-        while len(list(filter(lambda x: abs(x - anglefromcenter) < mindist, self.slots))) > 0:
-            anglefromcenter = random.uniform(-math.pi, math.pi)
-
-        self.slots.append(anglefromcenter)
-        return anglefromcenter
+        if not self.slots:
+            raise ValueError("No free slots left in the circle")
+        return self.slots.pop()
 
 
 class Scene:
@@ -151,68 +224,110 @@ class Scene:
     Characters and robots in a conversational circle. Handles top level simualtion management
     """
 
-    def __init__(self, npeople, visualizer):
+    def __init__(self, npeople, visualizer, clock=None, rng=None, radius=50, mindist=None, center=(250, 150)):
+        self.clock = clock if clock is not None else wallclock
+        # everything random in the scene draws from this one stream
+        self.rng = rng if rng is not None else SpawnableRandom()
         self.people = []
-        self.center = (250, 150)
-        self.bubbler = UtteranceBubbler(visualizer, (120, 50), None)
-        self.turnstate = TurnState(npeople, self.bubbler)
+        self.center = center
+        self.bubbler = UtteranceBubbler(visualizer, (120, 50), None, self.clock, self.rng)
+        self.turnstate = TurnState(npeople, self.bubbler, self.clock, self.rng)
 
-        slots = UniformCirclePlacer()
+        # by default squeeze the gap when there are too many people for MIN_GAP
+        if mindist is None:
+            mindist = min(MIN_GAP, 2 * math.pi / (npeople + 1))
+        slots = UniformCirclePlacer(npeople + 1, self.rng, radius, mindist)
         for i in range(npeople):
             anglefromcenter = slots.getNextAngle()
-            char = Character(self.center, anglefromcenter, 50, i, visualizer)
+            char = Character(self.center, anglefromcenter, slots.radius, i, visualizer, self.rng)
             self.people.append(char)
 
         anglefromcenter = slots.getNextAngle()
-        self.robot = Robot(self.center, anglefromcenter, 50, visualizer)
+        self.robot = Robot(self.center, anglefromcenter, slots.radius, visualizer, self.rng)
+
+        # nobody moves after this, so the gaze angles between everyone can be computed once
+        self.angles = angleTable(self.people + [self.robot])
 
-        self.gazestate = GazeState(npeople, self.center, self.people)
+        self.gazestate = GazeState(npeople, self.center, self.people, self.angles)
         self.gazestate.setGazeState(self.turnstate, self.robot)
 
         self.tryingfooting = False
+        self.turns = 0
 
     def updateVis(self, stateIn):
         """
-        Draw the scene
+        Advance the scene by one tick and draw it
+        """
+        self.update()
+        self.draw()
+
+    def update(self):
+        """
+        Advance the scene by one tick. Touches no drawing, see draw() for that
         """
         turnChange = self.turnstate.update(self.people, self.robot)
         if turnChange is not None:
             if turnChange:
-                map(lambda char: char.reset_footing(self.turnstate.whospeaking), self.people)
+                self.turns += 1
+                for char in self.people:
+                    char.reset_footing(self.turnstate.whospeaking)
                 self.robot.reset_footing(self.turnstate.whospeaking)
                 self.tryingfooting = not self.tryingfooting
                 self.gazestate.setGazeState(self.turnstate, self.robot)
             elif not self.bubbler.isSpeaking() and not self.tryingfooting:
-                print("Trying to foot")
+                if trace.LEVEL >= trace.INFO:
+                    trace.emit(trace.FOOTING, 0)
                 self.tryingfooting = not self.tryingfooting
-                map(lambda char: char.try_footing(), self.people)
+                for char in self.people:
+                    char.try_footing()
                 self.robot.try_footing()
         else:
             # Let silence lay
-            print("Trying to foot again")
-            map(lambda char: char.try_footing(), self.people)
+            if trace.LEVEL >= trace.DEBUG:
+                trace.emit(trace.FOOTING, 1)
+            for char in self.people:
+                char.try_footing()
             self.robot.try_footing()
 
+        lookat = self.gazestate.lookat.tolist()
         for i in range(len(self.people)):
             person = self.people[i]
-            person.look_at(self.gazestate.lookat[i])
+            person.look_at(lookat[i])
             person.update()
-            person.drawChar(self.center)
 
         self.robot.update()
-        self.robot.drawChar(self.center)
 
         if turnChange:
             self.bubbler.randomUtterance(None)
 
-        self.bubbler.drawUtterance()
+    def frame(self):
+        """
+        A copy of what draw() shows of the scene as it is now
+        """
+        characters = self.people + [self.robot]
+        return SceneFrame(tuple(char.theta for char in characters),
+                          tuple(char.isGesturing for char in characters),
+                          self.bubbler.isSpeaking(), self.bubbler.utterance)
+
+    def draw(self, frame=None):
+        """
+        Draw a frame of the scene, by default the scene as it is now (only from the thread that
+        updates it). Call it from the thread that owns the visualizer
+        """
+        if frame is None:
+            frame = self.frame()
+        characters = self.people + [self.robot]
+        for (char, theta, gesturing) in zip(characters, frame.thetas, frame.gesturing):
+            char.drawChar(self.center, theta, gesturing)
+        self.bubbler.drawUtterance(frame.utterance, frame.speaking)
 
     def makeRobotLookAtPerson(self, whichPerson):
         """
         Exactly as it seems
         """
-        angle = computeTheta(self.robot.getPos(), self.gazestate.people[whichPerson].getPos())
-        self.robot.look_at(angle)
+        # the robot is the last row of the table
+        angle = self.angles[-1, whichPerson % len(self.people)]
+        self.robot.look_at(float(angle))
 
     def getFeatures(self):
         """
@@ -231,83 +346,94 @@ def computeTheta(myPos, lookAtPos):
     return ang
 
 
+def angleTable(characters):
+    """
+    angles[i, j] is computeTheta from character i to character j
+    """
+    positions = [c.getPos() for c in characters]
+    return np.array([[computeTheta(mine, theirs) for theirs in positions] for mine in positions])
+
+
+def threePointFeatures(th, lookat):
+    """
+    Vectorized three point gaze feature. th is the angle from each person to the robot and lookat
+    where each person is looking (same shape). 0 means looking at the robot, -1/1 looking to either
+    side of it and -2 looking somewhere else.
+    """
+    dtheta = th - lookat
+    x_z3 = (lookat + (2 * math.pi)) % (2 * math.pi)
+    y_z3 = (th + (2 * math.pi)) % (2 * math.pi)
+
+    dtheta_z3 = x_z3 - y_z3
+    ordinal = np.where(dtheta_z3 < -math.radians(30), -1, np.where(dtheta_z3 > math.radians(30), 1, 0))
+    close = (np.abs(dtheta) < math.radians(30)) & (np.abs(y_z3 - x_z3) < math.pi)
+    return np.where(close, ordinal, -2)
+
+
 class GazeState:
     """
     This is a simple class that can change the direction of the gaze based on who's talking and who they want to talk to
     """
 
-    def __init__(self, npeople, center, people):
+    def __init__(self, npeople, center, people, angles=None):
         self.npeople = npeople
-        self.lookat = [0] * npeople
+        # nan until someone has been told where to look
+        self.lookat = np.full(npeople, np.nan)
         self.centerPos = center
-
-        for i in range(npeople):
-            self.lookat[i] = None
         self.people = people
+        # angle table over the people with the robot last, see angleTable
+        self.angles = angles
+        # gaze features only change when lookat does, keep them until then
+        self.features = None
 
     def setGazeState(self, turnstate, robot):
         """
         Meat of the gaze decision
         """
         whoIndex = turnstate.whospeaking
-        print("Who's turn: " + str(whoIndex))
-        whopos = self.people[whoIndex].getPos()
+        if trace.LEVEL >= trace.INFO:
+            trace.emit(trace.GAZE, whoIndex)
+        if self.angles is None:
+            self.angles = angleTable(self.people + [robot])
+        robotIndex = self.npeople
         for i in range(self.npeople):
-            l = whopos
+            target = whoIndex % self.npeople
             if whoIndex == -1:
-                l = robot.getPos()
+                target = robotIndex
             elif i == whoIndex:
-                if self.lookat[i] is not None:
+                if not np.isnan(self.lookat[i]):
                     continue
                 else:
                     if self.npeople == 1:
-                        l = robot.getPos()
+                        target = robotIndex
                     else:
-                        somei = (whoIndex + 1) % self.npeople
-                        l = self.people[somei].getPos()
-            self.lookat[i] = computeTheta(self.people[i].getPos(), l)
+                        target = (whoIndex + 1) % self.npeople
+            self.lookat[i] = self.angles[i, target]
+        self.features = None
 
     def __compute_three_point_features(self, robot):
         """
         gets the gaze features by extracting the gaze targets as ordinals of people
         """
-        features_out = []
-        for i in range(len(self.people)):
-            person = self.people[i]
-            th = computeTheta(person.getPos(), robot.getPos())
-            dtheta = th - self.lookat[i]
-
-            x_z3 = (self.lookat[i] + (2 * math.pi)) % (2 * math.pi)
-            y_z3 = (th + (2 * math.pi)) % (2 * math.pi)
-
-            if abs(dtheta) < math.radians(30):
-                if abs(y_z3 - x_z3) < math.pi:
-                    dtheta = x_z3 - y_z3
-                    if dtheta < -math.radians(30):
-                        features_out.append(-1)
-                    elif dtheta > math.radians(30):
-                        features_out.append(1)
-                    else:
-                        features_out.append(0)
-                else:
-                    features_out.append(-2)
-            else:
-                features_out.append(-2)
-
-            # if i == 0:
-            #     print("th: " + str(math.degrees(th)))
-
-            #     print("x: " + str(math.degrees(x_z3)))
-            #     print("y: " + str(math.degrees(y_z3)))
-
-            #     print("Feature for person zero and robot: " + str(dtheta))
-        return features_out
+        if self.angles is None:
+            self.angles = angleTable(self.people + [robot])
+        # angle from every person to the robot, straight out of the table
+        th = self.angles[:self.npeople, self.npeople]
+        return threePointFeatures(th, self.lookat)
 
     def getFeatures(self, robot):
         """
         External function that is called
         """
-        return self.__compute_three_point_features(robot)
+        return self.getFeatureArray(robot).tolist()
+
+    def getFeatureArray(self, robot):
+        """
+        Same as getFeatures, as a numpy array. Shared between calls, don't write to it
+        """
+        if self.features is None:
+            self.features = self.__compute_three_point_features(robot)
+        return self.features
 
     def getPositions(self):
         return [p.getPos() for p in self.people]
@@ -318,14 +444,16 @@ class TurnState:
     Determins who gets the next turn. This is mostly chosen randomly
     """
 
-    def __init__(self, npeople, utterer):
+    def __init__(self, npeople, utterer, clock=None, rng=None):
+        self.clock = clock if clock is not None else wallclock
+        self.rng = rng if rng is not None else SpawnableRandom()
         self.whospeaking = -1
         self.cadence = 500
         self.lastStamp = -1
         self.npeople = npeople
         self.speakerbox = utterer
         self.whospeaking = 0
-        self.cadence = random.randint(-200, 200) + 500
+        self.cadence = self.rng.randint(-200, 200) + 500
 
     def __pickNext(self, peoplefooting, robotfooting):
         """
@@ -337,26 +465,28 @@ class TurnState:
         if len(possibilities) == 0:
             self.whospeaking = -2
         else:
-            self.whospeaking = random.randint(0, len(possibilities) - 1)
+            self.whospeaking = self.rng.randint(0, len(possibilities) - 1)
             self.whospeaking = possibilities[self.whospeaking].id
-            self.cadence = random.randint(-200, 200) + 500
+            self.cadence = self.rng.randint(-200, 200) + 500
         return self.whospeaking
 
     def update(self, footingpeople, footingrobot):
         """
         Meat of the turn state update
         """
+        now = self.clock.now()
         if self.lastStamp == -1:
-            self.lastStamp = timems()
-        if not self.speakerbox.isSpeaking() and timems() - self.lastStamp > self.cadence:
+            self.lastStamp = now
+        if not self.speakerbox.isSpeaking() and now - self.lastStamp > self.cadence:
             # see who's turn it is
             whonext = self.__pickNext(footingpeople, footingrobot)
             if whonext == -2:
                 return None
-            print("Person " + str(self.whospeaking) + "'s turn.")
+            if trace.LEVEL >= trace.INFO:
+                trace.emit(trace.TURN_CHANGE, self.whospeaking)
             return True
         elif self.speakerbox.isSpeaking():
-            self.lastStamp = timems()
+            self.lastStamp = now
         return False
 
     def getFeatures(self):
@@ -373,11 +503,15 @@ class UtteranceBubbler:
     We don't take these semantics into account very deeply here. We just return whether or not a pronoun was used.
     """
 
-    def __init__(self, visualizer, center, distance):
+    def __init__(self, visualizer, center, distance, clock=None, rng=None):
+        self.clock = clock if clock is not None else wallclock
+        self.rng = rng if rng is not None else SpawnableRandom()
         self.center = center
         self.distance = distance
         self.visualizer = visualizer
         self.forhowlong = 0
+        # the utterance last handed to the visualizer, it's rendered when it's first drawn
+        self.rendered = None
         self.randomUtterance(None)
 
     def renderUtterance(self, utterance, fromAngle):
@@ -390,33 +524,37 @@ class UtteranceBubbler:
         """
         Determines how long it takes to say something
         """
-        return timems() - self.lastStamp < self.forhowlong
+        return self.clock.now() - self.lastStamp < self.forhowlong
 
     def randomUtterance(self, fromAngle):
         """
         Synthesizes a random utterance and make it come from a specific person
         """
         numwords = 2  # random.randint(1,4)
-        self.forhowlong = random.randint(1, 10) * 1000
+        self.forhowlong = self.rng.randint(1, 10) * 1000
         phrase = ""
-        self.lastStamp = timems()
+        self.lastStamp = self.clock.now()
         for _ in range(numwords):
-            wordlen = random.randint(1, 3)
+            wordlen = self.rng.randint(1, 3)
             wrd = ''
             for _ in range(wordlen):
-                nextChar = chr(ord('A') + random.randint(0, 25)) + 'A'
+                nextChar = chr(ord('A') + self.rng.randint(0, 25)) + 'A'
                 wrd = wrd + nextChar
             phrase = phrase + wrd + " "
 
         # 1 in 10 chance of using pronoun
-        self.includespronoun = 1 if random.random() < 0.3 else 0
-        self.renderUtterance(phrase, fromAngle)
+        self.includespronoun = 1 if self.rng.random() < 0.3 else 0
+        self.utterance = phrase
+        self.fromAngle = fromAngle
 
-    def drawUtterance(self):
+    def drawUtterance(self, utterance, speaking):
         """
-        Draw the utterance in the visualizer
+        Draw an utterance in the visualizer, shown while it is being spoken
         """
-        if self.isSpeaking():
+        if utterance is not self.rendered:
+            self.renderUtterance(utterance, self.fromAngle)
+            self.rendered = utterance
+        if speaking:
             self.visualizer.putJib(self.center)
 
     def getFeatures(self):
@@ -431,37 +569,110 @@ class Simulator(threading.Thread):
     Encapsulate the whole simulator and model and run the sim.
     """
 
-    def __init__(self, model, npeople):
-        # type: (ModelInterface) -> None
+    def __init__(self, model, npeople, headless=False, clock=None, seed=None, history=None):
+        # type: (ModelInterface, int, bool, object, object, object) -> None
         threading.Thread.__init__(self)
 
         timelineheight = 200
         tlx = 300
 
-        self.visualizer = PyGameVis(150, timelineheight)
+        # pass a SimClock to run faster than real time. The GUI wants the wall clock.
+        self.clock = clock if clock is not None else wallclock
+        self.tick_ms = 50
+
+        # seed is an int or a numpy SeedSequence. The scene gets its own child stream
+        self.rng = SpawnableRandom(seed)
+        (scene_rng,) = self.rng.spawn(1)
+
+        self.headless = headless
+        if headless:
+            # no display, no kivy. Everything still simulates, nothing draws
+            self.visualizer = NullVis()
+            self.app = NullGui()
+            self.circle = Scene(npeople, self.visualizer, self.clock, scene_rng)
+            self.timeline = NullTimeline()
+        else:
+            # kivy is only imported when we actually want a window
+            from sim.sim_vis import TimelineViz, PyGameVis
+            from sim.flexgui import FlexGui
+
+            self.visualizer = PyGameVis(150, timelineheight)
 
-        # kivy
-        self.app = FlexGui()  # wrapVis(self.visualizer, timelineheight)
-        self.app.tt_viewer = self.visualizer
+            self.app = FlexGui()  # wrapVis(self.visualizer, timelineheight)
+            self.app.tt_viewer = self.visualizer
 
-        self.circle = Scene(npeople, self.visualizer)
-        self.timeline = TimelineViz(tlx, timelineheight, self.visualizer.timelineGroup)
+            self.circle = Scene(npeople, self.visualizer, self.clock, scene_rng)
+            # history: path of an interval log that keeps the whole timeline (see sim.intervals)
+            self.timeline = TimelineViz(tlx, timelineheight, self.visualizer.timelineGroup, self.clock,
+                                        history=history)
 
         self.model = model
+        self.visualizer.set_keyboard_handler(self.model.queue_action)
+
+        self.records = [FeatureRecord(npeople) for _ in range(NRECORDS)]
+        for record in self.records:
+            # nobody moves, the positions only need writing once
+            record.positions[:] = self.circle.gazestate.getPositions()
+        self.nextrecord = 0
+        # bumped whenever a record is written with features different from the last one, see
+        # __writeFeatures. Consumers compare versions instead of whole records
+        self.version = 0
+        self.lastgaze = None
+        self.lastsources = None
+
+        # latest published features, and robot commands waiting for the next tick
+        self.snapshot = None
+        self.commands = queue.SimpleQueue()
+
+        # frames are drawn by the kivy clock, see startRendering
+        self.frames = 0
+        self.rendered = 0
+        # ticks that were published but never drawn
+        self.skippedframes = 0
 
         self.running = True
 
-    def getFeatures(self):
+    def getFeatures(self, out=None):
+        """
+        Aggregate all of the features into a FeatureRecord: out, or a new record without it.
+        The records behind published snapshots belong to step() and are never handed out here.
+        """
+        record = out if out is not None else FeatureRecord(len(self.circle.people))
+        record.positions[:] = self.circle.gazestate.getPositions()
+        return self.__writeFeatures(record)
+
+    def __nextRecord(self):
+        """
+        The next record of the ring, marked as being written (seq 0) before anything in it changes
+        """
+        record = self.records[self.nextrecord]
+        self.nextrecord = (self.nextrecord + 1) % NRECORDS
+        record.seq = 0
+        return record
+
+    def __writeFeatures(self, record):
         """
-        Aggregate all of the features
+        Fill in everything but the positions, and stamp the record with the feature version
         """
-        gazefeatures = self.circle.gazestate.getFeatures(self.circle.robot)
-        utterancefeatures = self.circle.bubbler.getFeatures()
-        turnfeatures = self.circle.turnstate.getFeatures()
-        posfeatures = self.circle.gazestate.getPositions()
-        scenefeatures = self.circle.getFeatures()
+        scene = self.circle
+        utterance = (scene.bubbler.includespronoun, scene.bubbler.isSpeaking())
+        gaze = scene.gazestate.getFeatureArray(scene.robot)
+        whospeaking = scene.turnstate.whospeaking
+        gesturing = scene.getFeatures()
+        # the gaze array is only recomputed when the gaze targets change, so its identity tells
+        # whether it did, the rest are a few python values. Nobody moves, the positions never change
+        sources = (utterance, whospeaking, gesturing)
+        if gaze is not self.lastgaze or sources != self.lastsources:
+            self.version += 1
+            self.lastgaze = gaze
+            self.lastsources = sources
+        record.version = self.version
 
-        return [utterancefeatures, gazefeatures, posfeatures, turnfeatures, scenefeatures]
+        record.utterance[:] = utterance
+        record.gaze[:] = gaze
+        record.turn[0] = whospeaking
+        record.scene[:] = gesturing
+        return record
 
     def stopRunning(self):
         """
@@ -480,31 +691,116 @@ class Simulator(threading.Thread):
         Starts the sim and the threads
         """
         # this blocks until the user closes the window
+        self.startRendering()
         self.app.run()
         self.running = False
+        if self.is_alive():
+            # let the sim thread finish its last tick before the timeline is closed
+            self.join()
+        self.close()
+
+    def close(self):
+        """
+        End the session once the simulator has stopped: writes what the timeline still holds
+        to its interval log
+        """
+        self.timeline.close()
+
+    def startRendering(self):
+        """
+        Draw on the kivy clock, on the UI thread, once per frame. Does nothing headless
+        """
+        if self.headless:
+            return
+        from kivy.clock import Clock
+        # an interval of 0 calls render before every frame
+        Clock.schedule_interval(self.render, 0)
+
+    def render(self, dt=None):
+        """
+        Draw the latest published tick. Frames with no new tick draw nothing, ticks published
+        between two frames are skipped. Only call it from the UI thread. It draws what the
+        snapshot holds and reads nothing the sim is writing, so the sim can tick on a thread
+        of its own.
+        """
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.seq == self.rendered:
+            return
+        if self.rendered:
+            self.skippedframes += snapshot.seq - self.rendered - 1
+        self.rendered = snapshot.seq
+        self.frames += 1
+
+        self.visualizer.blankScreen()
+        self.circle.draw(snapshot.scene)
+        self.timeline.render(snapshot.timeline)
+        self.visualizer.canvas.ask_update()
+        self.visualizer.update()
+
+    def readSnapshot(self):
+        """
+        The features of the last finished tick, all from that same tick. Safe from any thread.
+        """
+        return self.snapshot
+
+    def requestLookAt(self, whichPerson):
+        """
+        Have the robot look at someone, starting with the next tick. Safe from any thread.
+        """
+        self.commands.put((self.circle.makeRobotLookAtPerson, whichPerson))
+
+    def requestQueuedAction(self, queued):
+        """
+        Tell the robot whether it has an action queued, starting with the next tick. Safe from any thread.
+        """
+        self.commands.put((self.__setQueuedAction, queued))
+
+    def __setQueuedAction(self, queued):
+        self.circle.robot.queuedAction = queued
+
+    def __applyCommands(self):
+        """
+        Run the robot commands that came in since the last tick
+        """
+        while True:
+            try:
+                (command, arg) = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            command(arg)
+
+    def step(self):
+        """
+        Advance the simulation by a single tick and publish its snapshot. Does not sleep or
+        draw, frames are drawn by render() at the display's own rate.
+        """
+        self.__applyCommands()
+
+        self.circle.update()
+
+        features = self.__writeFeatures(self.__nextRecord())
+        # only now that every field is written does the record carry the new seq, and a single
+        # reference swap publishes it: readers see either the old snapshot or the new one
+        seq = 1 if self.snapshot is None else self.snapshot.seq + 1
+        features.seq = seq
+        t = self.clock.now()
+        if self.headless:
+            self.snapshot = FeatureSnapshot(seq, t, features)
+            return features
+        # the intervals are kept every tick, drawing them waits for the next frame. What it
+        # will draw is copied into the snapshot now, render() never reads the live scene
+        self.timeline.record(features, t)
+        self.snapshot = FeatureSnapshot(seq, t, features, self.circle.frame(), self.timeline.view(t))
+        return features
 
     def run(self):
         """
         Run loop
         """
-        time.sleep(0.5)
+        self.clock.sleep(500)
         while self.running:
-            dx = 0
-            dz = 0
-
-            self.visualizer.blankScreen()
-            self.circle.updateVis(self.visualizer)
-            self.visualizer.canvas.ask_update()
-
-            features = self.getFeatures()
-            # self.timeline.update(self.visualizer, self.circle, features)
-            self.timeline.update(features)  # self.visualizer, self.circle, features)
-            time.sleep(0.05)
-
-            self.visualizer.set_keyboard_handler(self.model.queue_action)
-            # print("Features: " + str(features))
-            # self.visualizer.evalSpaceBar(self.model.queueAction, self.stopRunning)
-            self.visualizer.update()
+            self.step()
+            self.clock.sleep(self.tick_ms)
 
     def vis_features(self, observations, current_state):
         """
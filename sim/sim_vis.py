@@ -5,7 +5,8 @@
 
 import kivy
 
-from sim.util import timems
+from sim.intervals import IntervalRing, IntervalLog
+from sim.util import wallclock
 
 kivy.require('1.0.7')
 
@@ -20,6 +21,74 @@ from kivy.graphics import Rotate, Line
 from kivy.graphics.instructions import InstructionGroup
 
 import time, math, threading
+from collections import OrderedDict, namedtuple
+
+
+class TextureCache:
+    """
+    Bounded LRU cache of rendered text textures, keyed by text, font, size and color. The
+    least recently used texture goes once there are more than capacity of them.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.textures = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, font_size=12, color=(0, 0, 0, 1), font_name=None):
+        """
+        The texture of text, rasterized only if it isn't in the cache
+        """
+        key = (text, font_name, font_size, color)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textures.move_to_end(key)
+            self.hits += 1
+            return texture
+
+        self.misses += 1
+        if font_name is None:
+            mylabel = CoreLabel(text=text, font_size=font_size, color=color)
+        else:
+            mylabel = CoreLabel(text=text, font_name=font_name, font_size=font_size, color=color)
+        # Force refresh to compute things and generate the texture
+        mylabel.refresh()
+        texture = mylabel.texture
+        self.textures[key] = texture
+        if len(self.textures) > self.capacity:
+            self.textures.popitem(last=False)
+        return texture
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.textures)}
+
+    def clear(self):
+        self.textures.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# shared by every label and utterance on the screen
+textures = TextureCache()
+
+# the time labels are drawn a character at a time from these glyphs, so however long a session
+# runs they only ever need these textures
+TIME_GLYPHS = "0123456789.-"
+# characters per time label, enough for 99999.9 s, then 9999999 s
+TIME_LABEL_CHARS = 7
+
+
+def timeLabel(ms):
+    """
+    The text of a time label: seconds to a tenth, whole seconds once that doesn't fit
+    """
+    text = "%.1f" % (ms / 1000.0)
+    if len(text) > TIME_LABEL_CHARS:
+        text = "%d" % (ms // 1000)
+    if len(text) > TIME_LABEL_CHARS:
+        raise ValueError("%d ms doesn't fit in a time label" % ms)
+    return text
 
 
 class PyGameVis(FloatLayout):
@@ -53,6 +122,7 @@ class PyGameVis(FloatLayout):
         self.canvas.add(self.textGroup)
 
         self.on_keys = None
+        self.textsurface = None
 
         self.timelineheight = timelineheight
 
@@ -139,25 +209,25 @@ class PyGameVis(FloatLayout):
         """
         Draw some gibberish utterance.
         """
-        mylabel = CoreLabel(text=utterance, font_name=u'wasy10', font_size=24, color=(1, 1, 1, 1))
-        # Force refresh to compute things and generate the texture
-        mylabel.refresh()
-        # Get the texture and the texture size
-        self.texture = mylabel.texture
+        self.texture = textures.get(utterance, font_size=24, color=(1, 1, 1, 1), font_name=u'wasy10')
         # self.textsurface = self.jibfont.render(utterance, True, (255, 255, 255))
         self.textGroup.clear()
+        self.textsurface = None
 
     def putJib(self, center):
         """
         Puts the jibberish at a specific place
         """
         (x, y) = center
-        texture_size = list(self.texture.size)
-        # Draw the texture on any widget canvas
-        self.textsurface = Rectangle(texture=self.texture, size=texture_size, pos=(self.pos[0] + x,
-                                                                                   self.pos[1] + 480 - y))
-        self.textGroup.add(self.textsurface)
-        pass
+        pos = (self.pos[0] + x, self.pos[1] + 480 - y)
+        if self.textsurface is None:
+            texture_size = list(self.texture.size)
+            # Draw the texture on any widget canvas
+            self.textsurface = Rectangle(texture=self.texture, size=texture_size, pos=pos)
+            self.textGroup.add(self.textsurface)
+        else:
+            # every frame of the same utterance reuses its rectangle
+            self.textsurface.pos = pos
 
     def update(self):
         """
@@ -197,12 +267,27 @@ class MyPaintApp(App):
         return self.mybuild
 
 
+class TimelineView(namedtuple("TimelineView", ["t_begin", "t_middle", "t_end", "rows"])):
+    """
+    What a timeline frame shows: its 4 second window and, per row, the (start, end) of the
+    intervals in it
+    """
+    __slots__ = ()
+
+
 class TimelineViz:
     """
-    Timeline widget
+    Timeline widget. The instructions are built once and kept: every render only moves the points
+    of the grid and interval lines, and swaps the glyphs of a time label when its text changes.
+    Lines of intervals that scroll out of view go back to a pool for the next new interval.
+
+    Each row only keeps its last capacity intervals (see sim.intervals). Give history a path
+    to keep the older ones in an interval log on disk instead of dropping them, and close()
+    the timeline at the end of the session to write the rest.
     """
 
-    def __init__(self, x, height, instruc_group):
+    def __init__(self, x, height, instruc_group, clock=None, capacity=256, history=None):
+        self.clock = clock if clock is not None else wallclock
         self.height = height
         self.width = 500
 
@@ -213,20 +298,56 @@ class TimelineViz:
                                   ["Robot:", lambda x: x[3][0] == -1]]
 
         self.timelines = None
-        self.t_init = timems()
+        self.capacity = capacity
+        self.history = history
+        self.log = None
+        self.t_init = self.clock.now()
         self.t_last = self.t_init
 
         self.instructs = instruc_group
         self.x = x
 
+        # retained instructions, built on the first render
+        self.glyphs = None
+        self.timelabels = None
+        self.timeorigins = None
+        self.timetexts = None
+        self.secondlines = None
+        # per row, the lines of the visible intervals
+        self.segments = None
+        self.pool = []
+
     def update(self, features):
         """
-        On update
+        On update: record the tick and draw it right away
+        """
+        t_now = self.clock.now()
+        self.record(features, t_now)
+        self.render(self.view(t_now))
+
+    def record(self, features, t_now):
+        """
+        Keep the intervals of a tick. Touches no kivy, the sim calls this every tick
         """
         if self.timelines == None:
-            self.timelines = [[]] * len(self.feature_xtracters)
+            if self.history is not None:
+                self.log = IntervalLog(self.history, self.t_init)
+            self.timelines = [IntervalRing(self.capacity, self.log, row) for row in range(len(self.feature_xtracters))]
+
+        for row in range(len(self.timelines)):
+            # for that row, determine if start, extend, or end
+            if self.feature_xtracters[row][1](features):
+                self.timelines[row].extend(t_now)
+            else:
+                self.timelines[row].close()
 
-        t_now = timems()
+    def view(self, t_now):
+        """
+        The 4 second window around t_now and the intervals in it, copied out of the rings.
+        Touches no kivy, the sim publishes one with every tick. None before the first record
+        """
+        if self.timelines == None:
+            return None
         if t_now - self.t_init > 2000:
             t_begin = t_now - 2000
             t_middle = t_now
@@ -235,124 +356,163 @@ class TimelineViz:
             t_begin = self.t_init
             t_middle = t_begin + 2000
             t_end = t_begin + 4000
+        rows = [timeline.window(t_begin, t_end) for timeline in self.timelines]
+        return TimelineView(t_begin, t_middle, t_end, rows)
 
-        # print("Features: " + str(features))
-        now_state = list(map(lambda fn: fn[1](features), self.feature_xtracters))
-        # print("now state: " + str(now_state))
-
-        for row in range(len(self.timelines)):
-            numlinesinrow = len(self.timelines[row])
-            # for that row, determine if start, extend, or end
-            if now_state[row]:
-                # continue or start
-                if numlinesinrow > 0:
-                    # something here.. check if we should continue it or stop it
-                    if len(self.timelines[row][numlinesinrow - 1]) == 3:
-                        # start a new one - the last one had an end marker
-                        newlines = list(self.timelines[row])
-                        newlines.append([t_now, t_now])
-                        self.timelines[row] = newlines
-                    else:
-                        self.timelines[row][numlinesinrow - 1][1] = t_now
-                else:
-                    # nothing on this line at all. just start a new line
-                    newlines = list(self.timelines[row])
-                    newlines.append([t_now, t_now])
-                    self.timelines[row] = newlines
-            else:
-                # end
-                if numlinesinrow > 0 and len(self.timelines[row][numlinesinrow - 1]) == 2:
-                    # end it
-                    (self.timelines[row][numlinesinrow - 1]).append(None)
+    def render(self, view):
+        """
+        Draw a view. Call it from the UI thread
+        """
+        if view is None:
+            return
+        if self.segments == None:
+            self.build()
+        self.render_timegrid(view)
 
-        # prune the lines
+    def build(self):
+        """
+        Create the instructions that stay for the whole session
+        """
         self.instructs.clear()
         self.instructs.add(Color(1., 1., 1.))
         self.instructs.add(Rectangle(size=(self.width, self.height), pos=(self.x, 0)))
 
-        self.render_timegrid(t_begin, t_middle, t_end)
+        # begin, middle and end time, one rectangle per character. The glyph textures are
+        # rasterized once and swapped in as the text changes
+        self.glyphs = {c: self.render_text(c) for c in TIME_GLYPHS}
+        y = 5
+        self.timeorigins = [(self.x + x, y) for x in (0, (self.width / 2) - 8, self.width - 17)]
+        self.timelabels = [[Rectangle(size=(0, 0), pos=origin) for _ in range(TIME_LABEL_CHARS)]
+                           for origin in self.timeorigins]
+        self.timetexts = [None] * len(self.timelabels)
+        for label in self.timelabels:
+            for char in label:
+                self.instructs.add(char)
+
+        # the line delineating the text at the bottom
+        self.instructs.add(Color(200. / 255., 200. / 255., 200. / 255.))
+        self.instructs.add(Line(points=[self.x, 20, self.x + self.width, 20], width=1))
+
+        # the seconds lines, at most 5 fall in the 4 s window
+        self.instructs.add(Color(210. / 255., 210. / 255., 210. / 255.))
+        self.secondlines = [Line(points=[], width=1) for _ in range(5)]
+        for line in self.secondlines:
+            self.instructs.add(line)
+
+        timelinecolor = (0, 200, 200)
+        self.instructs.add(Color(rgb=timelinecolor))
+        y = self.height - 12
+        for (label, _) in self.feature_xtracters:
+            self.instructs.add(self.get_text_texture(str(label), (self.x, y)))
+            y = y - 13
+        # interval lines get added after this, in the timeline color
+        self.segments = [[] for _ in self.feature_xtracters]
+
+    def close(self):
+        """
+        End the session: the intervals still in the rings go to the interval log, if there
+        is one, and the log is closed
+        """
+        if self.log is None:
+            return
+        for timeline in self.timelines:
+            timeline.flush()
+        self.log.close()
+        self.log = None
+
+    def render_text(self, textO):
+        """
+        The texture of a piece of text, from the shared cache
+        """
+        return textures.get(textO, font_size=12, color=(0, 0, 0, 1))
 
     def get_text_texture(self, textO, posO):
         """
         Creates a texture for the text at a specific position
         """
-        mylabel = CoreLabel(text=textO, font_size=12, color=(0, 0, 0, 1))
-        # Force refresh to compute things and generate the texture
-        mylabel.refresh()
-        # Get the texture and the texture size
-        texture = mylabel.texture
+        texture = self.render_text(textO)
         texture_size = list(texture.size)
         # Draw the texture on any widget canvas
         return Rectangle(texture=texture, size=texture_size, pos=posO)
 
-    def render_timegrid(self, tbegin, tmid, tend):
+    def set_time_label(self, i, textO):
         """
-        Renders the grid to the canvas
+        Lay out the glyphs of textO in time label i, the characters it doesn't need are hidden.
+        Only TIME_GLYPHS can be drawn, in at most TIME_LABEL_CHARS characters
         """
+        if len(textO) > TIME_LABEL_CHARS:
+            raise ValueError("Time label %r is longer than %d characters" % (textO, TIME_LABEL_CHARS))
+        missing = set(textO) - set(TIME_GLYPHS)
+        if missing:
+            raise ValueError("Time label %r has characters without a glyph: %s" % (textO, sorted(missing)))
+        (x, y) = self.timeorigins[i]
+        for (j, char) in enumerate(self.timelabels[i]):
+            if j < len(textO):
+                texture = self.glyphs[textO[j]]
+                char.texture = texture
+                char.size = list(texture.size)
+                char.pos = (x, y)
+                x += texture.size[0]
+            else:
+                char.size = (0, 0)
+
+    def render_timegrid(self, view):
+        """
+        Moves the grid and the interval lines to the view's window
+        """
+        (tbegin, tmid, tend) = (view.t_begin, view.t_middle, view.t_end)
         tb_act = (tbegin - self.t_init) / 1000.0
-        tm_act = (tmid - self.t_init) / 1000.0
         te_act = (tend - self.t_init) / 1000.0
 
         # Render the text
-        y = 5
-        x = int(0)
-        textO = str("{0:.1f}".format(tb_act))
-        self.instructs.add(self.get_text_texture(textO, (self.x + x, y)))
+        for (i, t) in enumerate((tbegin, tmid, tend)):
+            textO = timeLabel(t - self.t_init)
+            if textO != self.timetexts[i]:
+                self.set_time_label(i, textO)
+                self.timetexts[i] = textO
 
-        x = (self.width / 2) - 8
-        textO = str("{0:.1f}".format(tm_act))
-        self.instructs.add(self.get_text_texture(textO, (self.x + x, y)))
-
-        x = self.width - 17
-        textO = str("{0:.1f}".format(te_act))
-        self.instructs.add(self.get_text_texture(textO, (self.x + x, y)))
-
-        # Render the line delineating the text at the bottom
-        self.instructs.add(Color(200. / 255., 200. / 255., 200. / 255.))
-        self.instructs.add(Line(points=[self.x, 20, self.x + self.width, 20], width=1))
-
-        self.instructs.add(Color(210. / 255., 210. / 255., 210. / 255.))
         # Mark the seconds lines
         pt = int(tb_act)
-        for _ in range(5):
+        for line in self.secondlines:
             if tb_act < pt < te_act:
                 npt = (pt - tb_act) / 4.0
                 x = npt * self.width
-                self.instructs.add(Line(points=[self.x + x, self.height, self.x + x, 20], width=1))
+                line.points = [self.x + x, self.height, self.x + x, 20]
+            else:
+                line.points = []
             pt = pt + 1
 
-        timelinecolor = (0, 200, 200)
         y = self.height - 12
         # Actually draw the lines
-        for row in range(len(self.timelines)):
-            lines = self.timelines[row]
-            linestokeep = list([])
-            self.instructs.add(Color(rgb=timelinecolor))
-
-            for line in lines:
-                # check if the line is in bounds
-                line_start = line[0]
-                line_end = line[1]
-
-                if (tbegin < line_start < tend) or (tbegin < line_end < tend):
-                    # don't cull the line, it's in bounds
-                    linestokeep.append(line)
-                    line_start = max(line_start, tbegin) - tbegin
-                    line_end = min(line_end, tend) - tbegin
-
-                    # normalize them
-                    line_begin_norm = line_start / 4000.0
-                    line_end_norm = line_end / 4000.0
-
-                    # now fit them to the width
-                    x_start = line_begin_norm * self.width
-                    x_end = line_end_norm * self.width
-                    self.instructs.add(Line(points=[self.x + x_start, y, self.x + x_end, y], width=1))
-
-            #            self.timelines[row] = linestokeep
-            label = str(self.feature_xtracters[row][0])
-
-            self.instructs.add(self.get_text_texture(label, (self.x, y)))
+        for row in range(len(view.rows)):
+            visible = view.rows[row]
+            segments = self.segments[row]
+
+            # one line per visible interval, lines that scrolled out go back to the pool
+            while len(segments) > len(visible):
+                segment = segments.pop()
+                segment.points = []
+                self.pool.append(segment)
+            while len(segments) < len(visible):
+                if self.pool:
+                    segments.append(self.pool.pop())
+                else:
+                    segment = Line(points=[], width=1)
+                    self.instructs.add(segment)
+                    segments.append(segment)
+
+            for (segment, (line_start, line_end)) in zip(segments, visible):
+                line_start = max(line_start, tbegin) - tbegin
+                line_end = min(line_end, tend) - tbegin
+
+                # normalize them
+                line_begin_norm = line_start / 4000.0
+                line_end_norm = line_end / 4000.0
+
+                # now fit them to the width
+                x_start = line_begin_norm * self.width
+                x_end = line_end_norm * self.width
+                segment.points = [self.x + x_start, y, self.x + x_end, y]
             y = y - 13
 
 
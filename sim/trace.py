@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+#
+# Trace events. The hot path records small typed events into a preallocated ring buffer
+# instead of printing. Call sites check the level first, so a disabled trace costs one
+# comparison:
+#
+#   if trace.LEVEL >= trace.INFO:
+#       trace.emit(trace.TURN_CHANGE, whospeaking)
+#
+# There is one ring per process. Every event also records the source that was current when it
+# was emitted, so the events of many sessions on one loop (sim.aio.runSessions) or many groups
+# of a Room can be told apart. Whoever steps a sim or a model sets its source first:
+#
+#   trace.setSource(session.source)
+#
+
+import numpy as np
+
+from sim.util import wallclock
+
+# levels
+OFF = 0
+INFO = 1
+DEBUG = 2
+
+# event kinds, and what a and b hold for each
+TURN_CHANGE = 1     # a: who got the turn
+FOOTING = 2         # a: 1 if nobody took the last attempt and we are trying again
+GAZE = 3            # a: who everyone is looking at
+FSM_TRANSITION = 4  # a: state index left, b: state index entered
+FEATURES = 5        # a: voice activity, b: who is talking
+CUE = 6             # a: cue kind (sim.latency), b: ms since the cue happened
+REACTION = 7        # a: reaction kind (sim.latency)
+
+NAMES = {TURN_CHANGE: "turn change",
+         FOOTING: "footing attempt",
+         GAZE: "gaze",
+         FSM_TRANSITION: "fsm transition",
+         FEATURES: "features",
+         CUE: "cue",
+         REACTION: "reaction"}
+
+EVENT_DTYPE = np.dtype([("t", np.int64), ("kind", np.uint8), ("source", np.int32), ("a", np.int32), ("b", np.int32)])
+
+LEVEL = OFF
+# who the events being emitted belong to, see setSource
+SOURCE = 0
+
+
+class Tracer:
+    """
+    Fixed capacity ring buffer of events. Once full, the oldest events get overwritten.
+    """
+
+    def __init__(self, capacity=65536, clock=None, echo=False):
+        self.events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.capacity = capacity
+        self.clock = clock if clock is not None else wallclock
+        # also print every event, like the sim used to
+        self.echo = echo
+        self.count = 0
+
+    def emit(self, kind, a=0, b=0):
+        """
+        Record one event
+        """
+        t = self.clock.now()
+        self.events[self.count % self.capacity] = (t, kind, SOURCE, a, b)
+        self.count += 1
+        if self.echo:
+            print("[%d] #%d %s %d %d" % (t, SOURCE, NAMES.get(kind, kind), a, b))
+
+    def dropped(self):
+        """
+        How many events got overwritten
+        """
+        return max(0, self.count - self.capacity)
+
+    def ordered(self):
+        """
+        The events still in the buffer, oldest first
+        """
+        if self.count <= self.capacity:
+            return self.events[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate([self.events[start:], self.events[:start]])
+
+    def dump(self, path):
+        """
+        Write the events out as a binary .npy file, load them back with numpy.load
+        """
+        np.save(path, self.ordered())
+
+    def clear(self):
+        self.count = 0
+
+
+tracer = Tracer(capacity=1)
+
+
+def enable(level=INFO, capacity=65536, clock=None, echo=False):
+    """
+    Start tracing into a fresh buffer. Returns the tracer
+    """
+    global LEVEL, tracer
+    tracer = Tracer(capacity, clock, echo)
+    LEVEL = level
+    return tracer
+
+
+def disable():
+    global LEVEL
+    LEVEL = OFF
+
+
+def setSource(source):
+    """
+    Tag the events emitted from now on with source (a session id, a Room group). Returns the
+    previous source
+    """
+    global SOURCE
+    previous = SOURCE
+    SOURCE = source
+    return previous
+
+
+def emit(kind, a=0, b=0):
+    """
+    Record an event on the current tracer. Check LEVEL before calling this
+    """
+    tracer.emit(kind, a, b)
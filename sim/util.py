@@ -1,8 +1,80 @@
+import random
 import time
 
+import numpy as np
+
 
 def timems():
     """
     Get the time in milliseconds
     """
     return int(round(time.time() * 1000))
+
+
+class WallClock:
+    """
+    Real time. This is what the interactive GUI runs on.
+    """
+
+    def now(self):
+        """
+        Current time in milliseconds
+        """
+        return timems()
+
+    def sleep(self, ms):
+        """
+        Block for ms milliseconds
+        """
+        time.sleep(ms / 1000.0)
+
+
+class SimClock:
+    """
+    Simulated time in milliseconds. It only moves when somebody sleeps on it or advances it,
+    so an episode runs as fast as the CPU allows. Meant to be driven from a single thread.
+    """
+
+    def __init__(self, start=0):
+        self.t = start
+
+    def now(self):
+        """
+        Current simulated time in milliseconds
+        """
+        return self.t
+
+    def sleep(self, ms):
+        """
+        Sleeping on simulated time just moves it forward
+        """
+        self.t += ms
+
+    def advance(self, ms):
+        """
+        Move time forward by ms milliseconds
+        """
+        self.t += ms
+
+
+wallclock = WallClock()
+
+
+class SpawnableRandom(random.Random):
+    """
+    A random.Random seeded from a numpy SeedSequence. Every scene owns one of these, so a run
+    can be replayed bit-for-bit from its seed, and spawn() hands out statistically independent
+    children for worker processes or batch lanes.
+    """
+
+    def __init__(self, seed=None):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seedseq = seed
+        random.Random.__init__(self, int.from_bytes(seed.generate_state(8).tobytes(), "little"))
+
+    def spawn(self, n):
+        """
+        n independent child generators
+        """
+        return [SpawnableRandom(child) for child in self.seedseq.spawn(n)]
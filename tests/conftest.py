@@ -0,0 +1,4 @@
+import fakekivy
+
+# before anything imports sim.sim_vis
+fakekivy.install()
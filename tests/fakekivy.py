@@ -0,0 +1,80 @@
+#
+# Just enough of kivy for sim.sim_vis to import and build its instructions without a display.
+# Instructions keep whatever they are given as attributes, CoreLabel counts its rasterizations.
+#
+
+import sys
+import types
+
+
+class Instruction:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        for (name, value) in kwargs.items():
+            setattr(self, name, value)
+
+
+class Line(Instruction):
+    pass
+
+
+class Rectangle(Instruction):
+    pass
+
+
+class InstructionGroup:
+    def __init__(self):
+        self.children = []
+
+    def add(self, instruction):
+        self.children.append(instruction)
+
+    def clear(self):
+        self.children = []
+
+
+class Texture:
+    def __init__(self, text, font_size):
+        self.text = text
+        self.size = (len(text) * font_size // 2, font_size)
+
+
+class CoreLabel:
+    """
+    Rasterizes nothing, counts the refresh() calls that would have
+    """
+
+    refreshes = 0
+
+    def __init__(self, text="", font_size=12, **kwargs):
+        self.text = text
+        self.font_size = font_size
+        self.texture = None
+
+    def refresh(self):
+        CoreLabel.refreshes += 1
+        self.texture = Texture(self.text, self.font_size)
+
+
+def module(name, **attributes):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attributes)
+    sys.modules[name] = mod
+    return mod
+
+
+def install():
+    """
+    Put the stand-ins in sys.modules, in place of kivy whether or not it is installed
+    """
+    graphics = {name: type(name, (Instruction,), {})
+                for name in ("Mesh", "PushMatrix", "PopMatrix", "Color", "Ellipse", "Rotate")}
+    module("kivy", require=lambda version: None)
+    module("kivy.app", App=type("App", (), {}))
+    module("kivy.uix")
+    module("kivy.uix.floatlayout", FloatLayout=type("FloatLayout", (), {}))
+    module("kivy.core")
+    module("kivy.core.window", Window=types.SimpleNamespace(size=(0, 0)))
+    module("kivy.core.text", Label=CoreLabel)
+    module("kivy.graphics", Line=Line, Rectangle=Rectangle, **graphics)
+    module("kivy.graphics.instructions", InstructionGroup=InstructionGroup)
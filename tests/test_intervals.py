@@ -0,0 +1,73 @@
+import numpy as np
+
+from sim.intervals import SESSION, IntervalLog, IntervalRing, intervalSessions, readIntervalLog
+
+
+def ring_of(intervals, capacity=4):
+    ring = IntervalRing(capacity)
+    for (start, end) in intervals:
+        for t in range(start, end + 1, 10):
+            ring.extend(t)
+        ring.close()
+    return ring
+
+
+def test_window_overlapping_oldest_first():
+    ring = ring_of([(0, 100), (200, 300), (400, 500)])
+    assert ring.window(0, 1000) == [(0, 100), (200, 300), (400, 500)]
+    assert ring.window(250, 450) == [(200, 300), (400, 500)]
+    assert ring.window(310, 390) == []
+    # an interval ending exactly at tbegin still shows, one starting at tend doesn't
+    assert ring.window(100, 400) == [(0, 100), (200, 300)]
+
+
+def test_window_extends_the_open_interval():
+    ring = IntervalRing(4)
+    ring.extend(0)
+    ring.extend(50)
+    assert ring.open
+    assert ring.window(0, 100) == [(0, 50)]
+    ring.extend(80)
+    assert ring.window(60, 100) == [(0, 80)]
+
+
+def test_window_only_sees_what_the_ring_keeps():
+    ring = ring_of([(k * 100, k * 100 + 50) for k in range(10)], capacity=4)
+    assert len(ring) == 4
+    assert ring.dropped() == 6
+    assert ring.window(0, 10000) == [(600, 650), (700, 750), (800, 850), (900, 950)]
+    (start, end) = ring.ordered()
+    assert start.tolist() == [600, 700, 800, 900]
+    assert np.all(end - start == 50)
+
+
+def test_log_reads_back_every_session(tmp_path):
+    path = str(tmp_path / "timeline.bin")
+    for (session, origin) in enumerate((0, 5000)):
+        log = IntervalLog(path, origin)
+        ring = IntervalRing(2, log, row=session)
+        for k in range(5):
+            ring.extend(origin + k * 100)
+            ring.extend(origin + k * 100 + 50)
+            ring.close()
+        assert ring.dropped() == 3
+        ring.flush()
+        log.close()
+
+    records = readIntervalLog(path)
+    assert np.count_nonzero(records["row"] == SESSION) == 2
+    sessions = intervalSessions(records)
+    assert [int(header["end"]) for (header, _) in sessions] == [0, 5000]
+    assert sessions[0][0]["start"] <= sessions[1][0]["start"]
+    for (session, (header, intervals)) in enumerate(sessions):
+        origin = int(header["end"])
+        # the dropped intervals, then the ones still in the ring, oldest first
+        assert intervals["row"].tolist() == [session] * 5
+        assert intervals["start"].tolist() == [origin + k * 100 for k in range(5)]
+        assert (intervals["end"] - intervals["start"]).tolist() == [50] * 5
+
+
+def test_flush_without_a_log():
+    ring = ring_of([(0, 100)])
+    ring.flush()
+    assert ring.window(0, 1000) == [(0, 100)]
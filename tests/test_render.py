@@ -0,0 +1,77 @@
+from fakekivy import InstructionGroup
+
+from sim import sim_vis
+from sim.null_vis import NullVis
+from sim.sim import Scene
+from sim.util import SimClock, SpawnableRandom
+
+
+class RecordingVis(NullVis):
+    """
+    Keeps what the last frame drew
+    """
+
+    def __init__(self):
+        NullVis.__init__(self)
+        self.thetas = []
+        self.gesturing = []
+        self.jibs = []
+        self.shown = 0
+
+    def blankScreen(self):
+        self.thetas = []
+        self.gesturing = []
+
+    def drawChar(self, center, pos, drawOuterCircle, thetaRot, color, thechar):
+        self.thetas.append(thetaRot)
+        self.gesturing.append(drawOuterCircle)
+
+    def drawJib(self, utterance):
+        self.jibs.append(utterance)
+
+    def putJib(self, center):
+        self.shown += 1
+
+
+def test_scene_draws_the_frame_not_the_live_scene():
+    clock = SimClock()
+    vis = RecordingVis()
+    scene = Scene(4, vis, clock, SpawnableRandom(7))
+    while not scene.bubbler.isSpeaking():
+        scene.update()
+        clock.advance(50)
+    frame = scene.frame()
+    assert len(frame.thetas) == len(frame.gesturing) == 5
+    assert frame.speaking
+
+    # the scene moves on until the utterance is over and the gaze has turned
+    while scene.frame().utterance is frame.utterance or scene.frame().thetas == frame.thetas:
+        scene.update()
+        clock.advance(50)
+
+    vis.blankScreen()
+    scene.draw(frame)
+    assert vis.thetas == list(frame.thetas)
+    assert vis.gesturing == list(frame.gesturing)
+    assert vis.jibs == [frame.utterance]
+    assert vis.shown == 1
+
+
+def test_timeline_draws_the_view_not_the_rings():
+    clock = SimClock()
+    timeline = sim_vis.TimelineViz(0, 100, InstructionGroup(), clock=clock)
+    for k in range(100):
+        timeline.record(([0, True], [], [], [k // 20 % 4], []), clock.now())
+        clock.advance(50)
+    view = timeline.view(clock.now() - 50)
+    # the rings go on, the view doesn't
+    for k in range(100):
+        timeline.record(([0, True], [], [], [-1], []), clock.now())
+        clock.advance(50)
+    assert timeline.timelines[4].window(view.t_begin, view.t_end)
+
+    timeline.render(view)
+    drawn = [len(segments) for segments in timeline.segments]
+    assert drawn == [len(row) for row in view.rows]
+    assert drawn[4] == 0
+    assert timeline.timetexts == [sim_vis.timeLabel(t) for t in (view.t_begin, view.t_middle, view.t_end)]
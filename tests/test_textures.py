@@ -0,0 +1,69 @@
+import pytest
+from fakekivy import CoreLabel, InstructionGroup
+
+from sim import sim_vis
+from sim.util import SimClock
+
+
+def test_least_recently_used_goes_first():
+    cache = sim_vis.TextureCache(capacity=2)
+    a = cache.get("a")
+    cache.get("b")
+    assert cache.get("a") is a
+    cache.get("c")
+    assert list(key[0] for key in cache.textures) == ["a", "c"]
+    assert cache.stats() == {"hits": 1, "misses": 3, "size": 2}
+
+    # b was dropped, so it is rasterized again and pushes out a
+    refreshes = CoreLabel.refreshes
+    cache.get("b")
+    assert CoreLabel.refreshes == refreshes + 1
+    assert list(key[0] for key in cache.textures) == ["c", "b"]
+    assert cache.stats() == {"hits": 1, "misses": 4, "size": 2}
+
+
+def test_key_is_text_font_size_and_color():
+    cache = sim_vis.TextureCache()
+    cache.get("x")
+    cache.get("x", font_size=14)
+    cache.get("x", color=(1, 0, 0, 1))
+    cache.get("x", font_name="wasy10.ttf")
+    cache.get("x")
+    assert cache.stats() == {"hits": 1, "misses": 4, "size": 4}
+    cache.clear()
+    assert cache.stats() == {"hits": 0, "misses": 0, "size": 0}
+
+
+def test_time_labels_rasterize_nothing_after_warm_up():
+    clock = SimClock()
+    timeline = sim_vis.TimelineViz(0, 100, InstructionGroup(), clock=clock)
+    features = ([0, True], [], [], [0], [])
+    timeline.update(features)
+    refreshes = CoreLabel.refreshes
+    hits = sim_vis.textures.stats()["hits"]
+    # ten minutes of frames, every label text a new one
+    for _ in range(6000):
+        clock.advance(100)
+        timeline.update(features)
+    assert CoreLabel.refreshes == refreshes
+    assert sim_vis.textures.stats()["hits"] == hits
+    assert timeline.timetexts == ["598.0", "600.0", "602.0"]
+
+
+def test_time_label_text():
+    assert sim_vis.timeLabel(0) == "0.0"
+    assert sim_vis.timeLabel(12345) == "12.3"
+    assert sim_vis.timeLabel(99999900) == "99999.9"
+    # a tenth no longer fits, whole seconds do
+    assert sim_vis.timeLabel(100000000) == "100000"
+    with pytest.raises(ValueError):
+        sim_vis.timeLabel(10 ** 10)
+
+
+def test_time_label_refuses_what_it_cant_draw():
+    timeline = sim_vis.TimelineViz(0, 100, InstructionGroup(), clock=SimClock())
+    timeline.update(([0, False], [], [], [-2], []))
+    with pytest.raises(ValueError):
+        timeline.set_time_label(0, "1e+05")
+    with pytest.raises(ValueError):
+        timeline.set_time_label(0, "12345678")
@@ -0,0 +1,73 @@
+from fakekivy import InstructionGroup, Line
+
+from sim import sim_vis
+from sim.intervals import intervalSessions, readIntervalLog
+from sim.util import SimClock
+
+
+def features(speaker):
+    """
+    A tick where speaker (0-3, -1 for the robot, None for nobody) has the turn
+    """
+    return ([0, speaker is not None], [], [], [-2 if speaker is None else speaker], [])
+
+
+def run(timeline, clock, ticks, speakers):
+    for _ in range(ticks):
+        timeline.update(features(speakers(clock.now())))
+        clock.advance(50)
+
+
+def lines(group):
+    return [instruction for instruction in group.children if isinstance(instruction, Line)]
+
+
+def test_segment_pool_keeps_the_instructions_constant():
+    clock = SimClock()
+    group = InstructionGroup()
+    timeline = sim_vis.TimelineViz(0, 100, group, clock=clock)
+    # a new 300 ms utterance every 400 ms, taking turns round the circle
+    speakers = lambda t: None if t % 400 >= 300 else [0, 1, 2, 3, -1][t // 400 % 5]
+
+    run(timeline, clock, 400, speakers)
+    warm = len(group.children)
+    run(timeline, clock, 2000, speakers)
+    assert len(group.children) == warm
+
+    # the pooled lines draw nothing, the others are the visible intervals
+    drawn = sum(len(segments) for segments in timeline.segments)
+    assert timeline.pool
+    assert all(segment.points == [] for segment in timeline.pool)
+    assert all(segment.points for segments in timeline.segments for segment in segments)
+    # the 4 s window shows at most 11 intervals of 400 ms
+    assert drawn <= 11
+    # the text line and the 5 seconds lines, then one line per interval ever drawn at once
+    assert len(lines(group)) == 1 + 5 + drawn + len(timeline.pool)
+
+
+def test_segments_follow_the_window():
+    clock = SimClock()
+    group = InstructionGroup()
+    timeline = sim_vis.TimelineViz(0, 100, group, clock=clock)
+    run(timeline, clock, 200, lambda t: 0 if t % 1000 < 500 else None)
+
+    t_now = clock.now() - 50
+    visible = timeline.timelines[0].window(t_now - 2000, t_now + 2000)
+    assert len(timeline.segments[0]) == len(visible)
+    assert not any(timeline.segments[row] for row in range(1, 5))
+
+
+def test_close_writes_the_whole_timeline(tmp_path):
+    path = str(tmp_path / "timeline.bin")
+    clock = SimClock(1000)
+    timeline = sim_vis.TimelineViz(0, 100, InstructionGroup(), clock=clock, capacity=4, history=path)
+    run(timeline, clock, 200, lambda t: 0 if t % 1000 < 500 else None)
+    kept = timeline.timelines[0].ordered()[0].tolist()
+    timeline.close()
+    timeline.close()
+
+    [(header, intervals)] = intervalSessions(readIntervalLog(path))
+    assert header["end"] == 1000
+    assert intervals["row"].tolist() == [0] * 10
+    assert intervals["start"].tolist() == [1000 + k * 1000 for k in range(10)]
+    assert intervals["start"][-len(kept):].tolist() == kept
@@ -3,6 +3,8 @@
 # Implementation of a finite state machine
 #
 
+import sim.trace as trace
+
 DEBUG = False
 
 
@@ -65,15 +67,22 @@ class FSM:
     def __init__(self, states):
         self.all_states = states
         self.cur_state = states[0]
+        # transition table from tt.fsm_compiler.compileFSM, update() goes through it when set
+        self.table = None
 
     def update(self, observations):
         """
         Update function takes observations and sees which state to move to
         """
+        if self.table is not None and self.cur_state is not None:
+            return self.table.update(self, observations)
         if self.cur_state is not None:
             prev_state = self.cur_state
             self.cur_state = self.cur_state.nextState(observations)
             if self.cur_state != prev_state:
+                if trace.LEVEL >= trace.INFO:
+                    trace.emit(trace.FSM_TRANSITION, self.all_states.index(prev_state),
+                               self.all_states.index(self.cur_state))
                 prev_state.onEnd()
                 self.cur_state.onStart()
         return self.cur_state
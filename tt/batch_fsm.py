@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# Batched FSM evaluation. Advances B copies of one state machine at once: a (B, F) matrix of
+# observations and a (B,) vector of state indices in, the (B,) next states out.
+#
+# Predicates carrying an expression (see tt.fsm_compiler.expression) get rewritten into numpy
+# mask code:
+#
+#   o[9] > 50 and not o[4]    ->    (O[:, 9] > 50) & ~(O[:, 4] != 0)
+#
+# Any other predicate is called row by row on the agents that still need it, so every machine
+# works, only slower. Either way the states come out exactly as B scalar FSM.update calls
+# would leave them.
+#
+
+import ast
+
+import numpy as np
+
+from tt.fsm_compiler import TransitionTable, foldedExpression
+
+
+class Columns(ast.NodeTransformer):
+    """
+    o[k] -> O[:, k]
+    """
+
+    def visit_Subscript(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == "o":
+            column = ast.Tuple(elts=[ast.Slice(), node.slice], ctx=ast.Load())
+            return ast.Subscript(value=ast.Name(id="O", ctx=ast.Load()), slice=column, ctx=ast.Load())
+        return self.generic_visit(node)
+
+
+def vectorValue(node):
+    """
+    A value (o[k], a constant, arithmetic on those) as a column expression
+    """
+    if any(isinstance(n, (ast.BoolOp, ast.Not)) for n in ast.walk(node)):
+        # `and`/`or` hand back one of their operands, not a bool, so the
+        # elementwise version would not always agree
+        raise ValueError("Logic inside a value can't be vectorized")
+    return Columns().visit(node)
+
+
+def vectorTruth(node):
+    """
+    The truth of node as a bool mask expression: and/or/not become &, |, ~, and anything
+    that isn't a comparison gets compared with 0
+    """
+    if isinstance(node, ast.BoolOp):
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = vectorTruth(node.values[0])
+        for value in node.values[1:]:
+            result = ast.BinOp(left=result, op=op, right=vectorTruth(value))
+        return result
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ast.UnaryOp(op=ast.Invert(), operand=vectorTruth(node.operand))
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        return ast.Compare(left=vectorValue(node.left), ops=node.ops,
+                           comparators=[vectorValue(node.comparators[0])])
+    return ast.Compare(left=vectorValue(node), ops=[ast.NotEq()], comparators=[ast.Constant(0)])
+
+
+def vectorizedPredicate(fn):
+    """
+    fn as a function O -> (len(O),) bool mask, or None if it has no expression that can be
+    vectorized
+    """
+    folded = foldedExpression(fn)
+    if folded is None:
+        return None
+    try:
+        body = vectorTruth(folded)
+    except ValueError:
+        return None
+    source = "lambda O: %s" % ast.unparse(body)
+    mask = eval(compile(source, "<vectorized %s>" % fn.__name__, "eval"), {})
+    mask.source = source
+    return mask
+
+
+class BatchFSM:
+    """
+    B agents running the same FSM. States are numbered like the TransitionTable of the FSM,
+    so state i is table.states[i].
+
+    step() is pure: no onStart/onEnd callbacks run. Whatever an agent's callbacks would have
+    done has to be done by the caller, e.g. on the agents where step(...) != current.
+    """
+
+    def __init__(self, fsm):
+        self.table = TransitionTable(fsm.all_states)
+        self.nstates = len(self.table.states)
+        # per state, the list of (mask function or None, scalar predicate, target)
+        self.transitions = []
+        self.vectorized = 0
+        for i in range(self.nstates):
+            transitions = []
+            for (fn, target) in zip(self.table.predicates[i], self.table.targets[i]):
+                mask = vectorizedPredicate(fn)
+                if mask is not None:
+                    self.vectorized += 1
+                transitions.append((mask, fn, target))
+            self.transitions.append(transitions)
+
+    def initial(self, nagents, state=None):
+        """
+        (nagents,) state vector with everyone in state (the FSM's first state by default)
+        """
+        i = self.table.index[state] if state is not None else 0
+        return np.full(nagents, i, dtype=np.int64)
+
+    def names(self, current):
+        """
+        State names of a state vector
+        """
+        return [self.table.states[i].name for i in current]
+
+    def step(self, observations, current):
+        """
+        Next state of every agent. observations is (B, F), current the (B,) state indices.
+        Transitions are tried in order and the first one that holds wins, like FSMNode.nextState.
+        """
+        observations = np.asarray(observations)
+        nxt = current.copy()
+        for i in range(self.nstates):
+            if not self.transitions[i]:
+                continue
+            rows = np.flatnonzero(current == i)
+            if not len(rows):
+                continue
+            O = observations[rows]
+            undecided = np.ones(len(rows), dtype=bool)
+            for (mask, fn, target) in self.transitions[i]:
+                if mask is not None:
+                    fired = np.broadcast_to(mask(O), undecided.shape) & undecided
+                else:
+                    # only ask the agents the scalar FSM would have asked
+                    fired = np.zeros(len(rows), dtype=bool)
+                    waiting = np.flatnonzero(undecided)
+                    for (k, observation) in zip(waiting, O[waiting].tolist()):
+                        fired[k] = bool(fn(observation))
+                nxt[rows[fired]] = target
+                undecided &= ~fired
+                if not undecided.any():
+                    break
+        return nxt
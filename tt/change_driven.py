@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# Change-driven model stepping. Most ticks nothing the model looks at changes (someone is
+# halfway through an utterance), so re-running the observation transform and the FSM gives
+# the same answer as last tick. ChangeDriven only re-evaluates a model when
+#   - the feature record changed (its version, which the simulator bumps whenever it writes
+#     features that differ from the last ones),
+#   - one of the model's own inputs changed (action queued / running),
+#   - the last evaluation made a transition, or
+#   - a time threshold of the current state's predicates (the 50/70/120/170 ms of
+#     otherhas_itake, itake_otherhas) is reached.
+# The thresholds come from the predicates' @expression (tt.fsm_compiler.thresholds): the
+# comparisons of the columns declared with time=(...). A state with a predicate that has no
+# usable expression is evaluated every tick.
+#
+# This relies on the time columns (time since last activity) growing with the clock, or being
+# reset, while the features stay the same, and on every other column only changing with the
+# features. Both models' observations work like that.
+#
+
+import ast
+import math
+import operator
+
+from tt.fsm_compiler import thresholds
+
+# comparisons that flip when the left side grows past the constant: at v > c, or at v >= c
+FLIP_ABOVE = (ast.Gt, ast.LtE)
+FLIP_AT = (ast.GtE, ast.Lt)
+
+
+def stateful(onskip=None):
+    """
+    Marks an observation transform that keeps state from tick to tick. On ticks where the model
+    update is skipped ChangeDriven calls onskip(features) to keep that state current, or the
+    whole transform if there is no onskip. A transform object can define an onskip method
+    instead (e.g. GANDALF's ObservationTransformer and its activity stamp).
+    """
+    def mark(fn):
+        fn.onskip = onskip if onskip is not None else fn
+        return fn
+    return mark
+
+
+class ChangeDriven:
+    """
+    Wraps a model and its observation transform. update(features, now) does what
+    model.update(transform(features)) does, but only when something can have changed.
+    inputs names the model attributes Model.update reads besides the observations.
+    """
+
+    def __init__(self, model, transform, inputs=("actionqueued", "actionrunning")):
+        self.model = model
+        self.transform = transform
+        self.onskip = getattr(transform, "onskip", None)
+        self.inputs = operator.attrgetter(*inputs)
+        # per state: its thresholds, or None to evaluate every tick
+        self.statethresholds = {}
+
+        self.version = None
+        self.state = None
+        self.observations = None
+        self.deadline = None
+        self.transitioned = False
+        # whether the last update() actually ran the model
+        self.evaluated = False
+        self.evaluations = 0
+        self.skips = 0
+
+    def __thresholdsOf(self, state):
+        if state not in self.statethresholds:
+            found = []
+            for (fn, _) in getattr(state, "the_fns", []):
+                more = thresholds(fn)
+                if more is None:
+                    found = None
+                    break
+                found.extend(more)
+            self.statethresholds[state] = found
+        return self.statethresholds[state]
+
+    def __nextDeadline(self, now, observations):
+        """
+        Earliest time a time threshold of the current state can flip, None for every tick
+        """
+        found = self.__thresholdsOf(self.model.cur_state)
+        if found is None:
+            return None
+        deadline = math.inf
+        for (col, op, c) in found:
+            v = observations[col]
+            if op in FLIP_ABOVE and v <= c:
+                deadline = min(deadline, now + math.floor(c - v) + 1)
+            elif op in FLIP_AT and v < c:
+                deadline = min(deadline, now + math.ceil(c - v))
+        return deadline
+
+    def update(self, features, now):
+        """
+        The model's observations for this tick. Returns the previous ones untouched when the
+        model would not have been able to decide anything new. Records without a version (not
+        written by a Simulator) always count as changed.
+        """
+        model = self.model
+        version = features.version
+        if self.deadline is not None and now < self.deadline and not self.transitioned \
+                and version is not None and version == self.version and self.inputs(model) == self.state:
+            if self.onskip is not None:
+                self.onskip(features)
+            self.skips += 1
+            self.evaluated = False
+            return self.observations
+
+        prev_state = model.cur_state
+        self.observations = model.update(self.transform(features))
+        self.evaluations += 1
+        self.evaluated = True
+        self.transitioned = model.cur_state is not prev_state
+        self.version = version
+        # the update can itself change the model's inputs (onStart callbacks)
+        self.state = self.inputs(model)
+        self.deadline = self.__nextDeadline(now, self.observations)
+        return self.observations
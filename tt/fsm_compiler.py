@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+#
+# Transition table compiler for tt.FSM machines. The states get numbered, and each state gets
+# a generated step function that tries its transitions in order and returns the index of the
+# next state:
+#
+#   def step_2(o):
+#       if o[7] and not o[1]:
+#           return 1
+#       return 2
+#
+# Predicates defined by an expression (see expression()) are inlined like the one above.
+# Any other predicate is called like the interpreter would call it. Either way stepping
+# never walks the (fn, state) lists, and the interpreter's DEBUG checks are skipped.
+#
+#   table = compileFSM(model)   # model.update() now goes through the table
+#   model.table = None          # back to the interpreter
+#
+
+import ast
+import functools
+
+import sim.trace as trace
+
+
+def _docstringOnly(o):
+    """
+    What a predicate defined by an expression looks like
+    """
+
+
+def expression(expr, time=()):
+    """
+    Decorator that defines a transition predicate by a one line expression over the
+    observations o. The names used in it are looked up in the predicate's module, e.g.
+
+        @expression("o[f_wants_turn] or o[f_voice_activity]")
+        def igive_otherhas(o):
+            'Someone wants the turn or is talking'
+
+    The decorated function only gives the predicate its name and docstring. The predicate is
+    generated from expr, so the interpreted FSM, the compiled table and BatchFSM all evaluate
+    the one expression. A body besides the docstring would never run, so it is refused.
+
+    time lists the observation columns that grow with the clock between two feature changes
+    (e.g. the time since the last activity). Their comparisons are the predicate's deadlines,
+    see thresholds().
+    """
+    def define(fn):
+        code = fn.__code__
+        if code.co_code != _docstringOnly.__code__.co_code or code.co_names \
+                or any(c is not None and c != fn.__doc__ for c in code.co_consts):
+            raise ValueError("%s is defined by its @expression, it can't have a body" % fn.__name__)
+        source = "lambda o: bool(%s)" % expr
+        predicate = eval(compile(source, "<expression %s>" % fn.__name__, "eval"), fn.__globals__)
+        functools.update_wrapper(predicate, fn)
+        predicate.expr = expr
+        predicate.time = tuple(int(col) for col in time)
+        return predicate
+    return define
+
+
+class FoldIndices(ast.NodeTransformer):
+    """
+    Replaces every o[index] index with its value in namespace
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    def visit_Subscript(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == "o":
+            index = eval(compile(ast.Expression(node.slice), "<expression>", "eval"), self.namespace)
+            node.slice = ast.Constant(int(index))
+            return node
+        return self.generic_visit(node)
+
+
+def foldedExpression(fn):
+    """
+    The expression of a predicate as an ast node, with o[...] indices folded to integers.
+    None when the predicate has no expression, or its expression needs anything besides o
+    and the constants it indexes with (the predicate then has to be called).
+    """
+    expr = getattr(fn, "expr", None)
+    if expr is None:
+        return None
+    try:
+        tree = FoldIndices(fn.__globals__).visit(ast.parse(expr, mode="eval"))
+    except (NameError, AttributeError):
+        return None
+    if any(isinstance(node, ast.Name) and node.id != "o" for node in ast.walk(tree)):
+        return None
+    return tree.body
+
+
+# the same comparison with its sides swapped
+MIRRORED = {ast.Gt: ast.Lt, ast.Lt: ast.Gt, ast.GtE: ast.LtE, ast.LtE: ast.GtE}
+
+
+def column(node):
+    """
+    k for an o[k] node, None for anything else
+    """
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "o" \
+            and isinstance(node.slice, ast.Constant):
+        return node.slice.value
+    return None
+
+
+def thresholds(fn):
+    """
+    [(column, comparison class, constant)] of every ordering comparison of a time column (the
+    time=... of the predicate's @expression) with a constant, the column always on the left.
+    Comparisons of the other columns only change with the features and aren't deadlines. None
+    if the predicate can't be analysed, or uses a time column in any other way.
+    """
+    folded = foldedExpression(fn)
+    if folded is None:
+        return None
+    time = getattr(fn, "time", ())
+    found = []
+    compared = set()
+    for node in ast.walk(folded):
+        if not isinstance(node, ast.Compare):
+            continue
+        operands = [node.left] + node.comparators
+        if not any(column(operand) in time for operand in operands):
+            continue
+        op = type(node.ops[0])
+        if len(node.ops) != 1 or op not in MIRRORED:
+            return None
+        (left, right) = (node.left, node.comparators[0])
+        if column(left) in time and isinstance(right, ast.Constant):
+            found.append((column(left), op, right.value))
+            compared.add(id(left))
+        elif column(right) in time and isinstance(left, ast.Constant):
+            found.append((column(right), MIRRORED[op], left.value))
+            compared.add(id(right))
+        else:
+            return None
+    # a time column read anywhere else (o[t] alone, arithmetic on it) has no deadline we know
+    if any(column(node) in time and id(node) not in compared for node in ast.walk(folded)):
+        return None
+    return found
+
+
+class TransitionTable:
+    """
+    An FSM flattened to integer states. states[i] is the FSMNode of state i, targets[i] the
+    states it can move to in the order they are tried, and steps[i](o) the generated function
+    that returns the next state index for observations o.
+    """
+
+    def __init__(self, states):
+        self.states = list(states)
+        self.index = {node: i for (i, node) in enumerate(self.states)}
+        self.targets = []
+        self.predicates = []
+        i = 0
+        # states only reachable through a transition get numbered after the ones given
+        while i < len(self.states):
+            transitions = getattr(self.states[i], "the_fns", [])
+            for (_, target) in transitions:
+                if target not in self.index:
+                    self.index[target] = len(self.states)
+                    self.states.append(target)
+            self.predicates.append([fn for (fn, _) in transitions])
+            self.targets.append([self.index[target] for (_, target) in transitions])
+            i += 1
+
+        namespace = {}
+        self.inlined = 0
+        self.source = self.__generate(namespace)
+        exec(compile(self.source, "<fsm table>", "exec"), namespace)
+        self.steps = [namespace["step_%d" % i] for i in range(len(self.states))]
+        # index of the state the machine was left in by the last update
+        self.current = 0
+
+    def __generate(self, namespace):
+        """
+        Source of the step functions. Predicates that can't be inlined are put in namespace
+        """
+        lines = []
+        for i in range(len(self.states)):
+            lines.append("def step_%d(o):" % i)
+            for (k, (fn, target)) in enumerate(zip(self.predicates[i], self.targets[i])):
+                folded = foldedExpression(fn)
+                if folded is not None:
+                    condition = ast.unparse(folded)
+                    self.inlined += 1
+                else:
+                    name = "p%d_%d" % (i, k)
+                    namespace[name] = fn
+                    condition = "%s(o)" % name
+                lines.append("    if %s:" % condition)
+                lines.append("        return %d" % target)
+            lines.append("    return %d" % i)
+            lines.append("")
+        return "\n".join(lines)
+
+    def step(self, i, observations):
+        """
+        Index of the state that state i moves to on observations, no callbacks
+        """
+        return self.steps[i](observations)
+
+    def update(self, fsm, observations):
+        """
+        FSM.update through the table: same transition, same onEnd/onStart callbacks
+        """
+        i = self.current
+        if self.states[i] is not fsm.cur_state:
+            # somebody moved the machine behind our back
+            i = self.index[fsm.cur_state]
+        j = self.steps[i](observations)
+        self.current = j
+        if j != i:
+            prev_state = self.states[i]
+            fsm.cur_state = self.states[j]
+            if trace.LEVEL >= trace.INFO:
+                trace.emit(trace.FSM_TRANSITION, i, j)
+            prev_state.onEnd()
+            fsm.cur_state.onStart()
+        return fsm.cur_state
+
+
+def compileFSM(fsm):
+    """
+    Build the transition table of fsm and make its update() use it. Returns the table
+    """
+    fsm.table = TransitionTable(fsm.all_states)
+    return fsm.table
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# Opt-in profiler for FSM models. Attaching wraps the states' nextState and transition
+# predicates of one machine, detaching puts the originals back, so a machine that isn't being
+# profiled runs exactly the code it always did.
+#
+#   profiler = FSMProfiler(model).attach()
+#   ... run ...
+#   profiler.detach()
+#   print(profiler.format())
+#
+# What gets recorded:
+#   - per predicate: how often it was evaluated, how often it fired, total time spent in it,
+#     and a histogram of how long the machine had been in the state when it fired
+#   - per state: ticks spent in it, time in nextState, and a histogram of dwell times
+#   - a from x to transition count matrix
+#
+# The histogram edges include the time thresholds of the machine's @expression predicates
+# (the 50/70/120/170 ms of GANDALF), so a bin never straddles the point where a predicate flips.
+#
+
+import bisect
+import time
+
+import numpy as np
+
+from sim.util import wallclock
+from tt.fsm_compiler import thresholds
+
+# histogram bin edges in ms; bin k counts values in [edges[k-1], edges[k])
+DWELL_EDGES_MS = [50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+
+def thresholdEdges(states):
+    """
+    The positive constants the states' @expression predicates compare against
+    """
+    found = set()
+    for node in states:
+        for (fn, _) in getattr(node, "the_fns", []):
+            for (_, _, constant) in thresholds(fn) or ():
+                if isinstance(constant, (int, float)) and not isinstance(constant, bool) and constant > 0:
+                    found.add(constant)
+    return found
+
+
+class PredicateStats:
+    """
+    Counters of one (predicate, source state, target state) transition
+    """
+
+    __slots__ = ("name", "source", "target", "evaluations", "hits", "time_ns", "latency")
+
+    def __init__(self, name, source, target, nbins):
+        self.name = name
+        self.source = source
+        self.target = target
+        self.evaluations = 0
+        self.hits = 0
+        self.time_ns = 0
+        # time in the source state when the predicate fired
+        self.latency = np.zeros(nbins, dtype=np.int64)
+
+    def hitRate(self):
+        return self.hits / self.evaluations if self.evaluations else 0.0
+
+
+class FSMProfiler:
+    """
+    Collects evaluation counts, hit rates and time per predicate, dwell time histograms per
+    state and the transition matrix of one FSM. Dwell times are measured on clock (the
+    model's clock if it has one), so they are simulated ms on a SimClock. Without edges, the
+    histograms use DWELL_EDGES_MS plus the thresholds of the machine's predicates.
+
+    While attached, a compiled transition table (tt.fsm_compiler) is switched off, the table
+    skips nextState and inlines the predicates, so there would be nothing to count.
+    """
+
+    def __init__(self, fsm, clock=None, edges=None):
+        self.fsm = fsm
+        self.clock = clock if clock is not None else getattr(fsm, "clock", wallclock)
+
+        self.states = list(fsm.all_states)
+        i = 0
+        while i < len(self.states):
+            for (_, target) in getattr(self.states[i], "the_fns", []):
+                if target not in self.states:
+                    self.states.append(target)
+            i += 1
+        if edges is None:
+            edges = sorted(set(DWELL_EDGES_MS) | thresholdEdges(self.states))
+        self.edges = edges
+        nbins = len(self.edges) + 1
+        self.index = {node: i for (i, node) in enumerate(self.states)}
+        n = len(self.states)
+
+        self.transitions = np.zeros((n, n), dtype=np.int64)
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.time_ns = np.zeros(n, dtype=np.int64)
+        self.dwell = np.zeros((n, nbins), dtype=np.int64)
+        self.predicates = []
+        for node in self.states:
+            for (fn, target) in getattr(node, "the_fns", []):
+                self.predicates.append(PredicateStats(getattr(fn, "__name__", repr(fn)), self.index[node],
+                                                      self.index[target], nbins))
+
+        self.saved = None
+        self.table = None
+        self.entered = None
+
+    def __bin(self, ms):
+        return bisect.bisect_right(self.edges, ms)
+
+    def __profiledPredicate(self, fn, stats):
+        clock = self.clock
+        perf_counter_ns = time.perf_counter_ns
+
+        def profiled(observations):
+            t_start = perf_counter_ns()
+            hit = fn(observations)
+            stats.time_ns += perf_counter_ns() - t_start
+            stats.evaluations += 1
+            if hit:
+                stats.hits += 1
+                stats.latency[self.__bin(clock.now() - self.entered)] += 1
+            return hit
+        return profiled
+
+    def __profiledNextState(self, node, nextState):
+        i = self.index[node]
+        clock = self.clock
+        perf_counter_ns = time.perf_counter_ns
+
+        def profiled(observations):
+            t_start = perf_counter_ns()
+            nxt = nextState(observations)
+            self.time_ns[i] += perf_counter_ns() - t_start
+            self.ticks[i] += 1
+            if nxt is not node:
+                now = clock.now()
+                self.transitions[i, self.index[nxt]] += 1
+                self.dwell[i, self.__bin(now - self.entered)] += 1
+                self.entered = now
+            return nxt
+        return profiled
+
+    def attach(self):
+        """
+        Start profiling. Returns the profiler
+        """
+        if self.saved is not None:
+            return self
+        self.table = self.fsm.table
+        self.fsm.table = None
+        self.saved = {}
+        stats = iter(self.predicates)
+        for node in self.states:
+            the_fns = getattr(node, "the_fns", None)
+            self.saved[node] = the_fns
+            if the_fns is not None:
+                node.the_fns = [(self.__profiledPredicate(fn, next(stats)), target) for (fn, target) in the_fns]
+            # shadows FSMNode.nextState on this node only
+            node.nextState = self.__profiledNextState(node, node.nextState)
+        if self.entered is None:
+            self.entered = self.clock.now()
+        return self
+
+    def detach(self):
+        """
+        Stop profiling and put the machine back the way it was. The counts are kept
+        """
+        if self.saved is None:
+            return
+        for (node, the_fns) in self.saved.items():
+            del node.nextState
+            if the_fns is not None:
+                node.the_fns = the_fns
+        self.fsm.table = self.table
+        self.saved = None
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def report(self):
+        """
+        Everything collected so far, as plain python values (e.g. for json)
+        """
+        names = [node.name for node in self.states]
+        return {"states": names,
+                "edges_ms": list(self.edges),
+                "ticks": self.ticks.tolist(),
+                "nextstate_ns": self.time_ns.tolist(),
+                "dwell": self.dwell.tolist(),
+                "transitions": self.transitions.tolist(),
+                "predicates": [{"name": p.name,
+                                "from": p.source,
+                                "to": p.target,
+                                "evaluations": p.evaluations,
+                                "hits": p.hits,
+                                "hit_rate": p.hitRate(),
+                                "time_ns": p.time_ns,
+                                "latency": p.latency.tolist()} for p in self.predicates]}
+
+    def format(self):
+        """
+        The report as a table for the terminal
+        """
+        names = ["%d %s" % (i, node.name) for (i, node) in enumerate(self.states)]
+        bins = ["<%d" % edge for edge in self.edges] + [">=%d" % self.edges[-1]]
+        lines = ["%-28s %9s %10s %12s" % ("predicate", "evals", "hit rate", "ns/eval")]
+        for p in sorted(self.predicates, key=lambda p: -p.time_ns):
+            lines.append("%-28s %9d %9.1f%% %12.0f" % ("%s (%d->%d)" % (p.name, p.source, p.target), p.evaluations,
+                                                        100 * p.hitRate(), p.time_ns / max(p.evaluations, 1)))
+            if p.hits:
+                lines.append("    fired after ms: " + "  ".join("%s:%d" % (b, c) for (b, c) in zip(bins, p.latency) if c))
+        lines.append("")
+        lines.append("%-28s %9s %12s" % ("state", "ticks", "ns/tick"))
+        for i in range(len(self.states)):
+            lines.append("%-28s %9d %12.0f" % (names[i], self.ticks[i], self.time_ns[i] / max(self.ticks[i], 1)))
+            if self.dwell[i].any():
+                lines.append("    dwell ms: " + "  ".join("%s:%d" % (b, c) for (b, c) in zip(bins, self.dwell[i]) if c))
+        lines.append("")
+        lines.append("transitions (row from, column to)")
+        for i in range(len(self.states)):
+            lines.append("%-28s %s" % (names[i], " ".join("%7d" % c for c in self.transitions[i])))
+        return "\n".join(lines)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+# Offline replay. Feeds recorded feature ticks through the observation transform and
+# Model.update of one or more models, with no simulator, no GUI and no sleeping. Time comes
+# from the trace, so the models see the same clock they would have seen live.
+#
+#   python -m tt.replay runs/episode-3 MP_GANDALF.Model GANDALF.Model=GANDALF.transformer_for
+#
+# A trace is either a recording directory written by sim.recorder, or a .npy / .csv file
+# with one row per tick: the time in ms followed by the FeatureRecord buffer (utterance,
+# gaze, positions, turn, scene, see sim.features). A .csv may start with a header line.
+#
+# A recording also has the robot's action flags at the end of every tick (an action queued by
+# the episode loop, an action still running until its timeout). Those are handed back to the
+# models, so the model that made a recording goes through the same states on replay.
+#
+
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from sim.features import FeatureRecord, recordSize
+from sim.recorder import META, ACTION_QUEUED, ACTION_RUNNING, Recording
+from sim.runner import load_attr, sim_adapter_for
+from sim.util import SimClock
+from tt.fsm_profile import FSMProfiler
+
+
+def npeopleFor(width):
+    """
+    How many people a trace row of width values (time included) is for
+    """
+    (npeople, rest) = divmod(width - 1 - 3, 4)
+    if rest or npeople < 1 or recordSize(npeople) + 1 != width:
+        raise ValueError("A trace row of %d values is not a time plus a feature record" % width)
+    return npeople
+
+
+def traceChunks(path, chunksize=65536):
+    """
+    Yield (npeople, t, features, actions) a chunk of ticks at a time, t an int64 array of
+    times, features an int64 array with one FeatureRecord buffer per row and actions the
+    recorded robot action columns (see sim.recorder), or None for a trace that has none.
+    Recordings and .npy files are memory-mapped and .csv files read a chunk of lines at a
+    time, so a trace never has to fit in memory.
+    """
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, META)):
+        recording = Recording(path)
+        for (start, stop) in recording.chunks(chunksize):
+            yield (recording.npeople, recording.t[start:stop], recording.features[start:stop],
+                   recording.actions[start:stop])
+
+    elif path.endswith(".npy"):
+        rows = np.load(path, mmap_mode="r")
+        npeople = npeopleFor(rows.shape[1])
+        for start in range(0, len(rows), chunksize):
+            chunk = np.asarray(rows[start:start + chunksize], dtype=np.int64)
+            yield (npeople, chunk[:, 0], chunk[:, 1:], None)
+
+    elif path.endswith(".csv"):
+        with open(path) as f:
+            first = f.readline()
+            lines = f if not first.strip() or first.lstrip()[0].isalpha() else itertools.chain([first], f)
+            while True:
+                block = list(itertools.islice(lines, chunksize))
+                if not block:
+                    break
+                chunk = np.loadtxt(block, delimiter=",", dtype=np.int64, ndmin=2)
+                yield (npeopleFor(chunk.shape[1]), chunk[:, 0], chunk[:, 1:], None)
+
+    else:
+        raise ValueError("Don't know how to replay %s, expected a recording, .npy or .csv" % path)
+
+
+class ReplayedModel:
+    """
+    One model being replayed, with its own observation transform, its tally so far and the
+    observation it was handed on the last tick
+    """
+
+    def __init__(self, model, transform):
+        self.model = model
+        self.transform = transform
+        self.state_ticks = {}
+        self.transitions = 0
+        self.ticks = 0
+        self.prev_state = model.cur_state
+        self.observation = None
+
+    def update(self, features, now, actions=None):
+        """
+        One tick. actions is the recorded (action queued, action running, ...) row of this
+        tick, which the model carries into the next one. Without it, the action timeout of
+        the live loop is applied instead.
+        """
+        model = self.model
+        observation = self.observation = model.update(self.transform(features))
+        state = model.cur_state
+        self.state_ticks[state.name] = self.state_ticks.get(state.name, 0) + 1
+        if state is not self.prev_state:
+            self.transitions += 1
+            self.prev_state = state
+        self.ticks += 1
+        if actions is not None:
+            model.actionqueued = bool(actions[ACTION_QUEUED])
+            model.actionrunning = bool(actions[ACTION_RUNNING])
+        elif model.actionrunning and now - model.action_started_at > 2000:
+            # same action timeout as the live loop
+            model.actionrunning = False
+        return observation
+
+    def summary(self):
+        return {"ticks": self.ticks,
+                "transitions": self.transitions,
+                "state_ticks": self.state_ticks,
+                "final_state": self.model.cur_state.name}
+
+
+def replay(path, model_specs, chunksize=65536, on_tick=None, setup=None):
+    """
+    Replay the trace at path through every (model_cls, adapter_for) in model_specs, side by
+    side on the same ticks, and return one summary per model. adapter_for(clock) builds the
+    observation transform as in sim.runner.
+
+    When the trace is a recording, the recorded action flags are fed back into every model
+    after each tick (see ReplayedModel.update), so a model other than the recorded one sees
+    the actions of the recorded run rather than its own.
+
+    on_tick(t, features, replayed) is called after every tick, replayed being the list of
+    ReplayedModel, e.g. to compare what state each model is in. setup(model) is called on
+    every model before the first tick, e.g. to attach a profiler.
+
+    The models all read one SimClock that follows the trace's timestamps.
+    """
+    t_start = time.perf_counter()
+    clock = None
+    replayed = None
+    record = None
+    for (npeople, t, features, actions) in traceChunks(path, chunksize):
+        if clock is None:
+            clock = SimClock(int(t[0]))
+            replayed = [ReplayedModel(model_cls(clock), adapter_for(clock)) for (model_cls, adapter_for) in model_specs]
+            if setup is not None:
+                for r in replayed:
+                    setup(r.model)
+            # rows are copied into one record, which is cheaper than wrapping each row in its own
+            record = FeatureRecord(npeople)
+        buffer = record.buffer
+        times = t.tolist()
+        rows = actions.tolist() if actions is not None else [None] * len(times)
+        for i in range(len(times)):
+            now = times[i]
+            clock.advance(now - clock.now())
+            buffer[:] = features[i]
+            for r in replayed:
+                r.update(record, now, rows[i])
+            if on_tick is not None:
+                on_tick(now, record, replayed)
+
+    summaries = [r.summary() for r in replayed] if replayed is not None else []
+    wall_s = time.perf_counter() - t_start
+    for summary in summaries:
+        summary["wall_s"] = wall_s
+    return summaries
+
+
+def parseModelSpec(spec):
+    """
+    'GANDALF.Model=GANDALF.transformer_for' -> (Model, transformer_for). Without an adapter
+    the SimFeatureAdapter is used.
+    """
+    (model, _, adapter) = spec.partition("=")
+    return (load_attr(model), load_attr(adapter) if adapter else sim_adapter_for)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded trace through one or more models")
+    parser.add_argument("trace", help="recording directory, .npy or .csv trace")
+    parser.add_argument("models", nargs="+",
+                        help="model class, optionally =adapter, e.g. GANDALF.Model=GANDALF.transformer_for")
+    parser.add_argument("--chunksize", type=int, default=65536, help="ticks read at a time")
+    parser.add_argument("--profile", action="store_true", help="print a tt.fsm_profile report per model")
+    args = parser.parse_args()
+
+    profilers = []
+    setup = (lambda model: profilers.append(FSMProfiler(model).attach())) if args.profile else None
+    specs = [parseModelSpec(spec) for spec in args.models]
+    summaries = replay(args.trace, specs, args.chunksize, setup=setup)
+    for (spec, summary) in zip(args.models, summaries):
+        summary["model"] = spec
+        print(json.dumps(summary))
+    for (spec, profiler) in zip(args.models, profilers):
+        print()
+        print(spec)
+        print(profiler.format())
+
+
+if __name__ == "__main__":
+    main()
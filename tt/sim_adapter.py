@@ -3,8 +3,11 @@
 # Turns the simulator into a 'feature observer'
 #
 
+import numpy as np
+
 import tt.fsm_adapter as fsm_adapter
-from sim.util import timems
+import sim.trace as trace
+from sim.util import wallclock
 
 
 class SimFeatureAdapter(fsm_adapter.Adapter):
@@ -12,62 +15,57 @@ class SimFeatureAdapter(fsm_adapter.Adapter):
     This adapts the simulators features to the models expected order of observations
     """
 
-    def __init__(self):
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else wallclock
         self.lastFeatures = None
+        self.nobservations = fsm_adapter.timesincelastactivity + 1
+        self.lastactivitystamp = self.clock.now()
         print("WARNING: If you use this, you will still need " +
               "to set action_queued, action_running, and lastactivity features")
 
     def transform_features(self, features_in):
         """
-        Features from the simulator in, observations for the model out
+        Features from the simulator in (a FeatureRecord, or the old list of five lists),
+        observations for the model out. Every call returns a new list, keep it as long as you like
         """
-        # break apart the chunks from the simulator features
+        # break apart the chunks of the features
         (utterancefeatures, gazefeatures, \
          posfeatures, turnfeatures, scenefeatures) = features_in
 
-        print(
-            "Utterance: " + str(utterancefeatures) + ", gaze features: " + str(gazefeatures) + ", pos features: " + str(
-                posfeatures))
+        if trace.LEVEL >= trace.DEBUG:
+            trace.emit(trace.FEATURES, utterancefeatures[1], turnfeatures[0])
         chosenpartner = 0
-        newObservation = []
+        newObservation = [-1] * self.nobservations
 
         # voice activity   (of others)
-        newObservation.append(utterancefeatures[1])
-        if (utterancefeatures[1]):
-            lastactivitystamp = timems()
+        speaking = bool(utterancefeatures[1])
+        newObservation[fsm_adapter.f_voice_activity] = speaking
+        if speaking:
+            self.lastactivitystamp = self.clock.now()
         # f_action_queued  (for me)
-        newObservation.append(-1)  # fill this in
-        # newObservation.append(self.actionqueued) #TODO
+        newObservation[fsm_adapter.f_action_queued] = -1  # fill this in
         # f_utterance_complete
-        newObservation.append(not utterancefeatures[1])  # at the moment, this is just voice_activity inverse
+        newObservation[fsm_adapter.f_utterance_complete] = not speaking  # at the moment, this is just voice_activity inverse
 
         # f_other_lookat (someone looking at me)
-        someone_looking_at_me = False
-        for p in range(len(gazefeatures)):
-            if (gazefeatures[p] == 0):
-                someone_looking_at_me = True
-        newObservation.append(someone_looking_at_me)
+        # counting nonzeros is the cheapest test on a small array, and takes lists as well
+        newObservation[fsm_adapter.f_other_lookat] = bool(np.count_nonzero(gazefeatures) < len(gazefeatures))
 
-        # f_other_presenting (someone is gesturing at me)
-        someone_gesturing_at_me = False
-        for p in range(len(scenefeatures)):
-            if (scenefeatures[p]):
-                someone_gesturing_at_me = True
-        newObservation.append(someone_gesturing_at_me)
+        # f_other_presenting (someone is gesturing at me), the gesture flags are 0 or 1
+        newObservation[fsm_adapter.f_other_presenting] = bool(np.count_nonzero(scenefeatures) > 0)
         # f_who_talking
-        newObservation.append(turnfeatures[0])
+        newObservation[fsm_adapter.f_who_talking] = int(turnfeatures[0])
         # f_running_action
-        newObservation.append(-1)  # fill this in
-        # newObservation.append(self.actionrunning)
+        newObservation[fsm_adapter.f_running_action] = -1  # fill this in
         # f_wants_turn
-        newObservation.append(newObservation[fsm_adapter.f_voice_activity] or \
-                              newObservation[fsm_adapter.f_other_presenting])
+        newObservation[fsm_adapter.f_wants_turn] = newObservation[fsm_adapter.f_voice_activity] or \
+            newObservation[fsm_adapter.f_other_presenting]
         # f_other_accepts
-        newObservation.append(newObservation[fsm_adapter.f_other_lookat] and \
-                              newObservation[fsm_adapter.f_other_presenting])
+        newObservation[fsm_adapter.f_other_accepts] = newObservation[fsm_adapter.f_other_lookat] and \
+            newObservation[fsm_adapter.f_other_presenting]
         # timesincelastactivity
-        newObservation.append(-1)  # fill this in
-        # newObservation.append(timems()-self.lastactivitystamp)
+        newObservation[fsm_adapter.timesincelastactivity] = -1  # fill this in
+        # newObservation[fsm_adapter.timesincelastactivity] = self.clock.now()-self.lastactivitystamp
 
         # print("Observation transformer output: " + str(newObservation))
         self.lastFeatures = newObservation